@@ -1,14 +1,32 @@
 import streamlit as st
 import pandas as pd
-from ultralytics import YOLO
 import os
 import shutil
-import re
-import plotly.express as px
 from PIL import Image
-import io
+import collections
+import contextlib
+import json
+import tempfile
+import time
 import zipfile
-import gdown
+
+from rcf.acervo import AcervoResultados
+from rcf.analise import analisar_zip, formatar_duracao
+from rcf.backends import BACKENDS, caminho_backend
+from rcf.cache_resultados import CacheResultados
+from rcf.exportacao import FORMATOS, ExportacoesAnalise, limpar_exportacoes
+from rcf.espacial import filtrar_trecho, marcar_repetidos, posicao
+from rcf.graficos import figura_barras_patio, figura_dispersao, figura_histograma_km
+from rcf.inferencia import ConfigFase, aplicar_threads, resolver_config
+from rcf.ingestao import ZipInvalido
+from rcf.manifesto import manifesto_diretorio, resumo_manifesto
+from rcf.metricas import Metricas, formatar_prometheus, medir
+from rcf.modelos import MODEL_F1_ID, MODEL_F2_ID, CacheModelos, fonte_por_uri
+from rcf.pipeline import triar
+from rcf.registro import registro_global
+from rcf.relatorio import analisar_nomes, listar_recortes, tabela_deteccoes
+from rcf.trabalho import DIR_TMPFS, DiretorioTrabalho, coletar_abandonados
+from rcf import tarefas
 
 # Configuração da página do Streamlit
 st.set_page_config(
@@ -67,96 +85,528 @@ with col2:
 with col3:
     st.image("riv.jpg", width=100)
 
-# --- IDs dos modelos no Google Drive ---
-MODEL_F1_ID = "10Hh3ovvDBurmD8wZYG7uRpZklMhPHo1u"
-MODEL_F2_ID = "1It73Ji3ivybC2p-8b0Lr6BIAXdn_5eyf"
+# --- Cache persistente dos modelos ---
+# RIV_FONTE_MODELOS permite trocar o Google Drive por um diretório local ou servidor de arquivos.
+# Os pesos do cache são revalidados na fonte depois de RIV_MAX_IDADE_MODELOS segundos (rcf.modelos).
+DIR_CACHE_MODELOS = os.environ.get("RIV_CACHE_MODELOS", "cache_modelos")
+FONTE_MODELOS = os.environ.get("RIV_FONTE_MODELOS", "gdrive")
+LIMITE_CACHE_MODELOS = int(os.environ.get("RIV_LIMITE_CACHE_MODELOS", 2 * 1024 ** 3))
+
+@st.cache_resource
+def obter_cache_modelos():
+    return CacheModelos(DIR_CACHE_MODELOS, fonte_por_uri(FONTE_MODELOS), limite_bytes=LIMITE_CACHE_MODELOS)
+
+# --- Cache de resultados da inferência ---
+# Imagens já analisadas com os mesmos pesos e parâmetros não voltam ao modelo.
+CAMINHO_CACHE_RESULTADOS = os.environ.get("RIV_CACHE_RESULTADOS", os.path.join("cache_resultados", "resultados.db"))
+LIMITE_CACHE_RESULTADOS = int(os.environ.get("RIV_LIMITE_CACHE_RESULTADOS", 512 * 1024 ** 2))
+
+@st.cache_resource
+def obter_cache_resultados():
+    return CacheResultados(CAMINHO_CACHE_RESULTADOS, limite_bytes=LIMITE_CACHE_RESULTADOS)
+
+# --- Acervo de resultados (Parquet particionado por Linha/Pátio/Ano-Mês) ---
+DIR_ACERVO = os.environ.get("RIV_ACERVO", "acervo")
+
+@st.cache_resource
+def obter_acervo():
+    return AcervoResultados(DIR_ACERVO)
+
+# --- Relatórios exportados (gerados uma vez por análise) ---
+DIR_EXPORTACOES = os.environ.get("RIV_EXPORTACOES", "exportacoes")
 
-path_modelo_f1 = "fase_1.pt"
-path_modelo_f2 = "fase_2.pt"
+# --- Visualização ---
+# Linhas por página na prévia das tabelas; os gráficos têm o próprio limite em rcf.graficos.
+LINHAS_POR_PAGINA = 1000
+# Resultados parciais: intervalo mínimo entre redesenhos e quantas detecções recentes mostrar.
+INTERVALO_PARCIAL_S = 2.0
+ULTIMAS_DETECCOES = 200
+
+# --- Diretórios de trabalho por execução ---
+DIR_TRABALHO_DISCO = os.environ.get("RIV_DIR_TRABALHO", tempfile.gettempdir())
+RAIZES_TRABALHO = (DIR_TMPFS, DIR_TRABALHO_DISCO)
+
+# --- Fila de análises em segundo plano ---
+DIR_TAREFAS = os.environ.get("RIV_DIR_TAREFAS", "tarefas")
+WORKERS_TAREFAS = int(os.environ.get("RIV_WORKERS", 1))
+
+@st.cache_resource
+def obter_fila_tarefas():
+    # Executado uma vez por processo do servidor: os workers vivem enquanto o servidor estiver no ar.
+    fila = tarefas.FilaTarefas(DIR_TAREFAS)
+    tarefas.iniciar_workers(WORKERS_TAREFAS, DIR_TAREFAS, DIR_CACHE_MODELOS, FONTE_MODELOS, (MODEL_F1_ID, MODEL_F2_ID),
+                            caminho_cache_resultados=CAMINHO_CACHE_RESULTADOS, dir_acervo=DIR_ACERVO)
+    return fila
 
 # --- Funções auxiliares ---
-def find_image_directory(base_dir):
+def exibir_manifesto(itens, avisos):
+    """
+    Mostra quantas imagens foram encontradas em cada pasta do upload.
+    """
+    with st.expander(f"{len(itens)} imagem(ns) encontrada(s) no upload"):
+        st.dataframe(pd.DataFrame(resumo_manifesto(itens)))
+        for aviso in avisos:
+            st.text(f"- {aviso}")
+
+def configuracao_fase(nome, padrao_imgsz, fatiar=False, leitura=False):
     """
-    Procura por um diretório que contenha arquivos de imagem em uma árvore de diretórios.
-    Retorna o caminho do diretório encontrado ou None.
+    Widgets da barra lateral com os parâmetros de inferência de uma fase.
+    Com ``fatiar``, inclui o tamanho das fatias dos recortes (fase 2); com
+    ``leitura``, a decodificação das imagens que alimentam a fase (fase 1).
     """
-    for root, dirs, files in os.walk(base_dir):
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.webp', '.bmp')):
-                return root
-    return None
+    st.markdown(f"**{nome}**")
+    lote = st.number_input(f"Lote ({nome})", min_value=0, max_value=256, value=0,
+                           help="Imagens por chamada do modelo. 0 = ajuste automático pela vazão medida.")
+    imgsz = st.number_input(f"Tamanho de entrada ({nome})", min_value=160, max_value=2048, value=padrao_imgsz, step=32)
+    threads = st.number_input(f"Threads ({nome})", min_value=0, max_value=os.cpu_count() or 1, value=0,
+                              help="Threads do PyTorch. 0 = padrão do processo.")
+    half = st.checkbox(f"Meia precisão ({nome})", value=False, help="Só tem efeito em GPU.")
+    backend = st.selectbox(f"Backend ({nome})", BACKENDS, index=0,
+                           help="ONNX Runtime e OpenVINO costumam ser mais rápidos em CPU. "
+                                "Os pesos são exportados na primeira análise e reaproveitados.")
+    fatia, deduplicar = 0, False
+    if fatiar:
+        fatia = st.number_input(f"Fatias ({nome})", min_value=0, max_value=2048, value=0, step=32,
+                                help="Divide cada recorte de trilho em fatias sobrepostas deste lado, em pixels, "
+                                     "para ver trincas finas em resolução cheia. 0 = recorte inteiro. "
+                                     "Não se aplica ao modo em disco.")
+        deduplicar = st.checkbox(f"Agrupar recortes repetidos ({nome})", value=False,
+                                 help="Recortes do mesmo trilho em quadros consecutivos (mesmo KM/Metro e imagem "
+                                      "parecida) passam uma vez pela classificação; o relatório traz o grupo de "
+                                      "cada detecção e os gráficos contam cada grupo uma vez. "
+                                      "Não se aplica ao modo em disco.")
+    decodificadores, profundidade, reduzir, triagem = 1, 0, False, 0
+    if leitura:
+        triagem = st.number_input(f"Triagem ({nome})", min_value=0, max_value=2048, value=0, step=32,
+                                  help="Tamanho de entrada de uma passada prévia, em baixa resolução, que descarta "
+                                       "as imagens sem trilho antes da detecção completa. 0 = desligada. "
+                                       "Meça a perda antes com 'python -m rcf.triagem'.")
+        decodificadores = st.number_input(f"Threads de decodificação ({nome})", min_value=1,
+                                          max_value=os.cpu_count() or 1, value=min(4, os.cpu_count() or 1),
+                                          help="Imagens decodificadas em paralelo, à frente da inferência.")
+        profundidade = st.number_input(f"Fila de leitura ({nome})", min_value=0, max_value=1024, value=0,
+                                       help="Imagens decodificadas mantidas à frente da inferência. 0 = dois lotes.")
+        reduzir = st.checkbox(f"Decodificação reduzida ({nome})", value=False,
+                              help="Decodifica os JPEGs já reduzidos para perto do tamanho de entrada dos modelos. "
+                                   "Mais rápido; recortes de trilho curtos chegam à Fase 2 com menos detalhe. "
+                                   "As caixas do relatório continuam nas coordenadas originais.")
+    return ConfigFase(lote=lote, imgsz=imgsz, threads=threads or None, half=half, backend=backend,
+                      fatia=fatia or None, deduplicar=deduplicar, decodificadores=decodificadores, profundidade=profundidade or None,
+                      reduzir=reduzir, triagem=triagem or None)
 
-def run_yolo_predictions(path_modelo_f1, path_modelo_f2, src_dir, path_res, pasta_inferencia, arq_inferencia):
+def resolver_configs(model_f1, model_f2, config_f1, config_f2):
+    """
+    Define o lote das fases configuradas como automáticas e exibe o resultado.
+    """
+    config_f1 = resolver_config(config_f1, model_f1, 'fase_1')
+    config_f2 = resolver_config(config_f2, model_f2, 'fase_2')
+    st.caption(f"Fase 1: {config_f1} | Fase 2: {config_f2}")
+    return config_f1, config_f2
+
+def run_yolo_predictions(path_modelo_f1, path_modelo_f2, src_dir, path_res, pasta_inferencia, arq_inferencia, config_f1, config_f2,
+                         metricas=None):
     """
     Executa as predições YOLO para as duas fases a partir de um diretório de origem.
     """
     with st.spinner('Executando a inferência YOLO...'):
         try:
-            source_directory = find_image_directory(src_dir)
-            if not source_directory:
+            with medir(metricas, 'manifesto'):
+                manifesto, avisos_manifesto = manifesto_diretorio(src_dir)
+            if not manifesto:
                 return "Erro: Nenhuma imagem encontrada no arquivo .zip. Por favor, verifique se as imagens estão em um formato suportado e se o arquivo .zip não está vazio."
+            exibir_manifesto(manifesto, avisos_manifesto)
 
             os.makedirs(os.path.join(path_res, pasta_inferencia), exist_ok=True)
             os.makedirs(os.path.join(path_res, arq_inferencia), exist_ok=True)
 
-            model_f1 = YOLO(path_modelo_f1)
-            model_f1.predict(source=source_directory, save=True, save_crop=True, project=path_res, name=pasta_inferencia, exist_ok=True)
+            registro = registro_global()
+            model_f1 = registro.obter('fase_1', caminho_backend(path_modelo_f1, config_f1), imgsz=config_f1.imgsz)
+            model_f2 = registro.obter('fase_2', caminho_backend(path_modelo_f2, config_f2), imgsz=config_f2.imgsz)
+            config_f1, config_f2 = resolver_configs(model_f1, model_f2, config_f1, config_f2)
+
+            caminhos = [os.path.abspath(item.caminho) for item in manifesto]
+            if config_f1.triagem:
+                descartadas = []
+                caminhos = list(triar(model_f1, caminhos, config_f1, metricas=metricas, descartadas=descartadas))
+                st.caption(f"Triagem: {len(descartadas)} de {len(manifesto)} imagem(ns) sem trilho descartada(s) "
+                           f"({len(descartadas) / len(manifesto):.1%}).")
+                if not caminhos:
+                    return "Aviso: A triagem não encontrou trilho em nenhuma imagem. Não é possível executar a Fase 2."
+
+            # Todas as pastas do upload vão para a mesma predição através de uma lista de arquivos.
+            lista_imagens = os.path.join(path_res, "imagens.txt")
+            with open(lista_imagens, "w") as f:
+                f.write("\n".join(caminhos))
+
+            aplicar_threads(config_f1.threads)
+            # No modo em disco a fase 1 inclui a gravação das imagens anotadas e dos recortes.
+            with medir(metricas, 'fase_1', imagens=len(caminhos)):
+                model_f1.predict(source=lista_imagens, save=True, save_crop=True, project=path_res, name=pasta_inferencia, exist_ok=True,
+                                 batch=config_f1.lote, **config_f1.kwargs_predict())
             
             caminho_crops = os.path.join(path_res, pasta_inferencia, 'crops', 'Trilho')
             
             if not os.path.exists(caminho_crops) or not os.listdir(caminho_crops):
                 return "Aviso: Nenhuma detecção de trilho na Fase 1. A pasta de crops está vazia. Não é possível executar a Fase 2."
 
-            model_f2 = YOLO(path_modelo_f2)
-            model_f2.predict(source=caminho_crops, save=True, save_crop=True, project=path_res, name=arq_inferencia, exist_ok=True)
+            aplicar_threads(config_f2.threads)
+            with medir(metricas, 'fase_2', imagens=len(os.listdir(caminho_crops))):
+                model_f2.predict(source=caminho_crops, save=True, save_crop=True, project=path_res, name=arq_inferencia, exist_ok=True,
+                                 batch=config_f2.lote, **config_f2.kwargs_predict())
 
             return "Inferência YOLO concluída com sucesso para ambas as fases."
         except Exception as e:
             return f"Erro durante a inferência YOLO: {e}"
 
-def processar_arquivos(diretorio_principal):
-    dados = []
-    avisos = []
-    for root, dirs, files in os.walk(diretorio_principal):
-        for file in files:
-            match = re.match(
-                r"^(?P<lim_sup>\d+)\s+-\s+(?P<lim_inf>\d+)\s*(?P<linha>[A-Z\d]+)_(?P<patio>[A-Za-z]+)_(?P<data>\d{8})_(?P<km>\d+)_(?P<metro>\d+)\.jpg$",
-                file
+def painel_parcial():
+    """
+    Cria a área da página atualizada durante a inferência e retorna o callback
+    ``ao_lote`` que a redesenha: andamento, vazão, tempo restante, contagem
+    por classificação e as detecções mais recentes.
+    """
+    area = st.empty()
+    contagem = collections.Counter()
+    ultimas = collections.deque(maxlen=ULTIMAS_DETECCOES)
+    ultimo = {'desenho': 0.0}
+
+    def ao_lote(andamento, deteccoes):
+        contagem.update(d['classe'] for d in deteccoes)
+        ultimas.extend(deteccoes)
+        agora = time.monotonic()
+        if agora - ultimo['desenho'] < INTERVALO_PARCIAL_S and andamento.feitos < andamento.total:
+            return
+        ultimo['desenho'] = agora
+        with area.container():
+            col_imagens, col_vazao, col_restante, col_deteccoes = st.columns(4)
+            col_imagens.metric("Imagens", f"{andamento.feitos}/{andamento.total}")
+            col_vazao.metric("Vazão", f"{andamento.vazao:.1f} img/s")
+            restante = andamento.restante_s
+            col_restante.metric("Tempo restante", formatar_duracao(restante) if restante is not None else "-")
+            col_deteccoes.metric("Detecções", andamento.total_deteccoes)
+            if contagem:
+                st.bar_chart(pd.Series(contagem, name="Detecções"))
+                df_parcial, _ = processar_deteccoes(list(ultimas))
+                st.caption(f"Últimas {len(ultimas)} detecção(ões):")
+                st.dataframe(df_parcial.iloc[::-1])
+
+    return ao_lote
+
+def run_yolo_em_memoria(path_modelo_f1, path_modelo_f2, arquivo_zip, config_f1, config_f2, processos=1, cache=None, metricas=None):
+    """
+    Executa as duas fases lendo as imagens diretamente do .zip e mantendo os
+    recortes de trilho em memória. Retorna a mensagem de status, a lista de
+    detecções da fase 2 e os avisos da leitura do zip.
+    Com ``processos`` > 1, ``arquivo_zip`` deve ser um caminho em disco, pois
+    cada processo abre o .zip por conta própria. Com ``cache``, só as imagens
+    ausentes do cache de resultados passam pela inferência.
+    """
+    with st.spinner('Executando a inferência YOLO (em memória)...'):
+        unidade = "Fragmentos" if processos > 1 and not config_f2.deduplicar else "Imagens"
+        barra = st.progress(0.0, text="Lendo o conteúdo do .zip...")
+        ao_lote = painel_parcial()
+        try:
+            resultado = analisar_zip(
+                path_modelo_f1, path_modelo_f2, arquivo_zip, config_f1, config_f2, processos,
+                ao_manifesto=lambda itens, avisos: exibir_manifesto(itens, []),
+                progresso=lambda feitos, total: barra.progress(feitos / total, text=f"{unidade} processados: {feitos}/{total}"),
+                cache=cache, ao_lote=ao_lote, metricas=metricas,
             )
-            
-            if not match:
-                avisos.append(f"Aviso: O arquivo '{file}' não segue o padrão esperado e foi ignorado.")
-                continue
-
-            try:
-                lim_sup = int(match.group('lim_sup'))
-                lim_inf = int(match.group('lim_inf'))
-                linha = match.group('linha')
-                patio = match.group('patio')
-                data_str = match.group('data')
-                km = int(match.group('km'))
-                metro = int(match.group('metro'))
-                
-                data_obj = pd.to_datetime(data_str, format='%Y%m%d')
-                
-                dados.append({
-                    'LIM_sup': lim_sup,
-                    'LIM_inf': lim_inf,
-                    'Linha': linha,
-                    'Pátio': patio,
-                    'Ano': data_obj.year,
-                    'Mês': data_obj.month,
-                    'Dia': data_obj.day,
-                    'KM': km,
-                    'Metro': metro,
-                    'Classificação': os.path.basename(root)
-                })
-            except (IndexError, AttributeError, ValueError) as e:
-                avisos.append(f"Erro ao processar arquivo '{file}': {e}. Foi ignorado.")
-                continue
-
-    df = pd.DataFrame(dados)
-    return df, avisos
+        except ZipInvalido as e:
+            return f"Erro: arquivo .zip rejeitado. {e}", [], []
+        except Exception as e:
+            return f"Erro durante a inferência YOLO: {e}", [], []
+
+    if not resultado.manifesto:
+        return "Erro: Nenhuma imagem encontrada no arquivo .zip. Por favor, verifique se as imagens estão em um formato suportado e se o arquivo .zip não está vazio.", [], resultado.avisos
+    if resultado.configs:
+        st.caption(f"Fase 1: {resultado.configs[0]} | Fase 2: {resultado.configs[1]}")
+    if cache is not None and not config_f2.deduplicar:
+        exibir_uso_cache(resultado, cache)
+    avisos_zip = resultado.avisos + [erro.descrever_erro() for erro in resultado.erros]
+    if resultado.total_trilhos == 0:
+        return "Aviso: Nenhuma detecção de trilho na Fase 1. Não é possível executar a Fase 2.", [], avisos_zip
+    if resultado.erros:
+        return f"Inferência YOLO concluída com {len(resultado.erros)} fragmento(s) com falha; os demais resultados foram mantidos.", resultado.deteccoes, avisos_zip
+    return "Inferência YOLO concluída com sucesso para ambas as fases.", resultado.deteccoes, avisos_zip
+
+def exibir_uso_cache(resultado, cache):
+    """
+    Mostra quantas imagens desta análise vieram do cache de resultados.
+    """
+    col_acertos, col_faltas, col_total = st.columns(3)
+    col_acertos.metric("Imagens do cache", resultado.acertos_cache)
+    col_faltas.metric("Imagens inferidas", resultado.faltas_cache)
+    estatisticas = cache.estatisticas()
+    consultas = estatisticas['acertos'] + estatisticas['faltas']
+    taxa = estatisticas['acertos'] / consultas if consultas else 0.0
+    col_total.metric("Taxa de acerto acumulada", f"{taxa:.0%}")
+    st.caption(f"Cache de resultados: {estatisticas['entradas']} imagem(ns), "
+               f"{estatisticas['bytes'] / 1024 ** 2:.1f} MB, {estatisticas['removidos']} entrada(s) removida(s) pelo limite.")
+
+def processar_arquivos(diretorio_principal):
+    """
+    Monta o DataFrame a partir da árvore de recortes da fase 2 (modo em disco).
+    """
+    return analisar_nomes(*listar_recortes(diretorio_principal))
+
+def processar_deteccoes(deteccoes):
+    """
+    Monta o DataFrame a partir das detecções do pipeline em memória, com
+    confianças e caixas além dos metadados do nome da imagem.
+    """
+    return tabela_deteccoes(deteccoes)
+
+def exibir_paginado(df, chave, linhas_por_pagina=LINHAS_POR_PAGINA):
+    """
+    Mostra o DataFrame uma página por vez, para não enviar a tabela inteira ao navegador.
+    """
+    paginas = max(1, -(-len(df) // linhas_por_pagina))
+    pagina = 1
+    if paginas > 1:
+        pagina = st.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, value=1, key=f"{chave}_pagina")
+    inicio = (pagina - 1) * linhas_por_pagina
+    st.dataframe(df.iloc[inicio:inicio + linhas_por_pagina])
+    st.caption(f"Linhas {inicio + 1} a {min(inicio + linhas_por_pagina, len(df))} de {len(df)}.")
+
+def botao_download(local, rotulo, exportacoes, formato, chave):
+    nome, mime = FORMATOS[formato]
+    with open(exportacoes.caminho_formato(formato), 'rb') as f:
+        local.download_button(label=rotulo, data=f, file_name=nome, mime=mime, key=f"{chave}_{formato}")
+
+def exibir_downloads(df, exportacoes, arquivo_zip, chave, metricas=None):
+    """
+    Botões de download servidos a partir dos arquivos exportados da análise;
+    cada formato é gerado uma única vez, nos reruns seguintes só é lido do disco.
+    """
+    with st.spinner("Gerando os relatórios..."):
+        for formato in ('csv', 'xlsx'):
+            if not exportacoes.existe(formato):
+                with medir(metricas, f"exportacao_{formato}"):
+                    exportacoes.obter(formato, df)
+    col_csv, col_xlsx = st.columns(2)
+    botao_download(col_csv, "📥 Baixar Relatório CSV", exportacoes, 'csv', chave)
+    botao_download(col_xlsx, "📥 Baixar Relatório XLSX", exportacoes, 'xlsx', chave)
+
+    with st.expander("Outros formatos"):
+        opcoes = [('csv.gz', "CSV compactado (gzip)"), ('parquet', "Parquet")]
+        if arquivo_zip is not None and 'x1_imagem' in df.columns:
+            opcoes.append(('imagens', "Imagens anotadas (.zip)"))
+        elif 'x1_imagem' in df.columns and not exportacoes.existe('imagens'):
+            st.caption("Para exportar as imagens anotadas, carregue de novo o .zip desta análise.")
+        for formato, rotulo in opcoes:
+            col_gerar, col_baixar = st.columns(2)
+            if not exportacoes.existe(formato) and col_gerar.button(f"Gerar {rotulo}", key=f"{chave}_gerar_{formato}"):
+                with st.spinner(f"Gerando {rotulo}..."), medir(metricas, f"exportacao_{formato}"):
+                    exportacoes.obter(formato, df, arquivo_zip)
+            if exportacoes.existe(formato):
+                botao_download(col_baixar, f"📥 Baixar {rotulo}", exportacoes, formato, chave)
+
+def identificar_upload(arquivo):
+    """
+    Identifica um upload do ``st.file_uploader``, para saber se o arquivo
+    carregado agora é o mesmo que produziu um resultado.
+    """
+    return (getattr(arquivo, 'file_id', None), arquivo.name, arquivo.size)
+
+def exibir_resultados(df, rejeitados, chave='resultado', exportacoes=None, arquivo_zip=None, metricas=None):
+    """
+    Prévia, downloads e gráficos do resultado. ``exportacoes`` é o
+    ``ExportacoesAnalise`` onde os relatórios são gravados; ``arquivo_zip``, o
+    .zip que foi analisado, permite exportar as imagens anotadas. O tempo das
+    exportações é somado a ``metricas``, se informado.
+    """
+    exportacoes = exportacoes or ExportacoesAnalise(DIR_EXPORTACOES, chave)
+    if not rejeitados.empty:
+        st.warning(f"{len(rejeitados)} arquivo(s) com nome fora do padrão esperado foram ignorados.")
+        with st.expander("Arquivos ignorados"):
+            exibir_paginado(rejeitados, f"{chave}_rejeitados")
+
+    if not df.empty:
+        st.success("Processamento de arquivos concluído e DataFrame gerado.")
+
+        st.subheader("Prévia do DataFrame")
+        exibir_paginado(df, chave)
+
+        st.subheader("Download dos Relatórios")
+
+        exibir_downloads(df, exportacoes, arquivo_zip, chave, metricas)
+
+        st.subheader("Análises Visuais (Plotly)")
+
+        st.markdown("### Contagem de Classificações por Pátio")
+        if 'Classificação' in df.columns and 'Pátio' in df.columns:
+            st.plotly_chart(figura_barras_patio(df), use_container_width=True)
+        else:
+            st.warning("Dados para a visualização 'Classificação por Pátio' não estão disponíveis no DataFrame.")
+
+        st.markdown("### Distribuição de Defeitos ao Longo dos KMs")
+        if 'KM' in df.columns and 'Classificação' in df.columns:
+            largura_km = st.select_slider("Faixa do histograma (KM)", options=[1, 5, 10, 50], value=1, key=f"{chave}_faixa_km")
+            st.plotly_chart(figura_histograma_km(df, largura_km), use_container_width=True)
+            fig_scatter, passo_m, tamanho, histograma = figura_dispersao(df)
+            st.plotly_chart(fig_scatter, use_container_width=True)
+            if histograma:
+                st.caption(f"Detecções demais para a dispersão; histograma por faixa de {passo_m // 1000} KM, "
+                           f"{tamanho / 1024:.0f} KB enviados ao navegador.")
+            else:
+                agregacao = f"pontos agregados em trechos de {passo_m} m" if passo_m else "um ponto por detecção"
+                st.caption(f"Dispersão com {agregacao}; {tamanho / 1024:.0f} KB enviados ao navegador.")
+        else:
+            st.warning("Dados para a visualização 'Distribuição de Defeitos' não estão disponíveis no DataFrame.")
+    else:
+        st.warning("O DataFrame está vazio. Nenhum arquivo processado ou com dados válidos.")
+
+def exibir_metricas(resumo, chave, caminho_perfil=None):
+    """
+    Painel com o tempo, a CPU, a vazão e a memória de cada etapa da análise,
+    com downloads em JSON, no formato de texto do Prometheus e do perfil do
+    ``cProfile`` (``.prof``), quando capturado.
+    """
+    if not resumo:
+        return
+    with st.expander("Métricas da execução"):
+        tabela = pd.DataFrame(resumo).set_index('etapa')
+        tabela['pico_rss_mb'] = tabela.pop('pico_rss_bytes') / 1024 ** 2
+        st.dataframe(tabela.style.format(precision=2))
+        st.caption("O pico de memória é o do processo até o fim da etapa. A CPU e a E/S do processo aparecem "
+                   "só na linha 'processo', pois as etapas se sobrepõem em threads; nas análises com vários "
+                   "processos, tempos e CPU são a soma dos processos.")
+        col_json, col_prometheus, col_perfil = st.columns(3)
+        col_json.download_button("📥 Métricas (JSON)", data=json.dumps(resumo, ensure_ascii=False, indent=2),
+                                 file_name="metricas.json", mime="application/json", key=f"{chave}_metricas_json")
+        col_prometheus.download_button("📥 Métricas (Prometheus)", data=formatar_prometheus(resumo, rotulos={'analise': chave}),
+                                       file_name="metricas.prom", mime="text/plain", key=f"{chave}_metricas_prom")
+        if caminho_perfil and os.path.exists(caminho_perfil):
+            with open(caminho_perfil, 'rb') as f:
+                col_perfil.download_button("📥 Perfil (cProfile)", data=f, file_name="perfil.prof",
+                                           mime="application/octet-stream", key=f"{chave}_perfil")
+
+def gravar_no_acervo(df, id_analise):
+    """
+    Anexa o resultado ao acervo de análises, sem interromper o relatório em caso de falha.
+    """
+    try:
+        linhas = obter_acervo().anexar(df, id_analise)
+    except Exception as e:
+        st.warning(f"Não foi possível gravar o resultado no acervo: {e}")
+        return
+    if linhas:
+        st.caption(f"{linhas} linha(s) gravada(s) no acervo (análise {id_analise}).")
+
+def exibir_acervo():
+    """
+    Consulta ao acervo de análises anteriores, filtrando por Linha, Pátio e período.
+    """
+    acervo = obter_acervo()
+    particoes = acervo.particoes()
+    if not particoes:
+        st.caption("O acervo ainda não tem análises gravadas.")
+        return
+    linhas = st.multiselect("Linha", sorted({p[0] for p in particoes}))
+    patios = st.multiselect("Pátio", sorted({p[1] for p in particoes if not linhas or p[0] in linhas}))
+    meses = sorted({p[2] for p in particoes})
+    inicio, fim = st.select_slider("Período (ano-mês)", options=meses, value=(meses[0], meses[-1])) if len(meses) > 1 else (meses[0], meses[0])
+    filtros = [('Ano_Mes', '>=', inicio), ('Ano_Mes', '<=', fim)]
+    if linhas:
+        filtros.append(('Linha', 'in', linhas))
+    if patios:
+        filtros.append(('Pátio', 'in', patios))
+    col_consultar, col_compactar = st.columns(2)
+    if col_compactar.button("Compactar acervo"):
+        st.info(f"{acervo.compactar()} partição(ões) compactada(s).")
+    if col_consultar.button("Consultar acervo"):
+        # Guardado na sessão para que os filtros abaixo não percam a consulta a cada interação.
+        st.session_state['consulta_acervo'] = acervo.consultar(filtros)
+    df = st.session_state.get('consulta_acervo')
+    if df is not None:
+        df = filtro_trecho(df, 'acervo')
+        st.success(f"{len(df)} detecção(ões) selecionada(s).")
+        st.dataframe(df)
+
+def filtro_trecho(df, chave):
+    """
+    Filtro por trecho da via (Linha, KM+Metro inicial e final) e marcação
+    dos defeitos já vistos no levantamento anterior, usando o índice espacial.
+    """
+    if df.empty:
+        return df
+    with st.expander("Filtro por trecho"):
+        linha = st.selectbox("Linha", ["(todas)"] + sorted(df['Linha'].dropna().unique()), key=f"{chave}_linha")
+        col_km_i, col_m_i, col_km_f, col_m_f = st.columns(4)
+        km_inicio = col_km_i.number_input("KM inicial", min_value=0, value=int(df['KM'].min()), key=f"{chave}_km_i")
+        metro_inicio = col_m_i.number_input("Metro inicial", min_value=0, max_value=999, value=0, key=f"{chave}_m_i")
+        km_fim = col_km_f.number_input("KM final", min_value=0, value=int(df['KM'].max()), key=f"{chave}_km_f")
+        metro_fim = col_m_f.number_input("Metro final", min_value=0, max_value=999, value=999, key=f"{chave}_m_f")
+        repetidos = st.checkbox("Marcar defeitos repetidos do levantamento anterior", key=f"{chave}_repetidos")
+        tolerancia = st.number_input("Tolerância (m)", min_value=0, max_value=1000, value=5, key=f"{chave}_tolerancia",
+                                     disabled=not repetidos)
+    if repetidos:
+        # Marcado antes do recorte do trecho, para que defeitos na borda encontrem o par do lado de fora.
+        df = marcar_repetidos(df, tolerancia)
+    if linha != "(todas)":
+        df = filtrar_trecho(df, linha, posicao(km_inicio, metro_inicio), posicao(km_fim, metro_fim))
+    return df
+
+def exibir_tarefas():
+    """
+    Lista as análises em segundo plano desta sessão com o progresso de cada uma.
+    """
+    fila = obter_fila_tarefas()
+    ids = st.session_state.get('tarefas', [])
+    if not ids:
+        st.caption("Nenhuma análise em segundo plano nesta sessão.")
+        return
+    for tarefa in fila.listar(ids):
+        col_id, col_progresso, col_acao = st.columns([1, 4, 1])
+        col_id.markdown(f"`{tarefa['id']}`  \n{tarefa['estado']}")
+        col_progresso.progress(min(max(tarefa['progresso'], 0.0), 1.0), text=tarefa['mensagem'] or "")
+        if tarefa['estado'] == tarefas.CONCLUIDA:
+            if col_acao.button("Ver resultado", key=f"ver_{tarefa['id']}"):
+                st.session_state['tarefa_exibida'] = tarefa['id']
+                st.rerun()
+        elif tarefa['estado'] == tarefas.EXECUTANDO:
+            if col_acao.button("Ver parcial", key=f"parcial_{tarefa['id']}"):
+                st.session_state['tarefa_exibida'] = tarefa['id']
+                st.rerun()
+        elif tarefa['estado'] == tarefas.FALHOU:
+            col_acao.error("Falhou")
+            with st.expander(f"Erro da tarefa {tarefa['id']}"):
+                st.code(tarefa['erro'] or "")
+
+if hasattr(st, "fragment"):
+    # Atualiza só esta parte da página a cada poucos segundos.
+    exibir_tarefas = st.fragment(run_every=5)(exibir_tarefas)
+
+def exibir_resultado_tarefa(id_tarefa):
+    fila = obter_fila_tarefas()
+    tarefa = fila.obter(id_tarefa)
+    if tarefa is None:
+        st.error(f"Tarefa '{id_tarefa}' não encontrada.")
+        return
+    if tarefa['estado'] != tarefas.CONCLUIDA:
+        st.info(f"A tarefa '{id_tarefa}' ainda não terminou ({tarefa['estado']}). {tarefa['mensagem'] or ''}")
+        parciais = fila.carregar_resultado(id_tarefa, 'deteccoes_parciais.json')
+        if parciais:
+            # Resultado parcial para triagem; sem exportações, que ficariam desatualizadas.
+            st.subheader(f"Resultado parcial da análise {id_tarefa}")
+            df, _ = processar_deteccoes(parciais)
+            st.caption(f"{len(df)} detecção(ões) até a última gravação parcial.")
+            exibir_paginado(df, f"parcial_{id_tarefa}")
+        return
+    st.subheader(f"Resultado da análise {id_tarefa}")
+    st.info(tarefa['mensagem'])
+    avisos_zip = fila.carregar_resultado(id_tarefa, 'avisos.json') or []
+    if avisos_zip:
+        with st.expander(f"Avisos da leitura do .zip ({len(avisos_zip)})"):
+            for aviso in avisos_zip:
+                st.text(f"- {aviso}")
+    deteccoes = fila.carregar_resultado(id_tarefa, 'deteccoes.json') or []
+    df, rejeitados = processar_deteccoes(deteccoes)
+    exibir_resultados(df, rejeitados, chave=f"tarefa_{id_tarefa}",
+                      exportacoes=ExportacoesAnalise(fila.dir_tarefa(id_tarefa), 'exportacoes'),
+                      arquivo_zip=os.path.join(fila.dir_tarefa(id_tarefa), 'upload.zip'))
+    exibir_metricas(fila.carregar_resultado(id_tarefa, 'metricas.json'), f"tarefa_{id_tarefa}",
+                    os.path.join(fila.dir_tarefa(id_tarefa), 'perfil.prof'))
 
 # --- NOVO FLUXO DE AUTENTICAÇÃO SIMPLES ---
 if 'authenticated' not in st.session_state:
@@ -186,107 +636,155 @@ if st.session_state['authenticated']:
 
     uploaded_zip_file = st.file_uploader("Carregue as imagens em um arquivo .zip", type=["zip"])
 
+    modo_em_memoria = st.sidebar.checkbox(
+        "Pipeline em memória", value=True,
+        help="Lê as imagens direto do .zip e passa os recortes de trilho da Fase 1 para a Fase 2, sem gravar imagens em disco."
+    )
+    with st.sidebar.expander("Configuração da inferência"):
+        config_f1 = configuracao_fase("Fase 1", 640, leitura=True)
+        config_f2 = configuracao_fase("Fase 2", 640, fatiar=True)
+        processos = st.number_input(
+            "Processos de inferência", min_value=1, max_value=os.cpu_count() or 1, value=1,
+            help="Divide as imagens entre vários processos, cada um com seus modelos. Só no pipeline em memória; "
+                 "com o agrupamento de recortes repetidos, a análise usa um processo só."
+        )
+    usar_cache_resultados = st.sidebar.checkbox(
+        "Usar cache de resultados", value=True, disabled=not modo_em_memoria,
+        help="Reaproveita as detecções de imagens já analisadas com os mesmos modelos e parâmetros. "
+             "Não se aplica com o agrupamento de recortes repetidos."
+    )
+    gravar_acervo = st.sidebar.checkbox(
+        "Gravar no acervo", value=True,
+        help="Anexa o resultado ao acervo de análises (Parquet), para consultas ao longo de vários levantamentos."
+    )
+    capturar_perfil = st.sidebar.checkbox(
+        "Capturar perfil (cProfile)", value=False,
+        help="Executa a análise sob o cProfile e oferece o arquivo .prof para download. Deixa a análise mais lenta."
+    )
+    em_segundo_plano = st.sidebar.checkbox(
+        "Executar em segundo plano", value=False, disabled=not modo_em_memoria,
+        help="Enfileira a análise e libera a página; o resultado pode ser recuperado depois pelo ID da tarefa."
+    )
+    if st.sidebar.button(
+        "Atualizar modelos",
+        help="Baixa de novo os pesos da fonte. Sem isso, o cache só os revalida depois de RIV_MAX_IDADE_MODELOS segundos."
+    ):
+        try:
+            with st.spinner("Atualizando os modelos..."):
+                cache_modelos = obter_cache_modelos()
+                versoes = [os.path.basename(cache_modelos.atualizar(model_id))[:12] for model_id in (MODEL_F1_ID, MODEL_F2_ID)]
+            st.sidebar.success(f"Modelos atualizados (fase 1: {versoes[0]}, fase 2: {versoes[1]}).")
+        except Exception as e:
+            st.sidebar.error(f"Falha ao atualizar os modelos: {e}")
+
     st.markdown("---")
 
     if st.button('Executar Análise', type='primary'):
         if not uploaded_zip_file:
             st.error("Por favor, carregue o arquivo .zip com as imagens para a análise.")
+        elif em_segundo_plano and modo_em_memoria:
+            id_tarefa = obter_fila_tarefas().enfileirar(uploaded_zip_file, {
+                'config_f1': vars(config_f1), 'config_f2': vars(config_f2), 'processos': processos,
+                'usar_cache': usar_cache_resultados, 'gravar_acervo': gravar_acervo, 'perfil': capturar_perfil,
+            })
+            st.session_state.setdefault('tarefas', []).append(id_tarefa)
+            st.success(f"Análise enfileirada. ID da tarefa: {id_tarefa}. Guarde o ID para recuperar o resultado depois.")
         else:
             st.subheader("Status da Execução")
-            
-            temp_dir = "temp_data"
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-            os.makedirs(temp_dir)
-
-            try:
-                with st.spinner("Baixando os modelos do Google Drive..."):
-                    gdown.download(id=MODEL_F1_ID, output=path_modelo_f1, quiet=True)
-                    gdown.download(id=MODEL_F2_ID, output=path_modelo_f2, quiet=True)
-                st.info("Modelos baixados com sucesso.")
-
-                src_dir = os.path.join(temp_dir, "uploaded_images")
-                os.makedirs(src_dir)
-                with zipfile.ZipFile(uploaded_zip_file, 'r') as zip_ref:
-                    zip_ref.extractall(src_dir)
-
-                st.info("Arquivos de imagens carregados e descompactados com sucesso. Iniciando a análise...")
-                
+            st.session_state.pop('resultado_atual', None)
+            metricas = Metricas(perfil=capturar_perfil)
+
+            upload_analisado = identificar_upload(uploaded_zip_file)
+            coletar_abandonados(RAIZES_TRABALHO)
+            limpar_exportacoes(DIR_EXPORTACOES)
+            cache_modelos = obter_cache_modelos()
+            # Cada execução tem seu próprio diretório; extrair o zip no modo em disco ocupa algumas vezes o seu tamanho.
+            with DiretorioTrabalho(bytes_estimados=3 * uploaded_zip_file.size, raiz_disco=DIR_TRABALHO_DISCO) as trabalho, \
+                    contextlib.ExitStack() as modelos_em_uso, metricas.capturar_perfil():
+                with st.spinner("Carregando os modelos..."), metricas.etapa('download_modelos'):
+                    # As referências impedem que a limpeza do cache remova os pesos durante a análise.
+                    path_modelo_f1 = modelos_em_uso.enter_context(cache_modelos.usar(MODEL_F1_ID))
+                    path_modelo_f2 = modelos_em_uso.enter_context(cache_modelos.usar(MODEL_F2_ID))
+                st.info("Modelos disponíveis no cache local.")
+                temp_dir = trabalho.caminho
+
                 path_res = os.path.join(temp_dir, "resultado")
-                yolo_status = run_yolo_predictions(path_modelo_f1, path_modelo_f2, src_dir, path_res, 'inferencia', 'resultado_final')
+                if modo_em_memoria:
+                    st.info("Lendo as imagens diretamente do arquivo .zip. Iniciando a análise...")
+                    arquivo_zip = uploaded_zip_file
+                    if processos > 1:
+                        arquivo_zip = os.path.join(temp_dir, "upload.zip")
+                        uploaded_zip_file.seek(0)
+                        with open(arquivo_zip, "wb") as f:
+                            shutil.copyfileobj(uploaded_zip_file, f)
+                    cache_resultados = obter_cache_resultados() if usar_cache_resultados else None
+                    yolo_status, deteccoes, avisos_zip = run_yolo_em_memoria(path_modelo_f1, path_modelo_f2, arquivo_zip, config_f1, config_f2, processos,
+                                                                             cache=cache_resultados, metricas=metricas)
+                    if avisos_zip:
+                        with st.expander(f"Avisos da leitura do .zip ({len(avisos_zip)})"):
+                            for aviso in avisos_zip:
+                                st.text(f"- {aviso}")
+                else:
+                    src_dir = trabalho.subdiretorio("uploaded_images")
+                    with metricas.etapa('extracao_zip'), zipfile.ZipFile(uploaded_zip_file, 'r') as zip_ref:
+                        zip_ref.extractall(src_dir)
+
+                    st.info("Arquivos de imagens carregados e descompactados com sucesso. Iniciando a análise...")
+                    yolo_status = run_yolo_predictions(path_modelo_f1, path_modelo_f2, src_dir, path_res, 'inferencia', 'resultado_final', config_f1, config_f2,
+                                                       metricas=metricas)
                 st.info(yolo_status)
-                
-                if "Erro" not in yolo_status and "Aviso" not in yolo_status:
+
+                with st.expander("Modelos carregados em memória"):
+                    st.dataframe(pd.DataFrame(registro_global().estatisticas()))
+
+                if "Erro" not in yolo_status and "Aviso" not in yolo_status and modo_em_memoria:
+                    with metricas.etapa('relatorio', imagens=len(deteccoes)):
+                        df, rejeitados = processar_deteccoes(deteccoes)
+                    st.session_state['resultado_atual'] = (trabalho.id, df, rejeitados, metricas, upload_analisado)
+                    if gravar_acervo:
+                        with metricas.etapa('acervo'):
+                            gravar_no_acervo(df, trabalho.id)
+                elif "Erro" not in yolo_status and "Aviso" not in yolo_status:
                     path_res_modelo = os.path.join(path_res, 'resultado_final', 'crops')
-                    
+
                     if os.path.exists(path_res_modelo):
-                        df, avisos_processamento = processar_arquivos(path_res_modelo)
-                        
-                        if avisos_processamento:
-                            st.warning("Houve avisos durante o processamento de arquivos:")
-                            for aviso in avisos_processamento:
-                                st.text(f"- {aviso}")
+                        with metricas.etapa('relatorio'):
+                            df, rejeitados = processar_arquivos(path_res_modelo)
 
-                        if not df.empty:
-                            st.success("Processamento de arquivos concluído e DataFrame gerado.")
-                            
-                            st.subheader("Prévia do DataFrame")
-                            st.dataframe(df)
-
-                            st.subheader("Download dos Relatórios")
-                            
-                            csv_buffer = io.StringIO()
-                            df.to_csv(csv_buffer, index=False)
-                            st.download_button(
-                                label="📥 Baixar Relatório CSV",
-                                data=csv_buffer.getvalue(),
-                                file_name='relatorio.csv',
-                                mime='text/csv',
-                            )
-
-                            xlsx_buffer = io.BytesIO()
-                            df.to_excel(xlsx_buffer, index=False)
-                            st.download_button(
-                                label="📥 Baixar Relatório XLSX",
-                                data=xlsx_buffer.getvalue(),
-                                file_name='relatorio.xlsx',
-                                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                            )
-                            
-                            st.subheader("Análises Visuais (Plotly)")
-
-                            st.markdown("### Contagem de Classificações por Pátio")
-                            if 'Classificação' in df.columns and 'Pátio' in df.columns:
-                                classificacao_por_patio = df.groupby(['Pátio', 'Classificação']).size().reset_index(name='Contagem')
-                                fig_bar = px.bar(classificacao_por_patio, x='Pátio', y='Contagem', color='Classificação', 
-                                                 title='Contagem de Defeitos por Pátio')
-                                st.plotly_chart(fig_bar, use_container_width=True)
-                            else:
-                                st.warning("Dados para a visualização 'Classificação por Pátio' não estão disponíveis no DataFrame.")
-                            
-                            st.markdown("### Distribuição de Defeitos ao Longo dos KMs")
-                            if 'KM' in df.columns and 'Classificação' in df.columns:
-                                fig_scatter = px.scatter(df, x='KM', y='Metro', color='Classificação', 
-                                                         title='Localização de Defeitos por KM e Metro')
-                                st.plotly_chart(fig_scatter, use_container_width=True)
-                            else:
-                                st.warning("Dados para a visualização 'Distribuição de Defeitos' não estão disponíveis no DataFrame.")
-                                
-                            
-                        else:
-                            st.warning("O DataFrame está vazio. Nenhum arquivo processado ou com dados válidos.")
+                        st.session_state['resultado_atual'] = (trabalho.id, df, rejeitados, metricas, upload_analisado)
+                        if gravar_acervo:
+                            with metricas.etapa('acervo'):
+                                gravar_no_acervo(df, trabalho.id)
                     else:
                         st.error("O diretório de resultados da Fase 2 não foi encontrado.")
-            finally:
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
-                if os.path.exists(path_modelo_f1):
-                    os.remove(path_modelo_f1)
-                if os.path.exists(path_modelo_f2):
-                    os.remove(path_modelo_f2)
-                st.info("Arquivos temporários limpos.")
-                
-                
-    
-    
-            
+            st.info("Arquivos temporários limpos.")
+            caminho_perfil = metricas.salvar_perfil(os.path.join(ExportacoesAnalise(DIR_EXPORTACOES, trabalho.id).caminho, 'perfil.prof'))
+            if not st.session_state.get('resultado_atual'):
+                # Sem resultado para exibir abaixo; as métricas ajudam a entender onde a análise parou.
+                exibir_metricas(metricas.resumo(), f"resultado_{trabalho.id}", caminho_perfil)
+
+    # O resultado fica na sessão para sobreviver aos reruns da paginação, dos filtros e dos downloads.
+    if st.session_state.get('resultado_atual'):
+        id_analise, df, rejeitados, metricas, upload_analisado = st.session_state['resultado_atual']
+        exportacoes = ExportacoesAnalise(DIR_EXPORTACOES, id_analise)
+        # As imagens anotadas só saem do mesmo .zip que produziu o resultado; trocado o upload, não há de onde tirá-las.
+        arquivo_analisado = None
+        if uploaded_zip_file is not None and identificar_upload(uploaded_zip_file) == upload_analisado:
+            arquivo_analisado = uploaded_zip_file
+        exibir_resultados(df, rejeitados, chave=f"resultado_{id_analise}",
+                          exportacoes=exportacoes, arquivo_zip=arquivo_analisado, metricas=metricas)
+        exibir_metricas(metricas.resumo(), f"resultado_{id_analise}", os.path.join(exportacoes.caminho, 'perfil.prof'))
+
+    st.markdown("---")
+    st.subheader("Análises em segundo plano")
+    id_recuperar = st.text_input("Recuperar análise pelo ID da tarefa").strip()
+    if id_recuperar and id_recuperar not in st.session_state.get('tarefas', []):
+        st.session_state.setdefault('tarefas', []).append(id_recuperar)
+        st.session_state['tarefa_exibida'] = id_recuperar
+    exibir_tarefas()
+    if st.session_state.get('tarefa_exibida'):
+        exibir_resultado_tarefa(st.session_state['tarefa_exibida'])
+
+    st.markdown("---")
+    st.subheader("Acervo de resultados")
+    exibir_acervo()
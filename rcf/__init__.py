@@ -0,0 +1,6 @@
+"""
+Componentes reutilizáveis da análise de RCF em imagens RIV.
+
+Os módulos deste pacote não dependem do Streamlit e importam as bibliotecas
+pesadas (ultralytics, torch) apenas quando realmente necessárias.
+"""
@@ -0,0 +1,8 @@
+"""
+``python -m rcf``: análise de levantamentos pela linha de comando (ver ``rcf.levantamento``).
+"""
+import sys
+
+from rcf.levantamento import main
+
+sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Acervo persistente dos resultados, em Parquet particionado.
+
+Cada análise concluída é anexada ao acervo como um arquivo por partição,
+em ``<raiz>/Linha=<linha>/Pátio=<pátio>/Ano_Mes=<AAAA-MM>/<id_analise>.parquet``
+(partições no estilo Hive). Consultas com filtros sobre Linha, Pátio ou período
+leem só as pastas envolvidas, e os filtros nas demais colunas usam as
+estatísticas dos grupos de linhas (dados ordenados por KM e Metro). A
+compactação junta os vários arquivos pequenos de cada partição em um só.
+"""
+import os
+import urllib.parse
+import uuid
+
+from rcf.relatorio import CATEGORICAS, COLUNAS, COLUNAS_DETECCAO
+
+PARTICOES = ('Linha', 'Pátio', 'Ano_Mes')
+COLUNAS_ACERVO = COLUNAS + COLUNAS_DETECCAO + ['id_analise', 'Ano_Mes']
+LINHAS_POR_GRUPO = 128 * 1024
+
+
+def _esquema():
+    import pyarrow as pa
+    tipos = {
+        'LIM_sup': pa.int32(), 'LIM_inf': pa.int32(), 'Linha': pa.string(), 'Pátio': pa.string(),
+        'Ano': pa.int16(), 'Mês': pa.int8(), 'Dia': pa.int8(), 'KM': pa.int32(), 'Metro': pa.int32(),
+        'Classificação': pa.dictionary(pa.int32(), pa.string()),
+        'id_deteccao': pa.int64(), 'id_trilho': pa.int64(), 'imagem': pa.string(), 'nome_recorte': pa.string(),
+        'grupo': pa.string(), 'indice_trilho': pa.int16(), 'id_analise': pa.string(), 'Ano_Mes': pa.string(),
+    }
+    return pa.schema([(coluna, tipos.get(coluna, pa.float32())) for coluna in COLUNAS_ACERVO])
+
+
+def ano_mes(ano, mes):
+    return f"{int(ano):04d}-{int(mes):02d}"
+
+
+def filtros_periodo(inicio=None, fim=None):
+    """
+    Filtros de partição para um intervalo de meses (``(ano, mês)`` inclusivos).
+    """
+    filtros = []
+    if inicio is not None:
+        filtros.append(('Ano_Mes', '>=', ano_mes(*inicio)))
+    if fim is not None:
+        filtros.append(('Ano_Mes', '<=', ano_mes(*fim)))
+    return filtros
+
+
+class AcervoResultados:
+    """
+    Conjunto de dados Parquet com os resultados de todas as análises gravadas.
+
+    - ``raiz``: diretório do acervo.
+    """
+    def __init__(self, raiz):
+        self.raiz = raiz
+        os.makedirs(raiz, exist_ok=True)
+
+    def _dir_particao(self, chave):
+        partes = [f"{nome}={urllib.parse.quote(str(valor), safe='')}" for nome, valor in zip(PARTICOES, chave)]
+        return os.path.join(self.raiz, *partes)
+
+    def _gravar(self, tabela, destino):
+        # Grava com prefixo '.' (ignorado pelos leitores) e publica com troca atômica.
+        import pyarrow.parquet as pq
+        temporario = os.path.join(os.path.dirname(destino), f".{uuid.uuid4().hex}.parquet")
+        pq.write_table(tabela, temporario, row_group_size=LINHAS_POR_GRUPO, compression='zstd')
+        os.replace(temporario, destino)
+
+    def anexar(self, df, id_analise):
+        """
+        Anexa o resultado de uma análise (DataFrame de ``tabela_deteccoes`` ou
+        ``analisar_nomes``). Anexar de novo o mesmo ``id_analise`` substitui os
+        arquivos anteriores dele, enquanto a partição não for compactada.
+        Retorna o número de linhas gravadas.
+        """
+        import pyarrow as pa
+        if df.empty:
+            return 0
+        esquema = _esquema()
+        dados = df.reindex(columns=COLUNAS_ACERVO)
+        dados['id_analise'] = id_analise
+        dados['Ano_Mes'] = dados['Ano'].astype(int).map('{:04d}'.format) + '-' + dados['Mês'].astype(int).map('{:02d}'.format)
+        for coluna in ('Linha', 'Pátio', 'imagem', 'grupo'):
+            dados[coluna] = dados[coluna].astype(object).where(dados[coluna].notna(), None)
+        esquema_arquivo = pa.schema([campo for campo in esquema if campo.name not in PARTICOES])
+        for chave, grupo in dados.groupby(list(PARTICOES), observed=True, sort=False):
+            grupo = grupo.sort_values(['KM', 'Metro'], kind='stable').drop(columns=list(PARTICOES))
+            tabela = pa.Table.from_pandas(grupo, schema=esquema_arquivo, preserve_index=False)
+            destino_dir = self._dir_particao(chave)
+            os.makedirs(destino_dir, exist_ok=True)
+            self._gravar(tabela, os.path.join(destino_dir, f"{id_analise}.parquet"))
+        return len(dados)
+
+    def consultar(self, filtros=None, colunas=None):
+        """
+        Lê o acervo como DataFrame. ``filtros`` segue o formato do
+        ``pyarrow.parquet`` (ex.: ``[('Linha', '=', 'MRS01'), ('KM', '>=', 120)]``);
+        filtros sobre ``PARTICOES`` descartam pastas inteiras sem abri-las.
+        """
+        import pyarrow.parquet as pq
+        esquema = _esquema()
+        if self.particoes():
+            tabela = pq.read_table(self.raiz, schema=esquema, filters=filtros or None, columns=colunas, partitioning='hive')
+        else:
+            tabela = esquema.empty_table().select(colunas or esquema.names)
+        df = tabela.to_pandas()
+        for coluna in CATEGORICAS:
+            if coluna in df.columns:
+                df[coluna] = df[coluna].astype('category')
+        return df
+
+    def particoes(self):
+        """
+        Lista as partições existentes como tuplas ``(linha, pátio, ano_mes)``,
+        só a partir dos nomes das pastas.
+        """
+        encontradas = []
+        for raiz, dirs, files in os.walk(self.raiz):
+            dirs[:] = [d for d in dirs if not d.startswith(('.', '_'))]
+            relativo = os.path.relpath(raiz, self.raiz)
+            partes = relativo.split(os.sep) if relativo != '.' else []
+            if len(partes) == len(PARTICOES) and any(f.endswith('.parquet') and not f.startswith('.') for f in files):
+                encontradas.append(tuple(urllib.parse.unquote(p.split('=', 1)[1]) for p in partes))
+        return sorted(encontradas)
+
+    def compactar(self, minimo_arquivos=2):
+        """
+        Junta os arquivos de cada partição com ao menos ``minimo_arquivos``
+        arquivos em um único arquivo ordenado por KM e Metro. Retorna o número
+        de partições compactadas.
+
+        O arquivo novo é publicado antes de os antigos serem removidos; uma
+        leitura concorrente nesse intervalo pode ver linhas em dobro.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        compactadas = 0
+        for chave in self.particoes():
+            destino_dir = self._dir_particao(chave)
+            arquivos = sorted(
+                os.path.join(destino_dir, f) for f in os.listdir(destino_dir)
+                if f.endswith('.parquet') and not f.startswith('.')
+            )
+            if len(arquivos) < minimo_arquivos:
+                continue
+            tabela = pa.concat_tables(pq.read_table(arquivo, partitioning=None) for arquivo in arquivos)
+            tabela = tabela.sort_by([('KM', 'ascending'), ('Metro', 'ascending')])
+            self._gravar(tabela, os.path.join(destino_dir, f"compactado-{uuid.uuid4().hex[:12]}.parquet"))
+            for arquivo in arquivos:
+                os.remove(arquivo)
+            compactadas += 1
+        return compactadas
@@ -0,0 +1,366 @@
+"""
+Orquestração da análise de um .zip (ou diretório): manifesto, fase 1 e fase 2.
+
+Usado tanto pelo app (execução imediata) quanto pelos workers da fila de
+tarefas; não depende do Streamlit. O andamento é informado por callbacks.
+"""
+import itertools
+import threading
+import time
+import zipfile
+
+from rcf.backends import caminho_backend
+from rcf.cache_resultados import com_nomes, parametros_deteccao, sha256_bytes, versao_modelos
+from rcf.inferencia import ConfigFase, resolver_config
+from rcf.ingestao import decodificar_itens, iterar_bytes_arquivos, iterar_bytes_zip, manifesto_zip, pre_carregar
+from rcf.manifesto import manifesto_diretorio
+from rcf.metricas import medir
+from rcf.paralelo import executar_paralelo
+from rcf.pipeline import iterar_duas_fases, lado_decodificacao, reescalar_deteccoes
+from rcf.registro import registro_global
+
+# Imagens hasheadas por consulta ao cache de resultados durante a leitura.
+TAMANHO_BLOCO_CACHE = 32
+
+
+class ResultadoAnalise:
+    """
+    Resultado de uma análise: detecções da fase 2, número de recortes de
+    trilho, manifesto das imagens, avisos, erros de fragmentos e o uso do
+    cache de resultados (imagens atendidas pelo cache / enviadas ao modelo).
+    """
+    def __init__(self, deteccoes, total_trilhos, manifesto, avisos, erros=None, configs=None,
+                 acertos_cache=0, faltas_cache=0):
+        self.deteccoes = deteccoes
+        self.total_trilhos = total_trilhos
+        self.manifesto = manifesto
+        self.avisos = avisos
+        self.erros = erros or []
+        self.configs = configs
+        self.acertos_cache = acertos_cache
+        self.faltas_cache = faltas_cache
+
+
+class Andamento:
+    """
+    Andamento de uma análise, passado a ``ao_lote`` a cada lote concluído:
+    imagens processadas, vazão, tempo restante estimado e detecções até agora.
+    Imagens atendidas pelo cache (``do_cache``) contam como feitas, mas não
+    entram na vazão.
+    """
+    def __init__(self, total):
+        self.total = total
+        self.feitos = 0
+        self.do_cache = 0
+        self.total_deteccoes = 0
+        self._inicio = time.monotonic()
+
+    @property
+    def decorrido_s(self):
+        return time.monotonic() - self._inicio
+
+    @property
+    def vazao(self):
+        """
+        Imagens inferidas por segundo.
+        """
+        inferidas = self.feitos - self.do_cache
+        decorrido = self.decorrido_s
+        return inferidas / decorrido if inferidas > 0 and decorrido > 0 else 0.0
+
+    @property
+    def restante_s(self):
+        return (self.total - self.feitos) / self.vazao if self.vazao else None
+
+
+def descrever_andamento(andamento):
+    """
+    Resumo de uma linha do andamento, para mensagens de progresso.
+    """
+    partes = [f"{andamento.feitos} de {andamento.total} imagem(ns)"]
+    if andamento.vazao:
+        partes.append(f"{andamento.vazao:.1f} imagem(ns)/s")
+    if andamento.restante_s is not None and andamento.feitos < andamento.total:
+        partes.append(f"restam ~{formatar_duracao(andamento.restante_s)}")
+    partes.append(f"{andamento.total_deteccoes} detecção(ões)")
+    return " · ".join(partes)
+
+
+def formatar_duracao(segundos):
+    minutos, segundos = divmod(int(round(segundos)), 60)
+    horas, minutos = divmod(minutos, 60)
+    if horas:
+        return f"{horas}h{minutos:02d}min"
+    return f"{minutos}min{segundos:02d}s" if minutos else f"{segundos}s"
+
+
+def _notificar(andamento, ao_lote, deteccoes):
+    andamento.total_deteccoes += len(deteccoes)
+    if ao_lote is not None:
+        ao_lote(andamento, deteccoes)
+
+
+def _contar(imagens, progresso, andamento, consulta=None, intervalo=16):
+    informados = 0
+    for item in imagens:
+        yield item
+        andamento.feitos += 1
+        if consulta is not None:
+            consulta.entregar()
+        if progresso is not None and (andamento.feitos - informados >= intervalo or andamento.feitos == andamento.total):
+            informados = andamento.feitos
+            progresso(andamento.feitos, andamento.total)
+
+
+class _ConsultaCache:
+    """
+    Consulta o cache de resultados durante a leitura das imagens, em blocos de
+    ``TAMANHO_BLOCO_CACHE``: ``filtrar`` calcula o SHA-256 dos bytes lidos e só
+    deixa passar as imagens ausentes do cache, cujos hashes ficam em ``shas``
+    para a gravação ao final, junto com os recortes de trilho de cada uma
+    (``trilhos_por_imagem``, preenchido pela inferência). ``trilhos`` soma os
+    recortes de trilho das imagens encontradas.
+
+    As detecções dos acertos são entregues a ``ao_lote`` (e contadas no
+    ``andamento``) pela thread que criou a consulta. Quando a leitura roda na
+    thread de pré-carga, elas aguardam até essa thread chamar ``entregar``.
+    """
+    def __init__(self, cache, versao, parametros, andamento, ao_lote, metricas):
+        self.cache = cache
+        self.versao = versao
+        self.parametros = parametros
+        self.andamento = andamento
+        self.ao_lote = ao_lote
+        self.metricas = metricas
+        self.shas = {}
+        self.trilhos_por_imagem = {}
+        self.deteccoes = []
+        self.acertos = 0
+        self.trilhos = 0
+        self._a_entregar = []
+        self._lock = threading.Lock()
+        self._thread = threading.get_ident()
+
+    def filtrar(self, itens):
+        bloco = []
+        for item in itens:
+            bloco.append(item)
+            if len(bloco) == TAMANHO_BLOCO_CACHE:
+                yield from self._consultar(bloco)
+                bloco = []
+        yield from self._consultar(bloco)
+
+    def _consultar(self, bloco):
+        if not bloco:
+            return
+        with medir(self.metricas, 'cache_consulta', imagens=len(bloco), bytes_lidos=sum(len(dados) for _, dados in bloco)):
+            shas = [sha256_bytes(dados) for _, dados in bloco]
+            encontrados = self.cache.consultar(shas, self.versao, self.parametros)
+        faltas = []
+        with self._lock:
+            for (nome, dados), sha in zip(bloco, shas):
+                if sha in encontrados:
+                    self._a_entregar.append((nome, encontrados[sha]))
+                else:
+                    self.shas[nome] = sha
+                    faltas.append((nome, dados))
+        if threading.get_ident() == self._thread:
+            self.entregar()
+        yield from faltas
+
+    def entregar(self):
+        with self._lock:
+            acertos, self._a_entregar = self._a_entregar, []
+        if not acertos:
+            return
+        deteccoes = [com_nomes(deteccao, nome) for nome, (deteccoes, _) in acertos for deteccao in deteccoes]
+        self.deteccoes.extend(deteccoes)
+        self.acertos += len(acertos)
+        self.trilhos += sum(trilhos for _, (_, trilhos) in acertos)
+        self.andamento.feitos += len(acertos)
+        self.andamento.do_cache += len(acertos)
+        _notificar(self.andamento, self.ao_lote, deteccoes)
+
+
+def _ler_bytes(arquivo_zip, manifesto):
+    # Sem .zip, o manifesto é de um diretório e os caminhos são arquivos em disco.
+    if arquivo_zip is None:
+        return iterar_bytes_arquivos(manifesto)
+    return iterar_bytes_zip(arquivo_zip, manifesto=manifesto)
+
+
+def _inferir(path_modelo_f1, path_modelo_f2, arquivo_zip, manifesto, config_f1, config_f2, processos, progresso,
+             andamento, ao_lote, metricas, consulta=None):
+    """
+    Executa as duas fases sobre as imagens do manifesto; com ``consulta``
+    (``_ConsultaCache``), só sobre as ausentes do cache de resultados.
+    Retorna ``(deteccoes, total_trilhos, avisos, erros, falhas, configs)``.
+    """
+    avisos = []
+    trilhos_por_imagem = consulta.trilhos_por_imagem if consulta is not None else None
+    if processos > 1 and config_f2.deduplicar:
+        # Cada fragmento agruparia só os próprios recortes, e o resultado dependeria da divisão.
+        avisos.append("Aviso: o agrupamento de recortes repetidos roda em um único processo; "
+                      f"os {processos} processos pedidos foram ignorados.")
+        processos = 1
+
+    itens = _ler_bytes(arquivo_zip, manifesto)
+    if consulta is not None:
+        itens = consulta.filtrar(itens)
+        if processos > 1:
+            # Os processos leem as imagens por conta própria; aqui só se separam as ausentes do cache.
+            faltas = {nome for nome, _ in itens}
+            manifesto = [item for item in manifesto if item.caminho in faltas]
+        else:
+            # A leitura segue na thread de pré-carga a partir da primeira imagem ausente do cache.
+            primeira = next(itens, None)
+            if primeira is None:
+                manifesto = []
+            else:
+                itens = itertools.chain([primeira], itens)
+        if not manifesto:
+            # Tudo veio do cache: os modelos nem são carregados.
+            return [], 0, avisos, [], [], (config_f1, config_f2)
+
+    # Com ONNX/OpenVINO, os pesos são exportados aqui (uma vez) antes de os processos os carregarem.
+    with medir(metricas, 'exportacao_modelos'):
+        path_modelo_f1 = caminho_backend(path_modelo_f1, config_f1)
+        path_modelo_f2 = caminho_backend(path_modelo_f2, config_f2)
+    if processos > 1:
+        def ao_concluir(resultado, feitos, total):
+            andamento.feitos += len(resultado.caminhos)
+            _notificar(andamento, ao_lote, resultado.deteccoes if resultado.erro is None else [])
+            if progresso is not None:
+                progresso(feitos, total)
+
+        deteccoes, total_trilhos, avisos_paralelo, erros, falhas = executar_paralelo(
+            path_modelo_f1, path_modelo_f2, [item.caminho for item in manifesto], origem=arquivo_zip,
+            processos=processos, config_f1=config_f1, config_f2=config_f2, ao_concluir=ao_concluir, metricas=metricas,
+            trilhos_por_imagem=trilhos_por_imagem,
+        )
+        return deteccoes, total_trilhos, avisos + avisos_paralelo, erros, falhas, (config_f1, config_f2)
+
+    registro = registro_global()
+    with medir(metricas, 'carga_modelos'):
+        model_f1 = registro.obter('fase_1', path_modelo_f1, imgsz=config_f1.imgsz)
+        model_f2 = registro.obter('fase_2', path_modelo_f2, imgsz=config_f2.imgsz)
+        config_f1 = resolver_config(config_f1, model_f1, 'fase_1')
+        config_f2 = resolver_config(config_f2, model_f2, 'fase_2')
+
+    falhas, escalas = [], {}
+    imagens = pre_carregar(
+        decodificar_itens(itens, avisos=avisos, falhas=falhas, metricas=metricas,
+                          threads=config_f1.decodificadores, lado_minimo=lado_decodificacao(config_f1, config_f2),
+                          escalas=escalas),
+        profundidade=config_f1.profundidade_leitura(), metricas=metricas,
+    )
+    deteccoes, total_trilhos = [], 0
+    for novas, trilhos in iterar_duas_fases(
+        model_f1, model_f2, _contar(imagens, progresso, andamento, consulta), config_f1, config_f2,
+        metricas=metricas, trilhos_por_imagem=trilhos_por_imagem,
+    ):
+        reescalar_deteccoes(novas, escalas)
+        deteccoes.extend(novas)
+        total_trilhos += trilhos
+        _notificar(andamento, ao_lote, novas)
+        if consulta is not None:
+            consulta.entregar()
+    return deteccoes, total_trilhos, avisos, [], falhas, (config_f1, config_f2)
+
+
+def analisar_zip(path_modelo_f1, path_modelo_f2, arquivo_zip, config_f1=None, config_f2=None, processos=1,
+                 ao_manifesto=None, progresso=None, cache=None, ao_lote=None, metricas=None):
+    """
+    Executa as duas fases sobre todas as imagens do .zip.
+
+    - ``arquivo_zip``: caminho ou objeto de arquivo; com ``processos`` > 1 deve
+      ser um caminho em disco, pois cada processo abre o .zip por conta própria.
+      Com ``config_f2.deduplicar``, a análise roda em um processo só (com aviso):
+      o agrupamento precisa ver todos os recortes.
+    - ``ao_manifesto(itens, avisos)``: chamado depois da descoberta das imagens.
+    - ``progresso(feitos, total)``: andamento em imagens (ou fragmentos, no modo paralelo).
+    - ``cache``: ``CacheResultados`` opcional; imagens já analisadas com os
+      mesmos modelos e parâmetros não passam pela inferência. A consulta
+      acontece na mesma leitura que alimenta a decodificação, em blocos.
+      Ignorado com ``config_f2.deduplicar``: o grupo de cada recorte depende
+      das demais imagens da análise.
+    - ``ao_lote(andamento, deteccoes)``: chamado a cada lote concluído (e a
+      cada bloco de imagens encontradas no cache) com o ``Andamento`` e as
+      detecções novas, para exibir resultados parciais.
+    - ``metricas``: ``Metricas`` opcional, com o tempo de cada etapa.
+
+    Lança ``ZipInvalido`` se o .zip violar os limites.
+    """
+    config_f1 = config_f1 or ConfigFase()
+    config_f2 = config_f2 or ConfigFase()
+
+    with medir(metricas, 'manifesto'), zipfile.ZipFile(arquivo_zip, 'r') as zip_ref:
+        manifesto, avisos = manifesto_zip(zip_ref)
+    return _analisar(path_modelo_f1, path_modelo_f2, arquivo_zip, manifesto, avisos, config_f1, config_f2, processos,
+                     ao_manifesto, progresso, cache, ao_lote, metricas)
+
+
+def analisar_diretorio(path_modelo_f1, path_modelo_f2, diretorio, config_f1=None, config_f2=None, processos=1,
+                       ao_manifesto=None, progresso=None, cache=None, ao_lote=None, metricas=None):
+    """
+    Como ``analisar_zip``, para as imagens de uma árvore de diretórios. As
+    detecções têm em ``imagem`` o caminho do arquivo.
+    """
+    config_f1 = config_f1 or ConfigFase()
+    config_f2 = config_f2 or ConfigFase()
+    with medir(metricas, 'manifesto'):
+        manifesto, avisos = manifesto_diretorio(diretorio)
+    return _analisar(path_modelo_f1, path_modelo_f2, None, manifesto, avisos, config_f1, config_f2, processos,
+                     ao_manifesto, progresso, cache, ao_lote, metricas)
+
+
+def _analisar(path_modelo_f1, path_modelo_f2, arquivo_zip, manifesto, avisos, config_f1, config_f2, processos,
+              ao_manifesto, progresso, cache, ao_lote, metricas):
+    if ao_manifesto is not None:
+        ao_manifesto(manifesto, avisos)
+    if not manifesto:
+        return ResultadoAnalise([], 0, manifesto, avisos)
+
+    if cache is not None and config_f2.deduplicar:
+        # O grupo de um recorte depende das outras imagens da análise, não só do conteúdo da imagem.
+        avisos = avisos + ["Aviso: o cache de resultados não é usado com o agrupamento de recortes repetidos."]
+        cache = None
+
+    andamento = Andamento(len(manifesto))
+    consulta = None
+    if cache is not None:
+        # Cada imagem é hasheada e consultada no cache na mesma leitura que alimenta a decodificação.
+        consulta = _ConsultaCache(cache, versao_modelos(path_modelo_f1, path_modelo_f2),
+                                  parametros_deteccao(config_f1, config_f2), andamento, ao_lote, metricas)
+
+    deteccoes, total_trilhos, avisos_inferencia, erros, falhas, configs = _inferir(
+        path_modelo_f1, path_modelo_f2, arquivo_zip, manifesto, config_f1, config_f2, processos, progresso,
+        andamento, ao_lote, metricas, consulta,
+    )
+    deteccoes_cache = []
+    if consulta is not None:
+        consulta.entregar()
+        deteccoes_cache = consulta.deteccoes
+    andamento.feitos = andamento.total
+    _notificar(andamento, ao_lote, [])
+
+    if consulta is not None and consulta.shas:
+        nao_processadas = set(falhas).union(*(erro.caminhos for erro in erros))
+        por_imagem = {nome: [] for nome in consulta.shas if nome not in nao_processadas}
+        for deteccao in deteccoes:
+            por_imagem[deteccao['imagem']].append(deteccao)
+        with medir(metricas, 'cache_gravacao'):
+            cache.gravar({consulta.shas[nome]: (dets, consulta.trilhos_por_imagem.get(nome, 0))
+                          for nome, dets in por_imagem.items()},
+                         consulta.versao, consulta.parametros)
+
+    # Ordem final do manifesto, independente de a imagem ter vindo do cache ou do modelo.
+    ordem = {item.caminho: i for i, item in enumerate(manifesto)}
+    todas = sorted(deteccoes_cache + deteccoes, key=lambda d: ordem.get(d['imagem'], len(ordem)))
+    if consulta is not None:
+        total_trilhos += consulta.trilhos
+    return ResultadoAnalise(
+        todas, total_trilhos, manifesto, avisos + avisos_inferencia, erros, configs,
+        acertos_cache=consulta.acertos if consulta is not None else 0,
+        faltas_cache=len(consulta.shas) if consulta is not None else 0,
+    )
@@ -0,0 +1,234 @@
+"""
+Backends de inferência em CPU: PyTorch, ONNX Runtime e OpenVINO.
+
+Os pesos ``.pt`` são exportados uma única vez por backend, tamanho de
+entrada e precisão, e o artefato fica ao lado dos pesos, com o hash do
+conteúdo no nome (``<sha256>.onnx-<imgsz>-fp32.onnx``,
+``<sha256>.openvino-<imgsz>-fp16_openvino_model/``).
+No cache de modelos o nome dos pesos já é o hash, e a limpeza do cache
+remove os artefatos junto com a versão. O ultralytics carrega o artefato com
+a mesma API de ``predict``, então o restante do pipeline não muda.
+
+A verificação de paridade roda as duas fases com dois backends sobre uma
+amostra e casa as detecções por imagem, classe e sobreposição das caixas::
+
+    python -m rcf.backends amostra.zip --modelo-f1 f1.pt --modelo-f2 f2.pt --backend onnx
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import uuid
+
+BACKENDS = ('pytorch', 'onnx', 'openvino')
+PADRAO_SHA = re.compile(r'^[0-9a-f]{64}$')
+
+# Tolerâncias da paridade: sobreposição mínima (IoU) para casar duas caixas,
+# diferença máxima de confiança e fração mínima de detecções casadas.
+IOU_MINIMO = 0.9
+DIFERENCA_CONF = 0.05
+FRACAO_CASADA = 0.98
+
+
+def _sha_pesos(caminho_pt):
+    # No cache de modelos o nome do arquivo já é o SHA-256 do conteúdo.
+    stem = os.path.splitext(os.path.basename(caminho_pt))[0]
+    if PADRAO_SHA.match(stem):
+        return stem
+    from rcf.modelos import calcular_sha256
+    return calcular_sha256(caminho_pt)
+
+
+def caminho_exportado(caminho_pt, backend, imgsz, half=False):
+    """
+    Caminho do artefato de ``backend`` para os pesos ``caminho_pt`` exportados
+    com ``imgsz``, em meia precisão (``half``) ou não.
+    """
+    nome = f"{_sha_pesos(caminho_pt)}.{backend}-{imgsz}-{'fp16' if half else 'fp32'}"
+    base = os.path.join(os.path.dirname(os.path.abspath(caminho_pt)), nome)
+    return f"{base}.onnx" if backend == 'onnx' else f"{base}_openvino_model"
+
+
+def exportar(caminho_pt, backend, imgsz=640, half=False):
+    """
+    Exporta os pesos para ``backend`` se o artefato ainda não existir e
+    retorna o caminho dele. A exportação acontece em um diretório temporário
+    e o artefato é publicado com ``os.replace``; se outro processo publicar
+    antes, o dele é usado.
+    """
+    if backend not in BACKENDS or backend == 'pytorch':
+        raise ValueError(f"Backend de exportação inválido: '{backend}'.")
+    destino = caminho_exportado(caminho_pt, backend, imgsz, half)
+    if os.path.exists(destino):
+        return destino
+
+    from ultralytics import YOLO
+    temporario = os.path.join(os.path.dirname(destino), f".export-{uuid.uuid4().hex}")
+    os.makedirs(temporario)
+    try:
+        # O ultralytics grava o artefato ao lado dos pesos; um link no diretório temporário evita copiá-los.
+        pesos = os.path.join(temporario, 'modelo.pt')
+        try:
+            os.symlink(os.path.abspath(caminho_pt), pesos)
+        except OSError:
+            shutil.copyfile(caminho_pt, pesos)
+        formato = 'onnx' if backend == 'onnx' else 'openvino'
+        artefato = YOLO(pesos).export(format=formato, imgsz=imgsz, dynamic=True, half=half, verbose=False)
+        try:
+            os.replace(artefato, destino)
+        except OSError:
+            if not os.path.exists(destino):
+                raise
+    finally:
+        shutil.rmtree(temporario, ignore_errors=True)
+    return destino
+
+
+def caminho_backend(caminho_pt, config):
+    """
+    Caminho a carregar para a fase configurada em ``config`` (``ConfigFase``):
+    os próprios pesos no PyTorch ou o artefato exportado nos demais backends.
+    """
+    backend = getattr(config, 'backend', 'pytorch') or 'pytorch'
+    if backend == 'pytorch':
+        return caminho_pt
+    return exportar(caminho_pt, backend, config.imgsz, config.half)
+
+
+def remover_exportados(diretorio, sha):
+    """
+    Remove os artefatos exportados a partir da versão ``sha`` dos pesos.
+    """
+    for nome in os.listdir(diretorio):
+        if nome.startswith(f"{sha}.") and not nome.endswith('.pt'):
+            caminho = os.path.join(diretorio, nome)
+            if os.path.isdir(caminho):
+                shutil.rmtree(caminho, ignore_errors=True)
+            else:
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass
+
+
+# --- Paridade entre backends ---
+def _caixa_imagem(deteccao):
+    x1, y1, x2, y2 = deteccao['caixa']
+    dx, dy = deteccao['caixa_trilho'][:2]
+    return (x1 + dx, y1 + dy, x2 + dx, y2 + dy)
+
+
+def _iou(a, b):
+    largura = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    altura = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    intersecao = largura * altura
+    uniao = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersecao
+    return intersecao / uniao if uniao > 0 else 0.0
+
+
+def comparar_deteccoes(referencia, candidatas, iou_minimo=IOU_MINIMO, diferenca_conf=DIFERENCA_CONF):
+    """
+    Casa as detecções de dois backends por imagem e classe, da maior para a
+    menor sobreposição. Retorna um dict com as contagens, o pior IoU e a maior
+    diferença de confiança entre os pares casados. Repetições de um grupo de
+    recortes (sem ``caixa`` própria) ficam de fora.
+    """
+    referencia = [d for d in referencia if d['caixa'] is not None]
+    candidatas = [d for d in candidatas if d['caixa'] is not None]
+    grupos = {}
+    for lado, deteccoes in ((0, referencia), (1, candidatas)):
+        for deteccao in deteccoes:
+            grupos.setdefault((deteccao['imagem'], deteccao['classe']), ([], []))[lado].append(deteccao)
+
+    casadas, ious, diferencas = 0, [], []
+    for lista_ref, lista_cand in grupos.values():
+        pares = sorted(
+            ((_iou(_caixa_imagem(r), _caixa_imagem(c)), i, j)
+             for i, r in enumerate(lista_ref) for j, c in enumerate(lista_cand)),
+            reverse=True,
+        )
+        usados_ref, usados_cand = set(), set()
+        for iou, i, j in pares:
+            if iou < iou_minimo:
+                break
+            if i in usados_ref or j in usados_cand:
+                continue
+            usados_ref.add(i)
+            usados_cand.add(j)
+            casadas += 1
+            ious.append(iou)
+            diferencas.append(abs(lista_ref[i]['conf'] - lista_cand[j]['conf']))
+
+    total = max(len(referencia), len(candidatas))
+    fracao = casadas / total if total else 1.0
+    maior_diferenca = max(diferencas, default=0.0)
+    return {
+        'referencia': len(referencia),
+        'candidatas': len(candidatas),
+        'casadas': casadas,
+        'so_referencia': len(referencia) - casadas,
+        'so_candidatas': len(candidatas) - casadas,
+        'fracao_casada': fracao,
+        'menor_iou': min(ious, default=None),
+        'maior_diferenca_conf': maior_diferenca,
+        'aprovado': fracao >= FRACAO_CASADA and maior_diferenca <= diferenca_conf,
+    }
+
+
+def verificar_paridade(path_modelo_f1, path_modelo_f2, origem, backend, config_f1=None, config_f2=None,
+                       referencia='pytorch', limite=50):
+    """
+    Roda as duas fases com ``referencia`` e com ``backend`` sobre as
+    primeiras ``limite`` imagens de ``origem`` (.zip ou diretório) e compara
+    as detecções com ``comparar_deteccoes``. Retorna o dict da comparação,
+    com o tempo de cada backend.
+    """
+    import copy
+    import time
+    from rcf.inferencia import ConfigFase
+    from rcf.ingestao import carregar_amostra
+    from rcf.pipeline import executar_duas_fases
+    from rcf.registro import registro_global
+
+    config_f1 = config_f1 or ConfigFase()
+    config_f2 = config_f2 or ConfigFase()
+    imagens = carregar_amostra(origem, limite)
+    registro = registro_global()
+    deteccoes, tempos = {}, {}
+    for nome in (referencia, backend):
+        c1, c2 = copy.copy(config_f1), copy.copy(config_f2)
+        c1.backend = c2.backend = nome
+        model_f1 = registro.obter(f'fase_1:{nome}', caminho_backend(path_modelo_f1, c1), imgsz=c1.imgsz)
+        model_f2 = registro.obter(f'fase_2:{nome}', caminho_backend(path_modelo_f2, c2), imgsz=c2.imgsz)
+        inicio = time.perf_counter()
+        deteccoes[nome], _ = executar_duas_fases(model_f1, model_f2, imagens, c1, c2)
+        tempos[nome] = time.perf_counter() - inicio
+    comparacao = comparar_deteccoes(deteccoes[referencia], deteccoes[backend])
+    comparacao['imagens'] = len(imagens)
+    comparacao['tempo_s'] = tempos
+    return comparacao
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara as detecções de dois backends de inferência.")
+    parser.add_argument('origem', help="Amostra: .zip ou diretório com imagens.")
+    parser.add_argument('--modelo-f1', required=True)
+    parser.add_argument('--modelo-f2', required=True)
+    parser.add_argument('--backend', choices=BACKENDS[1:], default='onnx')
+    parser.add_argument('--referencia', choices=BACKENDS, default='pytorch')
+    parser.add_argument('--limite', type=int, default=50, help="Imagens da amostra.")
+    parser.add_argument('--imgsz', type=int, default=640)
+    args = parser.parse_args(argv)
+
+    from rcf.inferencia import ConfigFase
+    config = ConfigFase(imgsz=args.imgsz)
+    comparacao = verificar_paridade(args.modelo_f1, args.modelo_f2, args.origem, args.backend, config, config,
+                                    args.referencia, args.limite)
+    for chave, valor in comparacao.items():
+        print(f"{chave}: {valor}")
+    return 0 if comparacao['aprovado'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,351 @@
+"""
+Benchmark reprodutível das duas fases, sem o Streamlit.
+
+Gera levantamentos sintéticos com nomes no padrão RIV
+(``<lim_sup> - <lim_inf><linha>_<pátio>_<data>_<km>_<metro>.jpg``) e pesos
+YOLO pequenos, criados localmente com inicialização aleatória (mesma
+arquitetura do YOLOv8n, sem treino). Cada tamanho de levantamento roda em um
+processo próprio, para que a carga dos modelos e o pico de memória de um não
+contaminem o outro, e o resultado traz o tempo, a vazão e a memória de cada
+etapa (``Metricas``). Uma execução pode ser gravada como base e as seguintes
+comparadas com ela, apontando as regressões.
+
+Uso::
+
+    python -m rcf.benchmark --tamanhos 100 1000 10000 --saida atual.json --base base.json
+    python -m rcf.benchmark --tamanhos 100 1000 --salvar-base base.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import uuid
+import zipfile
+
+from rcf.inferencia import ConfigFase
+
+TAMANHOS = (100, 1000, 10000)
+DIR_BENCHMARK = os.environ.get("RIV_BENCHMARK", "benchmark")
+
+CLASSES_FASE_1 = ('Trilho',)
+CLASSES_FASE_2 = ('defeito_1', 'defeito_2', 'defeito_3')
+LINHAS = ('FA1', 'FA2', 'MRS01')
+PATIOS = ('Arafer', 'Barreiro', 'Jeceaba', 'Olhos')
+
+# Os pesos de inicialização aleatória dão confianças muito baixas; a confiança
+# mínima quase nula com um limite de detecções reproduz a forma de um
+# levantamento real (dois trilhos por imagem, poucos defeitos por trilho).
+CONFIG_F1 = {'lote': 16, 'imgsz': 640, 'conf': 1e-4, 'max_det': 2}
+CONFIG_F2 = {'lote': 16, 'imgsz': 640, 'conf': 1e-4, 'max_det': 3}
+
+# Variação tolerada antes de apontar uma regressão; etapas rápidas demais
+# (diferença abaixo de MINIMO_ETAPA_S) são só ruído de medição.
+TOLERANCIA = 0.10
+MINIMO_ETAPA_S = 0.05
+
+# Campos de ``ambiente`` que precisam coincidir entre a base e a execução atual
+# para que a comparação meça o código, e não uma mudança de cenário.
+CAMPOS_CENARIO = ('cpus', 'resolucao', 'backend', 'processos', 'pesos', 'config_f1', 'config_f2')
+
+
+# --- Dados sintéticos ---
+def nome_riv(indice, aleatorio):
+    """
+    Nome de imagem no padrão RIV para a ``indice``-ésima imagem do levantamento.
+    """
+    lim_sup = aleatorio.randint(100, 999)
+    lim_inf = aleatorio.randint(10, lim_sup)
+    linha = LINHAS[indice % len(LINHAS)]
+    patio = PATIOS[(indice // len(LINHAS)) % len(PATIOS)]
+    data = datetime.date(2024, 1, 1) + datetime.timedelta(days=aleatorio.randint(0, 364))
+    km, metro = divmod(indice * 7, 1000)
+    return f"{lim_sup} - {lim_inf}{linha}_{patio}_{data:%Y%m%d}_{km}_{metro}.jpg"
+
+
+def _imagem_sintetica(aleatorio, largura, altura):
+    # Fundo com ruído de lastro e dois trilhos verticais claros em posições variadas.
+    from PIL import Image, ImageDraw
+    fundo = Image.effect_noise((largura, altura), aleatorio.randint(30, 70)).convert('RGB')
+    desenho = ImageDraw.Draw(fundo)
+    bitola = largura // 3
+    x = aleatorio.randint(largura // 8, largura - bitola - largura // 8)
+    for inicio in (x, x + bitola):
+        desenho.rectangle((inicio, 0, inicio + largura // 40, altura), fill=(200, 200, 205))
+    for _ in range(aleatorio.randint(0, 3)):
+        cx, cy = aleatorio.choice((x, x + bitola)), aleatorio.randint(0, altura)
+        desenho.ellipse((cx - 6, cy - 6, cx + 12, cy + 12), fill=(60, 40, 30))
+    return fundo
+
+
+def gerar_levantamento(caminho_zip, quantidade, largura=1280, altura=720, semente=0):
+    """
+    Grava em ``caminho_zip`` um levantamento sintético com ``quantidade``
+    imagens JPEG. Com a mesma ``semente`` o conteúdo é sempre o mesmo; um .zip
+    já existente é reaproveitado.
+    """
+    import io
+    import random
+    if os.path.exists(caminho_zip):
+        return caminho_zip
+    os.makedirs(os.path.dirname(caminho_zip) or '.', exist_ok=True)
+    aleatorio = random.Random(semente)
+    temporario = os.path.join(os.path.dirname(caminho_zip) or '.', f".{uuid.uuid4().hex}.zip")
+    try:
+        with zipfile.ZipFile(temporario, 'w', compression=zipfile.ZIP_STORED) as saida:
+            for indice in range(quantidade):
+                buffer = io.BytesIO()
+                _imagem_sintetica(aleatorio, largura, altura).save(buffer, format='JPEG', quality=85)
+                saida.writestr(f"levantamento/{nome_riv(indice, aleatorio)}", buffer.getvalue())
+        os.replace(temporario, caminho_zip)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    return caminho_zip
+
+
+def gerar_pesos(diretorio, arquitetura='yolov8n.yaml'):
+    """
+    Cria (uma vez) os pesos substitutos da fase 1 e da fase 2: modelos YOLO
+    com a ``arquitetura`` indicada, pesos aleatórios e as classes do pipeline.
+    Retorna os caminhos ``(fase_1, fase_2)``.
+    """
+    import torch
+    from ultralytics.nn.tasks import DetectionModel
+
+    os.makedirs(diretorio, exist_ok=True)
+    caminhos = []
+    for nome, classes in (('fase_1.pt', CLASSES_FASE_1), ('fase_2.pt', CLASSES_FASE_2)):
+        caminho = os.path.join(diretorio, nome)
+        caminhos.append(caminho)
+        if os.path.exists(caminho):
+            continue
+        torch.manual_seed(0)
+        modelo = DetectionModel(arquitetura, nc=len(classes), verbose=False)
+        modelo.names = dict(enumerate(classes))
+        temporario = os.path.join(diretorio, f".{uuid.uuid4().hex}.pt")
+        torch.save({'model': modelo.half(), 'train_args': {'task': 'detect', 'imgsz': 640}}, temporario)
+        os.replace(temporario, caminho)
+    return tuple(caminhos)
+
+
+# --- Execução ---
+def executar_cenario(path_modelo_f1, path_modelo_f2, arquivo_zip, config_f1=None, config_f2=None, processos=1):
+    """
+    Analisa ``arquivo_zip`` uma vez, medindo cada etapa, e monta o relatório.
+    Retorna o resumo do cenário (serializável em JSON).
+    """
+    from rcf.analise import analisar_zip
+    from rcf.metricas import Metricas, pico_rss_bytes
+    from rcf.relatorio import tabela_deteccoes
+
+    config_f1 = config_f1 or ConfigFase(**CONFIG_F1)
+    config_f2 = config_f2 or ConfigFase(**CONFIG_F2)
+    metricas = Metricas()
+    inicio = time.perf_counter()
+    resultado = analisar_zip(path_modelo_f1, path_modelo_f2, arquivo_zip, config_f1, config_f2, processos,
+                             metricas=metricas)
+    with metricas.etapa('relatorio', imagens=len(resultado.manifesto)):
+        df, _ = tabela_deteccoes(resultado.deteccoes)
+    tempo = time.perf_counter() - inicio
+    return {
+        'imagens': len(resultado.manifesto),
+        'trilhos': resultado.total_trilhos,
+        'deteccoes': len(df),
+        'processos': processos,
+        'tempo_s': tempo,
+        'imagens_por_s': len(resultado.manifesto) / tempo if tempo > 0 else None,
+        'pico_rss_bytes': pico_rss_bytes(),
+        'etapas': metricas.resumo(),
+    }
+
+
+def executar_isolado(funcao, *argumentos):
+    """
+    ``funcao(*argumentos)`` em um processo novo (``spawn``) e não daemon, que
+    pode abrir seus próprios processos (``executar_paralelo`` com
+    ``processos > 1``); um ``Pool`` não serve, porque seus workers são daemon.
+    """
+    import concurrent.futures
+    import multiprocessing
+    contexto = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=contexto) as executor:
+        return executor.submit(funcao, *argumentos).result()
+
+
+def executar_benchmark(tamanhos=TAMANHOS, diretorio=DIR_BENCHMARK, processos=1, largura=1280, altura=720,
+                       pesos=None, isolar=True, ao_cenario=None, backend='pytorch'):
+    """
+    Roda um cenário por tamanho de levantamento e retorna o relatório com o
+    ambiente e os cenários. ``pesos`` = ``(fase_1, fase_2)``; sem ele os pesos
+    substitutos são gerados em ``<diretorio>/pesos``. Com ``isolar`` cada
+    cenário roda em um processo novo (``spawn``). ``backend`` vale para as duas fases.
+    """
+    origem_pesos = [os.path.basename(caminho) for caminho in pesos] if pesos else 'substitutos'
+    pesos = pesos or gerar_pesos(os.path.join(diretorio, 'pesos'))
+    cenarios = []
+    for tamanho in tamanhos:
+        arquivo_zip = gerar_levantamento(
+            os.path.join(diretorio, 'dados', f"levantamento_{tamanho}_{largura}x{altura}.zip"), tamanho, largura, altura,
+        )
+        configs = (ConfigFase(**CONFIG_F1, backend=backend), ConfigFase(**CONFIG_F2, backend=backend))
+        argumentos = (pesos[0], pesos[1], arquivo_zip, *configs, processos)
+        if isolar:
+            cenario = executar_isolado(executar_cenario, *argumentos)
+        else:
+            cenario = executar_cenario(*argumentos)
+        cenario['tamanho'] = tamanho
+        cenarios.append(cenario)
+        if ao_cenario is not None:
+            ao_cenario(cenario)
+    return {
+        'data': datetime.datetime.now().isoformat(timespec='seconds'),
+        'ambiente': {
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'resolucao': f"{largura}x{altura}",
+            'backend': backend,
+            'processos': processos,
+            'pesos': origem_pesos,
+            'config_f1': CONFIG_F1,
+            'config_f2': CONFIG_F2,
+        },
+        'cenarios': cenarios,
+    }
+
+
+# --- Comparação com a base ---
+def _variacao(atual, base):
+    if not base or atual is None:
+        return None
+    return (atual - base) / base
+
+
+def diferencas_cenario(relatorio, base):
+    """
+    Campos de ``CAMPOS_CENARIO`` em que o ambiente da base difere do atual,
+    como ``(campo, base, atual)``. Um campo ausente (base antiga) conta como diferente.
+    """
+    ambiente_base = base.get('ambiente', {})
+    ambiente = relatorio.get('ambiente', {})
+    # A base vem de JSON (tuplas viram listas); compara-se a forma serializada.
+    return [
+        (campo, ambiente_base.get(campo), ambiente.get(campo))
+        for campo in CAMPOS_CENARIO
+        if json.dumps(ambiente_base.get(campo), sort_keys=True) != json.dumps(ambiente.get(campo), sort_keys=True)
+    ]
+
+
+def comparar(relatorio, base, tolerancia=TOLERANCIA, minimo_etapa_s=MINIMO_ETAPA_S, forcar=False):
+    """
+    Compara cada cenário com o de mesmo tamanho na ``base``. Retorna uma
+    lista de dicts ``(tamanho, medida, base, atual, variacao, regressao)``;
+    é regressão a vazão cair, ou o tempo de uma etapa (em mais de
+    ``minimo_etapa_s``) ou o pico de memória subir, mais que ``tolerancia``.
+
+    Lança ``ValueError`` se a base tiver sido medida em outro cenário
+    (``diferencas_cenario``), a menos que ``forcar`` seja verdadeiro.
+    """
+    diferencas = diferencas_cenario(relatorio, base)
+    if diferencas and not forcar:
+        raise ValueError("A base foi medida em outro cenário: " + "; ".join(
+            f"{campo} {valor_base!r} -> {valor_atual!r}" for campo, valor_base, valor_atual in diferencas
+        ) + ".")
+    por_tamanho = {cenario['tamanho']: cenario for cenario in base.get('cenarios', [])}
+    comparacoes = []
+
+    def registrar(tamanho, medida, valor_base, valor_atual, maior_pior, minimo=0):
+        variacao = _variacao(valor_atual, valor_base)
+        piorou = variacao is not None and (variacao > tolerancia if maior_pior else variacao < -tolerancia)
+        piorou = piorou and abs(valor_atual - valor_base) >= minimo
+        comparacoes.append({
+            'tamanho': tamanho, 'medida': medida, 'base': valor_base, 'atual': valor_atual,
+            'variacao': variacao, 'regressao': piorou,
+        })
+
+    for cenario in relatorio['cenarios']:
+        anterior = por_tamanho.get(cenario['tamanho'])
+        if anterior is None:
+            continue
+        registrar(cenario['tamanho'], 'imagens_por_s', anterior['imagens_por_s'], cenario['imagens_por_s'], False)
+        registrar(cenario['tamanho'], 'pico_rss_bytes', anterior['pico_rss_bytes'], cenario['pico_rss_bytes'], True)
+        etapas_base = {etapa['etapa']: etapa for etapa in anterior['etapas']}
+        for etapa in cenario['etapas']:
+            if etapa['etapa'] in etapas_base:
+                registrar(cenario['tamanho'], f"{etapa['etapa']}.tempo_s",
+                          etapas_base[etapa['etapa']]['tempo_s'], etapa['tempo_s'], True, minimo_etapa_s)
+    return comparacoes
+
+
+def formatar_cenario(cenario):
+    linhas = [
+        f"{cenario['tamanho']} imagens: {cenario['tempo_s']:.1f} s, {cenario['imagens_por_s'] or 0:.1f} img/s, "
+        f"pico de memória {cenario['pico_rss_bytes'] / 1024 ** 2:.0f} MB, {cenario['deteccoes']} detecção(ões)"
+    ]
+    for etapa in cenario['etapas']:
+        vazao = f", {etapa['imagens_por_s']:.1f} img/s" if etapa['imagens_por_s'] else ""
+        cpu = f"  cpu {etapa['cpu_s']:9.3f} s" if etapa['cpu_s'] else ""
+        linhas.append(f"  {etapa['etapa']:<16} {etapa['tempo_s']:9.3f} s{cpu}{vazao}")
+    return '\n'.join(linhas)
+
+
+def formatar_comparacao(comparacoes):
+    linhas = []
+    for c in comparacoes:
+        variacao = f"{c['variacao']:+.1%}" if c['variacao'] is not None else "-"
+        marca = "  REGRESSÃO" if c['regressao'] else ""
+        linhas.append(f"{c['tamanho']:>6} {c['medida']:<28} {c['base'] or 0:14.3f} -> {c['atual'] or 0:14.3f} {variacao:>8}{marca}")
+    return '\n'.join(linhas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das duas fases com levantamentos sintéticos.")
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=list(TAMANHOS))
+    parser.add_argument('--diretorio', default=DIR_BENCHMARK, help="Dados sintéticos e pesos substitutos.")
+    parser.add_argument('--processos', type=int, default=1)
+    parser.add_argument('--largura', type=int, default=1280)
+    parser.add_argument('--altura', type=int, default=720)
+    parser.add_argument('--pesos', nargs=2, metavar=('FASE_1', 'FASE_2'), help="Pesos reais em vez dos substitutos.")
+    parser.add_argument('--sem-isolar', action='store_true', help="Roda os cenários no mesmo processo.")
+    parser.add_argument('--backend', choices=('pytorch', 'onnx', 'openvino'), default='pytorch')
+    parser.add_argument('--saida', help="Grava o relatório em JSON.")
+    parser.add_argument('--base', help="Relatório de base para comparação.")
+    parser.add_argument('--salvar-base', help="Grava o relatório como nova base.")
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA)
+    parser.add_argument('--forcar', action='store_true',
+                        help="Compara com a base mesmo que ela tenha sido medida em outro cenário.")
+    args = parser.parse_args(argv)
+
+    relatorio = executar_benchmark(
+        args.tamanhos, args.diretorio, args.processos, args.largura, args.altura, args.pesos,
+        isolar=not args.sem_isolar, ao_cenario=lambda cenario: print(formatar_cenario(cenario), flush=True),
+        backend=args.backend,
+    )
+    for caminho in (args.saida, args.salvar_base):
+        if caminho:
+            with open(caminho, 'w', encoding='utf-8') as f:
+                json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    if not args.base:
+        return 0
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    try:
+        comparacoes = comparar(relatorio, base, args.tolerancia, forcar=args.forcar)
+    except ValueError as e:
+        print(f"{e} Use --forcar para comparar mesmo assim.")
+        return 2
+    for campo, valor_base, valor_atual in diferencas_cenario(relatorio, base):
+        print(f"Aviso: {campo} difere da base ({valor_base!r} -> {valor_atual!r}).")
+    print(formatar_comparacao(comparacoes))
+    regressoes = [c for c in comparacoes if c['regressao']]
+    if regressoes:
+        print(f"{len(regressoes)} regressão(ões) acima de {args.tolerancia:.0%}.")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+Cache persistente de resultados de inferência, endereçado pelo conteúdo.
+
+A chave é o SHA-256 da imagem junto com a versão dos modelos (hash dos pesos
+da fase 1 e da fase 2) e os parâmetros que alteram as detecções. Imagens já
+analisadas, mesmo que venham em outro upload ou com outro nome, não voltam ao
+modelo. Imagens sem nenhuma detecção também são guardadas (lista vazia), pois
+evitar a inferência delas é o que mais economiza em levantamentos repetidos.
+Cada entrada guarda também o número de recortes de trilho da imagem, que os
+trilhos sem defeito não deixam nas detecções.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from rcf.modelos import calcular_sha256
+from rcf.pipeline import nome_recorte
+
+ESQUEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS resultados (
+        sha TEXT NOT NULL,
+        modelos TEXT NOT NULL,
+        parametros TEXT NOT NULL,
+        deteccoes TEXT NOT NULL,
+        tamanho INTEGER NOT NULL,
+        acesso REAL NOT NULL,
+        PRIMARY KEY (sha, modelos, parametros)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_resultados_acesso ON resultados (acesso)",
+    "CREATE TABLE IF NOT EXISTS contadores (nome TEXT PRIMARY KEY, valor INTEGER NOT NULL)",
+)
+
+# Campos que dependem do nome do arquivo e não do conteúdo; são refeitos a cada acerto.
+CAMPOS_NOME = ('imagem', 'arquivo', 'nome_recorte')
+# Campos de ``ConfigFase`` que não alteram as detecções e ficam fora da chave.
+CAMPOS_DESEMPENHO = ('lote', 'threads', 'decodificadores', 'profundidade')
+# Versão do formato de ``parametros_deteccao`` e das entradas; mudá-la torna as
+# entradas antigas inalcançáveis (a 3 passou a guardar os trilhos de cada imagem).
+ESQUEMA_PARAMETROS = 3
+
+_hashes_modelos = {}
+_hashes_lock = threading.Lock()
+
+
+def hash_modelo(caminho):
+    """
+    SHA-256 dos pesos, memorizado por caminho, tamanho e data de modificação.
+    """
+    info = os.stat(caminho)
+    chave = (os.path.abspath(caminho), info.st_size, info.st_mtime_ns)
+    with _hashes_lock:
+        if chave not in _hashes_modelos:
+            _hashes_modelos[chave] = calcular_sha256(caminho)
+        return _hashes_modelos[chave]
+
+
+def versao_modelos(path_modelo_f1, path_modelo_f2):
+    return f"{hash_modelo(path_modelo_f1)}:{hash_modelo(path_modelo_f2)}"
+
+
+def parametros_deteccao(config_f1, config_f2):
+    """
+    Parte da chave que depende da configuração: todos os campos de
+    ``ConfigFase`` das duas fases, menos os que só alteram o desempenho
+    (``CAMPOS_DESEMPENHO``), serializados em JSON canônico junto com
+    ``ESQUEMA_PARAMETROS``. Um campo novo em ``ConfigFase`` entra na chave
+    sem precisar mexer aqui.
+    """
+    fases = {
+        fase: {campo: valor for campo, valor in vars(config).items() if campo not in CAMPOS_DESEMPENHO}
+        for fase, config in (('fase_1', config_f1), ('fase_2', config_f2))
+    }
+    return json.dumps({'esquema': ESQUEMA_PARAMETROS, **fases}, sort_keys=True, separators=(',', ':'))
+
+
+def sha256_bytes(dados):
+    return hashlib.sha256(dados).hexdigest()
+
+
+def sem_nomes(deteccao):
+    return {k: v for k, v in deteccao.items() if k not in CAMPOS_NOME}
+
+
+def com_nomes(deteccao, nome):
+    d = dict(deteccao)
+    d['imagem'] = nome
+    d['arquivo'] = os.path.basename(nome)
+    d['nome_recorte'] = nome_recorte(nome, d['indice_trilho'])
+    return d
+
+
+class CacheResultados:
+    """
+    Detecções por (imagem, modelos, parâmetros) em SQLite, limitado a
+    ``limite_bytes`` (remoção das entradas acessadas há mais tempo). Entradas
+    de pesos antigos saem pelo mesmo limite, sem afetar versões ainda em uso
+    por outros workers ou análises.
+    """
+    def __init__(self, caminho_db, limite_bytes=512 * 1024 ** 2):
+        self.caminho_db = caminho_db
+        self.limite_bytes = limite_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(caminho_db)), exist_ok=True)
+        with self._conectar() as conexao:
+            for comando in ESQUEMA:
+                conexao.execute(comando)
+
+    @contextlib.contextmanager
+    def _conectar(self):
+        conexao = sqlite3.connect(self.caminho_db, timeout=30, isolation_level=None)
+        try:
+            conexao.execute('PRAGMA journal_mode=WAL')
+            yield conexao
+        finally:
+            conexao.close()
+
+    def consultar(self, shas, modelos, parametros):
+        """
+        Retorna ``{sha: (deteccoes, trilhos)}`` para os hashes presentes no
+        cache e atualiza os contadores de acertos e faltas.
+        """
+        shas = list(dict.fromkeys(shas))
+        encontrados = {}
+        agora = time.time()
+        with self._conectar() as conexao:
+            for i in range(0, len(shas), 500):
+                bloco = shas[i:i + 500]
+                marcadores = ','.join('?' * len(bloco))
+                linhas = conexao.execute(
+                    f"SELECT sha, deteccoes FROM resultados WHERE modelos = ? AND parametros = ? AND sha IN ({marcadores})",
+                    [modelos, parametros] + bloco,
+                ).fetchall()
+                for sha, entrada in linhas:
+                    entrada = json.loads(entrada)
+                    encontrados[sha] = (entrada['deteccoes'], entrada['trilhos'])
+            conexao.execute("BEGIN")
+            conexao.executemany(
+                "UPDATE resultados SET acesso = ? WHERE sha = ? AND modelos = ? AND parametros = ?",
+                [(agora, sha, modelos, parametros) for sha in encontrados],
+            )
+            self._somar(conexao, 'acertos', len(encontrados))
+            self._somar(conexao, 'faltas', len(shas) - len(encontrados))
+            conexao.execute("COMMIT")
+        return encontrados
+
+    def gravar(self, resultados, modelos, parametros):
+        """
+        Grava ``{sha: (deteccoes, trilhos)}`` e aplica o limite de tamanho.
+        """
+        agora = time.time()
+        linhas = []
+        for sha, (deteccoes, trilhos) in resultados.items():
+            texto = json.dumps({'trilhos': trilhos, 'deteccoes': [sem_nomes(d) for d in deteccoes]})
+            linhas.append((sha, modelos, parametros, texto, len(texto), agora))
+        with self._conectar() as conexao:
+            conexao.execute("BEGIN")
+            conexao.executemany("INSERT OR REPLACE INTO resultados VALUES (?, ?, ?, ?, ?, ?)", linhas)
+            conexao.execute("COMMIT")
+            self._aplicar_limite(conexao)
+
+    def invalidar(self, modelos):
+        """
+        Remove as entradas de todas as versões dos modelos exceto ``modelos``.
+        Ação administrativa (ex.: aposentar pesos antigos de vez); a análise
+        não a chama. Retorna o número de entradas removidas.
+        """
+        with self._conectar() as conexao:
+            return conexao.execute("DELETE FROM resultados WHERE modelos != ?", (modelos,)).rowcount
+
+    def _aplicar_limite(self, conexao):
+        total = conexao.execute("SELECT COALESCE(SUM(tamanho), 0) FROM resultados").fetchone()[0]
+        if total <= self.limite_bytes:
+            return
+        excesso = total - self.limite_bytes
+        liberados = 0
+        removidos = 0
+        conexao.execute("BEGIN")
+        for rowid, tamanho in conexao.execute("SELECT rowid, tamanho FROM resultados ORDER BY acesso").fetchall():
+            if liberados >= excesso:
+                break
+            conexao.execute("DELETE FROM resultados WHERE rowid = ?", (rowid,))
+            liberados += tamanho
+            removidos += 1
+        self._somar(conexao, 'removidos', removidos)
+        conexao.execute("COMMIT")
+
+    def _somar(self, conexao, nome, valor):
+        conexao.execute(
+            "INSERT INTO contadores VALUES (?, ?) ON CONFLICT(nome) DO UPDATE SET valor = valor + excluded.valor",
+            (nome, valor),
+        )
+
+    def estatisticas(self):
+        with self._conectar() as conexao:
+            contadores = dict(conexao.execute("SELECT nome, valor FROM contadores").fetchall())
+            entradas, tamanho = conexao.execute("SELECT COUNT(*), COALESCE(SUM(tamanho), 0) FROM resultados").fetchone()
+        return {
+            'acertos': contadores.get('acertos', 0),
+            'faltas': contadores.get('faltas', 0),
+            'removidos': contadores.get('removidos', 0),
+            'entradas': entradas,
+            'bytes': tamanho,
+        }
@@ -0,0 +1,120 @@
+"""
+Agrupamento de recortes de trilho repetidos entre quadros consecutivos.
+
+O RIV grava quadros muito sobrepostos, então o mesmo trecho de trilho (e o
+mesmo defeito) aparece em vários recortes seguidos. Dois recortes são do mesmo
+grupo quando vêm do mesmo levantamento (Linha, Pátio e data do nome do
+arquivo), estão a poucos metros um do outro (KM/Metro), ocupam a mesma faixa
+horizontal do quadro (o mesmo trilho, não o vizinho) e têm *hash* perceptual
+(dHash de 64 bits) parecido. Só o primeiro recorte de cada grupo, o
+representante, passa pela fase 2; os demais recebem as detecções dele.
+"""
+import collections
+import re
+
+from rcf.relatorio import PADRAO_NOME, chave_trilho
+
+DISTANCIA_HASH = 10
+DISTANCIA_METROS = 5
+SOBREPOSICAO_HORIZONTAL = 0.5
+# Representantes mais recentes com que um recorte novo é comparado.
+JANELA_REPRESENTANTES = 512
+
+_PADRAO_NOME = re.compile(PADRAO_NOME)
+
+
+def hash_perceptual(recorte):
+    """
+    dHash de 64 bits: o recorte em tons de cinza reduzido para 9x8 e um bit
+    por par de pixels vizinhos na horizontal (1 se o da esquerda for mais claro).
+    """
+    import numpy as np
+    from PIL import Image
+    cinza = Image.fromarray(recorte).convert('L').resize((9, 8), Image.BILINEAR)
+    pixels = np.asarray(cinza, dtype=np.int16)
+    bits = (pixels[:, :-1] > pixels[:, 1:]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def distancia_hash(a, b):
+    return bin(a ^ b).count('1')
+
+
+def localizar(arquivo):
+    """
+    ``((linha, pátio, data), posição em metros)`` a partir do nome da imagem,
+    ou None se o nome não seguir o padrão do levantamento.
+    """
+    partes = _PADRAO_NOME.match(arquivo)
+    if partes is None:
+        return None
+    return (partes['linha'], partes['patio'], partes['data']), int(partes['km']) * 1000 + int(partes['metro'])
+
+
+def _sobreposicao_horizontal(a, b):
+    intersecao = min(a[1], b[1]) - max(a[0], b[0])
+    menor = min(a[1] - a[0], b[1] - b[0])
+    return intersecao / menor if menor > 0 else 0.0
+
+
+class AgrupadorRecortes:
+    """
+    Atribui cada recorte de trilho (dict de ``extrair_trilhos``) a um grupo
+    de recortes repetidos, na ordem em que chegam. O grupo é identificado
+    pela ``chave_trilho`` (imagem e índice do trilho) do representante. Cada
+    recorte é comparado só com os representantes, para que um grupo não se
+    estenda pela via em cadeia.
+
+    Só os ``janela`` representantes mais recentes ficam guardados; um grupo
+    cujo representante saiu da janela não recebe mais recortes (``ativo``).
+    """
+    def __init__(self, distancia_hash=DISTANCIA_HASH, distancia_metros=DISTANCIA_METROS,
+                 sobreposicao=SOBREPOSICAO_HORIZONTAL, janela=JANELA_REPRESENTANTES):
+        self.distancia_hash = distancia_hash
+        self.distancia_metros = distancia_metros
+        self.sobreposicao = sobreposicao
+        self.janela = janela
+        # (levantamento, faixa de posição) -> representantes [(posição, hash, (x1, x2), grupo)].
+        self._faixas = {}
+        # Representantes guardados, do mais antigo ao mais recente: (chave da faixa, representante).
+        self._recentes = collections.deque()
+        self._ativos = set()
+
+    def ativo(self, grupo):
+        """
+        Se o grupo ainda pode receber repetições.
+        """
+        return grupo in self._ativos
+
+    def _guardar(self, chave, representante):
+        self._faixas.setdefault(chave, []).append(representante)
+        self._recentes.append((chave, representante))
+        self._ativos.add(representante[3])
+        if len(self._recentes) > self.janela:
+            chave, antigo = self._recentes.popleft()
+            self._faixas[chave].remove(antigo)
+            if not self._faixas[chave]:
+                del self._faixas[chave]
+            self._ativos.discard(antigo[3])
+
+    def agrupar(self, trilho):
+        """
+        Retorna ``(grupo, representante)``: o ID do grupo do recorte e se ele é
+        o representante (novo grupo) ou uma repetição.
+        """
+        local = localizar(trilho['arquivo'])
+        if local is None:
+            return chave_trilho(trilho['imagem'], trilho['indice_trilho']), True
+        levantamento, posicao = local
+        assinatura = hash_perceptual(trilho['recorte'])
+        horizontal = (trilho['caixa_trilho'][0], trilho['caixa_trilho'][2])
+        faixa = posicao // max(1, self.distancia_metros)
+        for vizinha in (faixa - 1, faixa, faixa + 1):
+            for pos, outro_hash, outra_horizontal, grupo in self._faixas.get((levantamento, vizinha), ()):
+                if (abs(pos - posicao) <= self.distancia_metros
+                        and _sobreposicao_horizontal(horizontal, outra_horizontal) >= self.sobreposicao
+                        and distancia_hash(assinatura, outro_hash) <= self.distancia_hash):
+                    return grupo, False
+        grupo = chave_trilho(trilho['imagem'], trilho['indice_trilho'])
+        self._guardar((levantamento, faixa), (posicao, assinatura, horizontal, grupo))
+        return grupo, True
@@ -0,0 +1,137 @@
+"""
+Índice espacial das detecções ao longo da via.
+
+A posição de cada detecção é ``KM * 1000 + Metro`` (em metros). Para cada
+Linha o índice guarda as posições ordenadas, de modo que consultas por trecho
+e por vizinho mais próximo são buscas binárias (``numpy.searchsorted``) em vez
+de varrer todas as linhas. O mesmo mecanismo casa os defeitos de um
+levantamento com os do levantamento anterior, dentro de uma tolerância.
+"""
+import numpy as np
+import pandas as pd
+
+
+def posicao(km, metro):
+    """
+    Posição em metros a partir de KM e Metro (escalares ou arrays).
+    """
+    return np.asarray(km, dtype='int64') * 1000 + np.asarray(metro, dtype='int64')
+
+
+def _chave(chave):
+    return chave if isinstance(chave, tuple) else (chave,)
+
+
+class IndiceEspacial:
+    """
+    Posições ordenadas por grupo (por padrão, por Linha) de um DataFrame com
+    as colunas ``KM`` e ``Metro``. Os resultados são posições de linha do
+    DataFrame original (para uso com ``df.iloc``).
+    """
+    def __init__(self, df, chaves=('Linha',)):
+        self.chaves = tuple(chaves)
+        posicoes = posicao(df['KM'].to_numpy(), df['Metro'].to_numpy())
+        self._grupos = {}
+        if df.empty:
+            return
+        for chave, linhas in df.groupby(list(self.chaves), observed=True, sort=False).indices.items():
+            ordem = np.argsort(posicoes[linhas], kind='stable')
+            self._grupos[_chave(chave)] = (posicoes[linhas][ordem], np.asarray(linhas)[ordem])
+
+    def grupos(self):
+        return list(self._grupos)
+
+    def intervalo(self, chave, inicio, fim):
+        """
+        Linhas do grupo ``chave`` com posição entre ``inicio`` e ``fim`` (metros, inclusivos),
+        em ordem de posição.
+        """
+        if _chave(chave) not in self._grupos:
+            return np.empty(0, dtype='int64')
+        ordenadas, linhas = self._grupos[_chave(chave)]
+        a = np.searchsorted(ordenadas, inicio, side='left')
+        b = np.searchsorted(ordenadas, fim, side='right')
+        return linhas[a:b]
+
+    def vizinhos(self, chave, pos, k=1):
+        """
+        As ``k`` linhas do grupo mais próximas da posição ``pos``.
+        Retorna ``(linhas, distancias)`` em ordem de distância.
+        """
+        if _chave(chave) not in self._grupos:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='int64')
+        ordenadas, linhas = self._grupos[_chave(chave)]
+        i = np.searchsorted(ordenadas, pos)
+        # Os k mais próximos estão entre os k vizinhos de cada lado do ponto de inserção.
+        a, b = max(i - k, 0), min(i + k, len(ordenadas))
+        distancias = np.abs(ordenadas[a:b] - pos)
+        ordem = np.argsort(distancias, kind='stable')[:k]
+        return linhas[a:b][ordem], distancias[ordem]
+
+    def mais_proximo(self, df, tolerancia_m=None):
+        """
+        Para cada linha de ``df`` (com as mesmas chaves e KM/Metro), a linha
+        indexada mais próxima no mesmo grupo. Retorna um DataFrame com
+        ``linha`` (posição em ``df``), ``linha_indice`` e ``distancia``, só
+        com os pares dentro de ``tolerancia_m`` quando informada.
+        """
+        pares = []
+        if not df.empty:
+            posicoes = posicao(df['KM'].to_numpy(), df['Metro'].to_numpy())
+            for chave, linhas in df.groupby(list(self.chaves), observed=True, sort=False).indices.items():
+                if _chave(chave) not in self._grupos:
+                    continue
+                ordenadas, indexadas = self._grupos[_chave(chave)]
+                alvo = posicoes[linhas]
+                i = np.searchsorted(ordenadas, alvo)
+                esquerda = np.clip(i - 1, 0, len(ordenadas) - 1)
+                direita = np.clip(i, 0, len(ordenadas) - 1)
+                d_esquerda = np.abs(alvo - ordenadas[esquerda])
+                d_direita = np.abs(ordenadas[direita] - alvo)
+                melhor = np.where(d_direita < d_esquerda, direita, esquerda)
+                distancia = np.minimum(d_esquerda, d_direita)
+                pares.append(pd.DataFrame({
+                    'linha': np.asarray(linhas), 'linha_indice': indexadas[melhor], 'distancia': distancia,
+                }))
+        resultado = pd.concat(pares, ignore_index=True) if pares else pd.DataFrame(
+            {'linha': pd.Series(dtype='int64'), 'linha_indice': pd.Series(dtype='int64'), 'distancia': pd.Series(dtype='int64')}
+        )
+        if tolerancia_m is not None:
+            resultado = resultado[resultado['distancia'] <= tolerancia_m]
+        return resultado.sort_values('linha', ignore_index=True)
+
+
+def filtrar_trecho(df, linha, inicio, fim):
+    """
+    Linhas de ``df`` na Linha ``linha`` entre as posições ``inicio`` e ``fim`` (metros).
+    """
+    return df.iloc[np.sort(IndiceEspacial(df).intervalo(linha, inicio, fim))]
+
+
+def marcar_repetidos(df, tolerancia_m=5, chaves=('Linha',)):
+    """
+    Marca os defeitos já vistos no levantamento anterior da mesma Linha
+    (data imediatamente anterior em Ano/Mês/Dia) a até ``tolerancia_m``
+    metros. Retorna uma cópia com ``Repetido`` e ``Distância anterior (m)``.
+    """
+    resultado = df.copy()
+    if df.empty:
+        resultado['Repetido'] = pd.Series(dtype=bool)
+        resultado['Distância anterior (m)'] = pd.Series(dtype=float)
+        return resultado
+    datas = pd.to_datetime(pd.DataFrame({'year': df['Ano'], 'month': df['Mês'], 'day': df['Dia']})).to_numpy()
+    repetido = np.zeros(len(df), dtype=bool)
+    distancia = np.full(len(df), np.nan)
+    for _, linhas in df.groupby(list(chaves), observed=True, sort=False).indices.items():
+        levantamentos = np.unique(datas[linhas])
+        for anterior, atual in zip(levantamentos[:-1], levantamentos[1:]):
+            linhas_anterior = linhas[datas[linhas] == anterior]
+            linhas_atual = linhas[datas[linhas] == atual]
+            indice = IndiceEspacial(df.iloc[linhas_anterior], chaves)
+            pares = indice.mais_proximo(df.iloc[linhas_atual], tolerancia_m)
+            destino = linhas_atual[pares['linha'].to_numpy()]
+            repetido[destino] = True
+            distancia[destino] = pares['distancia'].to_numpy()
+    resultado['Repetido'] = repetido
+    resultado['Distância anterior (m)'] = distancia
+    return resultado
@@ -0,0 +1,161 @@
+"""
+Exportação dos relatórios para arquivos em disco.
+
+Os arquivos são gerados uma única vez por análise, em
+``<dir_exportacoes>/<id_analise>/``, e servidos a partir de lá nos reruns
+seguintes. CSV e XLSX são escritos em blocos (o XLSX com o modo
+``write_only`` do openpyxl, que não mantém a planilha inteira em memória);
+há também CSV com gzip, Parquet e um .zip com as imagens anotadas.
+"""
+import contextlib
+import gzip
+import os
+import shutil
+import time
+import uuid
+import zipfile
+
+from rcf.ingestao import iterar_bytes_zip
+from rcf.manifesto import ItemManifesto
+
+LINHAS_POR_BLOCO = 50000
+# Limite do Excel é 1.048.576 linhas por planilha, incluindo o cabeçalho.
+LINHAS_POR_PLANILHA = 1048575
+
+FORMATOS = {
+    'csv': ('relatorio.csv', 'text/csv'),
+    'csv.gz': ('relatorio.csv.gz', 'application/gzip'),
+    'xlsx': ('relatorio.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'parquet': ('relatorio.parquet', 'application/vnd.apache.parquet'),
+    'imagens': ('imagens_anotadas.zip', 'application/zip'),
+}
+
+COR_TRILHO = (255, 255, 0)
+COR_DETECCAO = (255, 0, 0)
+
+
+def _blocos(df, linhas=LINHAS_POR_BLOCO):
+    for inicio in range(0, len(df), linhas):
+        yield df.iloc[inicio:inicio + linhas]
+
+
+def exportar_csv(df, caminho, compactar=False):
+    abrir = gzip.open if compactar else open
+    with abrir(caminho, 'wt', encoding='utf-8', newline='') as f:
+        if df.empty:
+            df.to_csv(f, index=False)
+        for i, bloco in enumerate(_blocos(df)):
+            bloco.to_csv(f, index=False, header=(i == 0))
+
+
+def exportar_xlsx(df, caminho):
+    from openpyxl import Workbook
+    livro = Workbook(write_only=True)
+    inicios = range(0, max(len(df), 1), LINHAS_POR_PLANILHA)
+    for numero, inicio in enumerate(inicios, start=1):
+        planilha = livro.create_sheet(f"Relatório {numero}" if len(inicios) > 1 else "Relatório")
+        planilha.append(list(df.columns))
+        for bloco in _blocos(df.iloc[inicio:inicio + LINHAS_POR_PLANILHA]):
+            # Categorias e tipos do numpy viram objetos Python; ausentes viram células vazias.
+            bloco = bloco.astype(object).where(bloco.notna(), None)
+            for linha in bloco.itertuples(index=False, name=None):
+                planilha.append(linha)
+    livro.save(caminho)
+
+
+def exportar_parquet(df, caminho):
+    df.to_parquet(caminho, index=False, compression='zstd')
+
+
+def exportar_imagens_anotadas(df, arquivo_zip, caminho):
+    """
+    Grava um .zip com as imagens do upload que têm detecções, com a caixa do
+    trilho e as caixas da fase 2 desenhadas. Requer as colunas de caixa de
+    ``tabela_deteccoes``; as imagens são lidas e gravadas uma por vez.
+    """
+    import io
+    from PIL import Image, ImageDraw
+    por_imagem = {nome: grupo for nome, grupo in df.groupby('imagem', observed=True, sort=False)}
+    manifesto = _itens_manifesto(arquivo_zip, por_imagem)
+    with zipfile.ZipFile(caminho, 'w', compression=zipfile.ZIP_STORED) as saida:
+        for nome, dados in iterar_bytes_zip(arquivo_zip, manifesto=manifesto):
+            with Image.open(io.BytesIO(dados)) as imagem:
+                imagem = imagem.convert('RGB')
+            desenho = ImageDraw.Draw(imagem)
+            grupo = por_imagem[nome]
+            trilhos = grupo.drop_duplicates('indice_trilho')
+            for caixa in trilhos[['x1_trilho', 'y1_trilho', 'x2_trilho', 'y2_trilho']].itertuples(index=False, name=None):
+                desenho.rectangle(caixa, outline=COR_TRILHO, width=3)
+            # Repetições de um grupo de recortes não têm caixa própria.
+            for linha in grupo.dropna(subset=['x1_imagem']).itertuples(index=False):
+                caixa = (linha.x1_imagem, linha.y1_imagem, linha.x2_imagem, linha.y2_imagem)
+                desenho.rectangle(caixa, outline=COR_DETECCAO, width=2)
+                desenho.text((caixa[0], max(caixa[1] - 12, 0)), f"{linha.Classificação} {linha.conf:.2f}", fill=COR_DETECCAO)
+            buffer = io.BytesIO()
+            imagem.save(buffer, format='JPEG', quality=90)
+            saida.writestr(os.path.splitext(nome)[0] + '.jpg', buffer.getvalue())
+
+
+def _itens_manifesto(arquivo_zip, nomes):
+    with zipfile.ZipFile(arquivo_zip, 'r') as zip_ref:
+        presentes = {info.filename: info for info in zip_ref.infolist()}
+    return [ItemManifesto(nome, presentes[nome].file_size, presentes[nome]) for nome in nomes if nome in presentes]
+
+
+class ExportacoesAnalise:
+    """
+    Arquivos exportados de uma análise, gerados sob demanda e reaproveitados.
+
+    - ``dir_exportacoes``: diretório base; cada análise ocupa ``<id_analise>/``.
+    """
+    def __init__(self, dir_exportacoes, id_analise):
+        self.caminho = os.path.join(dir_exportacoes, id_analise)
+        os.makedirs(self.caminho, exist_ok=True)
+
+    def caminho_formato(self, formato):
+        return os.path.join(self.caminho, FORMATOS[formato][0])
+
+    def existe(self, formato):
+        return os.path.exists(self.caminho_formato(formato))
+
+    def obter(self, formato, df, arquivo_zip=None):
+        """
+        Retorna o caminho do arquivo no ``formato`` pedido, gerando-o na
+        primeira chamada (escrita em arquivo temporário e troca atômica).
+        """
+        destino = self.caminho_formato(formato)
+        if os.path.exists(destino):
+            return destino
+        temporario = os.path.join(self.caminho, f".{uuid.uuid4().hex}-{FORMATOS[formato][0]}")
+        try:
+            if formato == 'csv':
+                exportar_csv(df, temporario)
+            elif formato == 'csv.gz':
+                exportar_csv(df, temporario, compactar=True)
+            elif formato == 'xlsx':
+                exportar_xlsx(df, temporario)
+            elif formato == 'parquet':
+                exportar_parquet(df, temporario)
+            elif formato == 'imagens':
+                exportar_imagens_anotadas(df, arquivo_zip, temporario)
+            os.replace(temporario, destino)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temporario)
+        return destino
+
+
+def limpar_exportacoes(dir_exportacoes, idade_max_s=24 * 3600):
+    """
+    Remove as exportações de análises geradas há mais de ``idade_max_s``.
+    """
+    if not os.path.isdir(dir_exportacoes):
+        return []
+    removidos = []
+    agora = time.time()
+    for nome in os.listdir(dir_exportacoes):
+        caminho = os.path.join(dir_exportacoes, nome)
+        if os.path.isdir(caminho) and agora - os.path.getmtime(caminho) > idade_max_s:
+            shutil.rmtree(caminho, ignore_errors=True)
+            removidos.append(caminho)
+    return removidos
@@ -0,0 +1,74 @@
+"""
+Inferência fatiada da fase 2 sobre os recortes de trilho.
+
+Um recorte de trilho é longo e estreito; redimensionado inteiro para o
+``imgsz`` do modelo, perde a resolução em que as trincas finas aparecem.
+No modo fatiado cada recorte é dividido em janelas sobrepostas do tamanho da
+entrada do modelo, as janelas de todos os recortes (e de várias imagens) são
+enviadas juntas em lotes e as caixas voltam para as coordenadas do recorte,
+onde as duplicadas nas sobreposições são suprimidas. Só as regiões que a
+fase 1 marcou como trilho são fatiadas: o restante da imagem (lastro,
+dormentes) não custa nada, ao contrário de aumentar o ``imgsz`` da imagem toda.
+"""
+import numpy as np
+
+# Duas caixas da mesma classe são a mesma detecção quando a interseção cobre
+# esta fração da menor delas (uma caixa cortada na borda da janela fica
+# quase toda dentro da caixa completa vista pela janela vizinha).
+LIMIAR_SOBREPOSICAO = 0.5
+
+
+def _inicios(comprimento, tamanho, passo):
+    if comprimento <= tamanho:
+        return [0]
+    inicios = list(range(0, comprimento - tamanho, passo))
+    # A última janela encosta na borda, em vez de passar dela.
+    inicios.append(comprimento - tamanho)
+    return inicios
+
+
+def janelas(altura, largura, tamanho, sobreposicao=0.2):
+    """
+    Janelas ``(x1, y1, x2, y2)`` de até ``tamanho`` pixels que cobrem uma
+    imagem ``altura`` x ``largura``, com ``sobreposicao`` (fração) entre vizinhas.
+    """
+    passo = max(1, int(tamanho * (1 - sobreposicao)))
+    return [
+        (x, y, min(x + tamanho, largura), min(y + tamanho, altura))
+        for y in _inicios(altura, tamanho, passo)
+        for x in _inicios(largura, tamanho, passo)
+    ]
+
+
+def fatiar(recorte, tamanho, sobreposicao=0.2):
+    """
+    Gera ``((x1, y1), fatia)`` para cada janela do recorte; as fatias são cópias contíguas.
+    """
+    altura, largura = recorte.shape[:2]
+    for x1, y1, x2, y2 in janelas(altura, largura, tamanho, sobreposicao):
+        yield (x1, y1), np.ascontiguousarray(recorte[y1:y2, x1:x2])
+
+
+def suprimir_duplicadas(caixas, limiar=LIMIAR_SOBREPOSICAO):
+    """
+    Supressão de não-máximos por classe sobre ``(classe, conf, (x1, y1, x2, y2))``,
+    usando a interseção sobre a menor caixa. Mantém a ordem por confiança.
+    """
+    mantidas = []
+    for classe in dict.fromkeys(c for c, _, _ in caixas):
+        grupo = sorted((c for c in caixas if c[0] == classe), key=lambda c: c[1], reverse=True)
+        xyxy = np.array([c[2] for c in grupo], dtype=float).reshape(-1, 4)
+        areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+        ativas = np.ones(len(grupo), dtype=bool)
+        for i in range(len(grupo)):
+            if not ativas[i]:
+                continue
+            mantidas.append(grupo[i])
+            resto = np.nonzero(ativas[i + 1:])[0] + i + 1
+            if not len(resto):
+                continue
+            largura = np.clip(np.minimum(xyxy[i, 2], xyxy[resto, 2]) - np.maximum(xyxy[i, 0], xyxy[resto, 0]), 0, None)
+            altura = np.clip(np.minimum(xyxy[i, 3], xyxy[resto, 3]) - np.maximum(xyxy[i, 1], xyxy[resto, 1]), 0, None)
+            menor = np.maximum(np.minimum(areas[i], areas[resto]), 1e-9)
+            ativas[resto[largura * altura / menor >= limiar]] = False
+    return sorted(mantidas, key=lambda c: c[1], reverse=True)
@@ -0,0 +1,113 @@
+"""
+Gráficos do relatório para conjuntos grandes de detecções.
+
+Os dados são agregados no servidor antes de irem para o navegador: contagens
+por Pátio, histograma por faixa de KM e, na dispersão KM x Metro, pontos
+agrupados em passos de alguns metros quando há detecções demais. A dispersão
+usa traços WebGL (``render_mode='webgl'``) e o tamanho do JSON enviado é
+medido e limitado, engrossando a agregação até caber (no limite, a dispersão
+dá lugar ao histograma por faixa de KM). Quando a análise
+agrupou os recortes repetidos entre quadros, cada grupo conta uma vez.
+"""
+import pandas as pd
+
+from rcf.espacial import posicao
+from rcf.relatorio import defeitos_distintos
+
+LIMITE_PONTOS = 20000
+LIMITE_BYTES_GRAFICO = 2 * 1024 ** 2
+# Passos (em metros) tentados, do mais fino ao mais grosso, quando há pontos demais.
+PASSOS_METRO = (1, 10, 50, 100, 250, 500, 1000, 5000)
+# Faixas (em KM) do histograma usado quando nem a dispersão mais agregada cabe no limite.
+LARGURAS_KM_RESERVA = (1, 5, 10, 50, 100, 500)
+
+
+def tamanho_payload(fig):
+    """
+    Tamanho em bytes do JSON da figura, que é o que vai para o navegador.
+    """
+    return len(fig.to_json().encode('utf-8'))
+
+
+def contagem_por_patio(df):
+    return df.groupby(['Pátio', 'Classificação'], observed=True).size().reset_index(name='Contagem')
+
+
+def histograma_km(df, largura_km=1):
+    """
+    Contagem de detecções por faixa de ``largura_km`` quilômetros e classificação.
+    """
+    faixa = (df['KM'] // largura_km) * largura_km
+    return (
+        df.assign(KM=faixa.astype('int64'))
+        .groupby(['KM', 'Classificação'], observed=True).size().reset_index(name='Contagem')
+    )
+
+
+def agregar_pontos(df, passo_m):
+    """
+    Agrupa as detecções em trechos de ``passo_m`` metros por classificação;
+    cada grupo vira um ponto no início do trecho, com a contagem.
+    """
+    trecho = posicao(df['KM'].to_numpy(), df['Metro'].to_numpy()) // passo_m * passo_m
+    agregados = (
+        pd.DataFrame({'trecho': trecho, 'Classificação': df['Classificação'].to_numpy()})
+        .groupby(['Classificação', 'trecho'], observed=True).size().reset_index(name='Contagem')
+    )
+    agregados['KM'] = agregados['trecho'] // 1000
+    agregados['Metro'] = agregados['trecho'] % 1000
+    return agregados.drop(columns='trecho')
+
+
+def figura_barras_patio(df):
+    import plotly.express as px
+    return px.bar(contagem_por_patio(defeitos_distintos(df)), x='Pátio', y='Contagem', color='Classificação',
+                  title='Contagem de Defeitos por Pátio')
+
+
+def figura_histograma_km(df, largura_km=1):
+    import plotly.express as px
+    return px.bar(histograma_km(defeitos_distintos(df), largura_km), x='KM', y='Contagem', color='Classificação',
+                  title=f'Defeitos por faixa de {largura_km} KM')
+
+
+def _dispersao(dados, agregado):
+    import plotly.express as px
+    return px.scatter(
+        dados, x='KM', y='Metro', color='Classificação', render_mode='webgl',
+        size='Contagem' if agregado else None, hover_data=['Contagem'] if agregado else None,
+        title='Localização de Defeitos por KM e Metro',
+    )
+
+
+def figura_dispersao(df, limite_pontos=LIMITE_PONTOS, limite_bytes=LIMITE_BYTES_GRAFICO):
+    """
+    Dispersão KM x Metro em WebGL. Até ``limite_pontos`` detecções os pontos
+    vão individualmente; acima disso, ou se o JSON passar de ``limite_bytes``,
+    são agregados em trechos cada vez maiores. Se nem o maior trecho couber, a
+    figura passa a ser o histograma por faixa de KM (``LARGURAS_KM_RESERVA``).
+
+    Retorna ``(fig, passo_m, bytes, histograma)``; ``passo_m`` é None sem
+    agregação e, com ``histograma``, é a largura da faixa em metros. Só um
+    ``limite_bytes`` menor que o histograma mais grosso (alguns KB) faz a
+    figura devolvida passar do limite; ``bytes`` permite conferir.
+    """
+    df = defeitos_distintos(df)
+    passos = [None] + list(PASSOS_METRO) if len(df) <= limite_pontos else list(PASSOS_METRO)
+    for passo in passos:
+        if passo is None:
+            dados = df[['KM', 'Metro', 'Classificação']]
+        else:
+            dados = agregar_pontos(df, passo)
+            if len(dados) > limite_pontos and passo != passos[-1]:
+                continue
+        fig = _dispersao(dados, passo is not None)
+        tamanho = tamanho_payload(fig)
+        if tamanho <= limite_bytes:
+            return fig, passo, tamanho, False
+    for largura_km in LARGURAS_KM_RESERVA:
+        fig = figura_histograma_km(df, largura_km)
+        tamanho = tamanho_payload(fig)
+        if tamanho <= limite_bytes:
+            break
+    return fig, largura_km * 1000, tamanho, True
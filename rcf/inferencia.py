@@ -0,0 +1,188 @@
+"""
+Configuração da inferência de cada fase e ajuste automático do tamanho de lote.
+
+Nos servidores sem GPU a vazão por núcleo é o que limita o número de
+levantamentos por turno; por isso lote, tamanho de entrada e número de
+threads são explícitos por fase, e o lote pode ser escolhido medindo a
+vazão real do modelo com a memória disponível.
+"""
+import copy
+import os
+import threading
+import time
+
+LOTES_CANDIDATOS = (1, 2, 4, 8, 16, 32, 64)
+
+# Multiplicador aproximado sobre o tamanho do tensor de entrada para estimar a
+# memória de ativação de um YOLO pequeno/médio durante a predição.
+FATOR_MEMORIA_ATIVACOES = 40
+# Confiança mínima da triagem: baixa, porque um trilho perdido ali não volta mais.
+CONF_TRIAGEM = 0.05
+
+
+class ConfigFase:
+    """
+    Parâmetros de predição de uma fase.
+
+    - ``lote``: imagens por chamada de ``predict``; 0 ou None = ajuste automático.
+    - ``imgsz``: tamanho de entrada do modelo.
+    - ``threads``: threads do PyTorch durante a fase; None = padrão do processo.
+    - ``half``: meia precisão. O ultralytics só a aplica em GPU; em CPU é ignorada.
+      Quantização INT8 depende de um backend exportado, não do ``.pt``.
+    - ``conf``: confiança mínima das detecções (None = padrão do modelo).
+    - ``max_det``: máximo de detecções por imagem (None = padrão do modelo).
+    - ``backend``: 'pytorch', 'onnx' ou 'openvino' (ver ``rcf.backends``).
+    - ``fatia``: lado, em pixels, das fatias em que cada recorte é dividido
+      (só na fase 2; None = recorte inteiro). ``sobreposicao`` é a fração
+      sobreposta entre fatias vizinhas.
+    - ``deduplicar``: agrupa recortes repetidos entre quadros consecutivos e
+      roda só o representante de cada grupo (só na fase 2; ver ``rcf.duplicatas``).
+    - ``decodificadores``: threads de decodificação das imagens (só na fase 1).
+    - ``profundidade``: imagens decodificadas à frente da inferência (só na
+      fase 1; None = dois lotes).
+    - ``triagem``: tamanho de entrada de uma passada prévia, barata, do modelo
+      da fase 1 que descarta imagens sem candidatos a trilho (só na fase 1;
+      None = sem triagem). ``conf_triagem`` é a confiança mínima dessa passada,
+      baixa para não perder trilhos.
+    - ``reduzir``: decodifica JPEGs já reduzidos para perto da entrada dos
+      modelos (só na fase 1; ver ``lado_decodificacao``).
+    """
+    def __init__(self, lote=16, imgsz=640, threads=None, half=False, conf=None, max_det=None, backend='pytorch',
+                 fatia=None, sobreposicao=0.2, deduplicar=False, decodificadores=1, profundidade=None, reduzir=False,
+                 triagem=None, conf_triagem=CONF_TRIAGEM):
+        self.lote = lote
+        self.imgsz = imgsz
+        self.threads = threads
+        self.half = half
+        self.conf = conf
+        self.max_det = max_det
+        self.backend = backend
+        self.fatia = fatia
+        self.sobreposicao = sobreposicao
+        self.deduplicar = deduplicar
+        self.decodificadores = decodificadores
+        self.profundidade = profundidade
+        self.reduzir = reduzir
+        self.triagem = triagem
+        self.conf_triagem = conf_triagem
+
+    def kwargs_predict(self):
+        kwargs = {'imgsz': self.imgsz, 'half': self.half, 'verbose': False}
+        if self.conf is not None:
+            kwargs['conf'] = self.conf
+        if self.max_det is not None:
+            kwargs['max_det'] = self.max_det
+        return kwargs
+
+    def profundidade_leitura(self):
+        return self.profundidade or 2 * (self.lote or 16)
+
+    def __repr__(self):
+        # Todos os campos, na ordem do construtor, para que um campo novo nunca fique de fora.
+        campos = ', '.join(f"{nome}={valor!r}" for nome, valor in vars(self).items())
+        return f"ConfigFase({campos})"
+
+
+_threads_lock = threading.Lock()
+
+
+def aplicar_threads(threads):
+    """
+    Ajusta o número de threads intra-op do PyTorch (configuração do processo).
+    """
+    if not threads:
+        return
+    with _threads_lock:
+        import torch
+        if torch.get_num_threads() != threads:
+            torch.set_num_threads(threads)
+
+
+def memoria_disponivel():
+    """
+    Memória disponível em bytes (MemAvailable do Linux), ou None se desconhecida.
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for linha in f:
+                if linha.startswith('MemAvailable:'):
+                    return int(linha.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def memoria_estimada_lote(lote, imgsz):
+    return lote * 3 * imgsz * imgsz * 4 * FATOR_MEMORIA_ATIVACOES
+
+
+_lotes_ajustados = {}
+_lotes_lock = threading.Lock()
+
+
+def ajustar_lote(modelo, imgsz=640, threads=None, candidatos=LOTES_CANDIDATOS, repeticoes=2,
+                 memoria=None, fracao_memoria=0.5, tolerancia=0.05, chave=None):
+    """
+    Escolhe o lote com maior vazão (imagens/s) que cabe na memória disponível.
+
+    Cada candidato é medido com imagens pretas de ``imgsz``; a busca para quando
+    a vazão cai mais que ``tolerancia`` em relação ao melhor resultado, já que
+    em CPU lotes maiores deixam de ajudar quando os núcleos estão saturados.
+    O resultado é memorizado por ``chave`` (ex.: nome e versão do modelo); com
+    chave, ajustes simultâneos (sessão do app e workers em threads) são
+    serializados, para que o mesmo modelo não seja medido duas vezes.
+    Retorna ``(melhor_lote, medicoes)`` com ``medicoes = {lote: imagens/s}``.
+    """
+    argumentos = (modelo, imgsz, threads, candidatos, repeticoes, memoria, fracao_memoria, tolerancia)
+    if chave is None:
+        return _medir_lotes(*argumentos)
+    chave = (chave, imgsz, threads)
+    with _lotes_lock:
+        if chave not in _lotes_ajustados:
+            _lotes_ajustados[chave] = _medir_lotes(*argumentos)
+        return _lotes_ajustados[chave]
+
+
+def _medir_lotes(modelo, imgsz, threads, candidatos, repeticoes, memoria, fracao_memoria, tolerancia):
+    import numpy as np
+
+    memoria = memoria_disponivel() if memoria is None else memoria
+    limite = memoria * fracao_memoria if memoria else None
+    aplicar_threads(threads)
+
+    medicoes = {}
+    melhor_lote, melhor_vazao = candidatos[0], 0.0
+    for lote in candidatos:
+        if limite is not None and lote > candidatos[0] and memoria_estimada_lote(lote, imgsz) > limite:
+            break
+        imagens = [np.zeros((imgsz, imgsz, 3), dtype=np.uint8) for _ in range(lote)]
+        # A primeira chamada com um novo lote inclui alocações; não entra na medida.
+        modelo.predict(source=imagens, imgsz=imgsz, verbose=False, save=False)
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            modelo.predict(source=imagens, imgsz=imgsz, verbose=False, save=False)
+        vazao = lote * repeticoes / max(time.perf_counter() - inicio, 1e-9)
+        medicoes[lote] = vazao
+        if vazao > melhor_vazao:
+            melhor_lote, melhor_vazao = lote, vazao
+        elif vazao < melhor_vazao * (1 - tolerancia):
+            break
+    return melhor_lote, medicoes
+
+
+def resolver_config(config, modelo, nome=None):
+    """
+    Retorna a configuração com o lote definido, executando o ajuste automático
+    quando ``config.lote`` for 0/None. ``modelo`` pode ser um ``ModeloCarregado``.
+    """
+    if config.lote:
+        return config
+    assinatura = getattr(modelo, 'assinatura', None)
+    chave = (nome, assinatura) if assinatura is not None else None
+    lote, _ = ajustar_lote(modelo, config.imgsz, config.threads, chave=chave)
+    resolvida = copy.copy(config)
+    resolvida.lote = lote
+    return resolvida
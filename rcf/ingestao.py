@@ -0,0 +1,268 @@
+"""
+Leitura das imagens diretamente do arquivo .zip, sem ``extractall``.
+
+Os membros de imagem são listados a partir do diretório central do zip,
+validados contra limites de tamanho (proteção contra zip bomb) e decodificados
+sob demanda. A decodificação pode rodar em várias threads (o Pillow libera o
+GIL ao decodificar) e, para JPEG, já em escala reduzida próxima da entrada do
+modelo (modo *draft*). Uma thread de pré-leitura mantém uma fila limitada de
+imagens já decodificadas, de modo que a leitura se sobrepõe à inferência, e
+mede quanto tempo a inferência ficou esperando por ela.
+"""
+import collections
+import os
+import queue
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from rcf.manifesto import eh_imagem, manifesto_diretorio, manifesto_membros
+from rcf.metricas import medir
+
+
+class LimitesZip:
+    """
+    Limites aplicados ao conteúdo do zip.
+
+    - ``max_membro_bytes``: tamanho descompactado máximo de uma imagem; maiores são ignoradas.
+    - ``max_total_bytes``: soma máxima dos tamanhos descompactados das imagens.
+    - ``max_membros``: número máximo de imagens.
+    - ``max_razao``: razão máxima descompactado/compactado de um membro.
+    """
+    def __init__(self, max_membro_bytes=64 * 1024 ** 2, max_total_bytes=20 * 1024 ** 3,
+                 max_membros=200_000, max_razao=200):
+        self.max_membro_bytes = max_membro_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_membros = max_membros
+        self.max_razao = max_razao
+
+
+class ZipInvalido(ValueError):
+    """
+    O arquivo .zip viola os limites configurados e não deve ser processado.
+    """
+
+
+def listar_membros_imagem(zip_ref, limites=None):
+    """
+    Seleciona os membros de imagem do zip aplicando os limites.
+    Retorna ``(membros, avisos)``; lança ``ZipInvalido`` se o total exceder o limite.
+    """
+    limites = limites or LimitesZip()
+    membros = []
+    avisos = []
+    total = 0
+    for info in zip_ref.infolist():
+        if info.is_dir() or not eh_imagem(info.filename):
+            continue
+        if info.file_size > limites.max_membro_bytes:
+            avisos.append(f"Aviso: '{info.filename}' excede o tamanho máximo por imagem e foi ignorado.")
+            continue
+        if info.compress_size and info.file_size / info.compress_size > limites.max_razao:
+            avisos.append(f"Aviso: '{info.filename}' tem taxa de compressão suspeita e foi ignorado.")
+            continue
+        total += info.file_size
+        membros.append(info)
+        if total > limites.max_total_bytes:
+            raise ZipInvalido("O conteúdo descompactado do .zip excede o limite permitido.")
+        if len(membros) > limites.max_membros:
+            raise ZipInvalido("O .zip contém mais imagens do que o limite permitido.")
+    return membros, avisos
+
+
+def manifesto_zip(zip_ref, limites=None, deduplicar=True):
+    """
+    Manifesto de todas as imagens do zip, em todas as pastas, sem duplicatas.
+    Retorna ``(itens, avisos)``.
+    """
+    membros, avisos = listar_membros_imagem(zip_ref, limites)
+    itens, avisos_manifesto = manifesto_membros(zip_ref, membros, deduplicar)
+    return itens, avisos + avisos_manifesto
+
+
+def ler_membro(zip_ref, info, limites=None):
+    """
+    Lê os bytes de um membro, sem confiar no tamanho declarado no cabeçalho.
+    """
+    limites = limites or LimitesZip()
+    with zip_ref.open(info) as f:
+        dados = f.read(limites.max_membro_bytes + 1)
+    if len(dados) > limites.max_membro_bytes:
+        raise ZipInvalido(f"'{info.filename}' é maior do que o declarado no .zip.")
+    return dados
+
+
+def decodificar_imagem(dados, lado_minimo=None):
+    """
+    Decodifica bytes de imagem para um array HxWx3 uint8 em ordem BGR (a mesma
+    que o ultralytics espera para arrays numpy).
+
+    Com ``lado_minimo``, JPEGs são decodificados já reduzidos (1/2, 1/4 ou
+    1/8) pelo modo *draft* do Pillow, mantendo o maior lado com pelo menos
+    ``lado_minimo`` pixels. Retorna ``(imagem, fator)``, em que ``fator`` é a
+    razão entre o tamanho original e o decodificado (1.0 sem redução).
+    """
+    import io
+    import numpy as np
+    from PIL import Image
+    with Image.open(io.BytesIO(dados)) as img:
+        largura = img.size[0]
+        if lado_minimo and max(img.size) > lado_minimo:
+            escala = lado_minimo / max(img.size)
+            img.draft('RGB', (int(img.size[0] * escala + 0.5), int(img.size[1] * escala + 0.5)))
+        fator = largura / img.size[0]
+        # JPEGs coloridos já vêm em RGB; ``convert`` só copiaria a imagem.
+        rgb = np.asarray(img if img.mode == 'RGB' else img.convert('RGB'))
+    return np.ascontiguousarray(rgb[:, :, ::-1]), fator
+
+
+def iterar_bytes_zip(arquivo_zip, limites=None, avisos=None, manifesto=None):
+    """
+    Gera ``(nome, bytes)`` para cada imagem do manifesto do zip, sem decodificar.
+    Se ``manifesto`` (lista de ``ItemManifesto``) não for informado, é montado aqui.
+    """
+    limites = limites or LimitesZip()
+    with zipfile.ZipFile(arquivo_zip, 'r') as zip_ref:
+        if manifesto is None:
+            manifesto, avisos_manifesto = manifesto_zip(zip_ref, limites)
+            if avisos is not None:
+                avisos.extend(avisos_manifesto)
+        for item in manifesto:
+            yield item.caminho, ler_membro(zip_ref, zip_ref.getinfo(item.caminho), limites)
+
+
+def iterar_bytes_arquivos(manifesto):
+    """
+    Gera ``(caminho, bytes)`` para cada imagem de um manifesto de diretório
+    (``manifesto_diretorio``), sem decodificar.
+    """
+    for item in manifesto:
+        with open(item.caminho, 'rb') as f:
+            yield item.caminho, f.read()
+
+
+def _decodificar(nome, dados, lado_minimo, metricas):
+    try:
+        with medir(metricas, 'decodificacao', imagens=1, bytes_lidos=len(dados)):
+            return decodificar_imagem(dados, lado_minimo), None
+    except Exception as e:
+        return None, e
+
+
+def decodificar_itens(itens, avisos=None, falhas=None, metricas=None, threads=1, lado_minimo=None, escalas=None):
+    """
+    Decodifica pares ``(nome, bytes)`` em ``(nome, imagem_bgr)``, na ordem de
+    entrada. Imagens que não podem ser decodificadas geram aviso e têm o nome
+    incluído em ``falhas``.
+
+    - ``threads``: decodificações simultâneas; a leitura dos bytes continua
+      sequencial, na thread que consome ``itens``.
+    - ``lado_minimo``: decodificação reduzida (ver ``decodificar_imagem``); o
+      fator de cada imagem reduzida é gravado em ``escalas[nome]``.
+    """
+    if threads > 1:
+        resultados = _decodificar_em_threads(itens, threads, lado_minimo, metricas)
+    else:
+        resultados = ((nome, _decodificar(nome, dados, lado_minimo, metricas)) for nome, dados in itens)
+    for nome, (decodificada, erro) in resultados:
+        if erro is not None:
+            if avisos is not None:
+                avisos.append(f"Aviso: não foi possível ler '{nome}': {erro}. Foi ignorado.")
+            if falhas is not None:
+                falhas.append(nome)
+            continue
+        imagem, fator = decodificada
+        if fator != 1.0 and escalas is not None:
+            escalas[nome] = fator
+        yield nome, imagem
+
+
+def _decodificar_em_threads(itens, threads, lado_minimo, metricas):
+    # Mantém no máximo 2 * threads imagens em decodificação e entrega na ordem de envio.
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='decodificacao') as executor:
+        em_andamento = collections.deque()
+        for nome, dados in itens:
+            em_andamento.append((nome, executor.submit(_decodificar, nome, dados, lado_minimo, metricas)))
+            if len(em_andamento) >= 2 * threads:
+                nome_pronto, futuro = em_andamento.popleft()
+                yield nome_pronto, futuro.result()
+        while em_andamento:
+            nome_pronto, futuro = em_andamento.popleft()
+            yield nome_pronto, futuro.result()
+
+
+def iterar_imagens_zip(arquivo_zip, limites=None, avisos=None, manifesto=None, falhas=None, metricas=None,
+                       threads=1, lado_minimo=None, escalas=None):
+    """
+    Gera ``(nome, imagem_bgr)`` para cada imagem do manifesto do zip.
+    Imagens que não podem ser decodificadas geram aviso.
+    """
+    return decodificar_itens(iterar_bytes_zip(arquivo_zip, limites, avisos, manifesto), avisos, falhas, metricas,
+                             threads, lado_minimo, escalas)
+
+
+def carregar_amostra(origem, limite=None):
+    """
+    Decodifica as primeiras ``limite`` imagens de ``origem`` (.zip ou diretório)
+    em uma lista de ``(nome, imagem_bgr)``, para avaliações sobre amostras.
+    """
+    if os.path.isdir(origem):
+        manifesto, _ = manifesto_diretorio(origem)
+        itens = iterar_bytes_arquivos(manifesto[:limite])
+    else:
+        with zipfile.ZipFile(origem, 'r') as zip_ref:
+            manifesto, _ = manifesto_zip(zip_ref)
+        itens = iterar_bytes_zip(origem, manifesto=manifesto[:limite])
+    return list(decodificar_itens(itens))
+
+
+_FIM = object()
+
+
+def pre_carregar(iteravel, profundidade=32, metricas=None):
+    """
+    Consome ``iteravel`` em uma thread separada, mantendo no máximo
+    ``profundidade`` itens prontos. Exceções da thread são relançadas no consumidor.
+    O tempo em que o consumidor ficou parado com a fila vazia é somado à etapa
+    ``espera_leitura`` de ``metricas``: perto de zero, a inferência nunca espera pela leitura.
+    """
+    fila = queue.Queue(maxsize=profundidade)
+    parar = threading.Event()
+
+    def colocar(item):
+        while not parar.is_set():
+            try:
+                fila.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produtor():
+        try:
+            for item in iteravel:
+                if not colocar(item):
+                    return
+            colocar(_FIM)
+        except BaseException as e:
+            colocar(e)
+
+    thread = threading.Thread(target=produtor, daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                item = fila.get_nowait()
+            except queue.Empty:
+                inicio = time.perf_counter()
+                item = fila.get()
+                if metricas is not None:
+                    metricas.somar('espera_leitura', chamadas=1, tempo_s=time.perf_counter() - inicio)
+            if item is _FIM:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        parar.set()
@@ -0,0 +1,256 @@
+"""
+Análise de levantamentos sem interface: API Python e linha de comando.
+
+Encadeia leitura, fase 1, fase 2 e relatório para um diretório ou .zip e
+grava o resultado no acervo e, se pedido, os relatórios exportados. Serve
+para processar lotes noturnos sem sessão do navegador::
+
+    python -m rcf /dados/riv/2024-05/*.zip --processos 4 --exportar relatorios
+
+Os pesos vêm do cache de modelos e são revalidados na fonte depois de
+``--max-idade-modelos``; ``python -m rcf --atualizar-modelos`` baixa de novo
+na hora, para quando pesos novos forem publicados com o mesmo ID.
+
+O import é leve (sem Streamlit, plotly, pandas ou ultralytics); as
+bibliotecas pesadas só são carregadas quando a análise começa.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import uuid
+
+DIR_CACHE_MODELOS = os.environ.get("RIV_CACHE_MODELOS", "cache_modelos")
+FONTE_MODELOS = os.environ.get("RIV_FONTE_MODELOS", "gdrive")
+CAMINHO_CACHE_RESULTADOS = os.environ.get("RIV_CACHE_RESULTADOS", os.path.join("cache_resultados", "resultados.db"))
+DIR_ACERVO = os.environ.get("RIV_ACERVO", "acervo")
+
+# Intervalo mínimo entre as mensagens de andamento na linha de comando.
+INTERVALO_MENSAGEM_S = 5
+
+
+class ResultadoLevantamento:
+    """
+    Resultado da análise de um levantamento: ``df`` e ``rejeitados`` de
+    ``tabela_deteccoes``, o ``ResultadoAnalise`` (``analise``), as métricas
+    das etapas e os caminhos dos relatórios exportados, por formato.
+    """
+    def __init__(self, origem, id_analise, df, rejeitados, analise, metricas, exportados=None, linhas_acervo=0):
+        self.origem = origem
+        self.id_analise = id_analise
+        self.df = df
+        self.rejeitados = rejeitados
+        self.analise = analise
+        self.metricas = metricas
+        self.exportados = exportados or {}
+        self.linhas_acervo = linhas_acervo
+
+
+def expandir_origens(padroes):
+    """
+    Expande os padrões (glob, com ``**``) em diretórios e arquivos .zip, em
+    ordem e sem repetição. Padrões sem correspondência são ignorados.
+    """
+    origens = []
+    for padrao in padroes:
+        for caminho in sorted(glob.glob(padrao, recursive=True)):
+            if (os.path.isdir(caminho) or caminho.lower().endswith('.zip')) and caminho not in origens:
+                origens.append(caminho)
+    return origens
+
+
+def id_para(origem):
+    """
+    ID de análise a partir do nome da origem, único por execução.
+    """
+    nome = os.path.splitext(os.path.basename(os.path.normpath(origem)))[0]
+    return f"{nome}-{uuid.uuid4().hex[:8]}"
+
+
+def analisar_levantamento(origem, path_modelo_f1, path_modelo_f2, config_f1=None, config_f2=None, processos=1,
+                          cache=None, acervo=None, dir_exportacoes=None, formatos=('csv',), id_analise=None,
+                          metricas=None, ao_lote=None):
+    """
+    Analisa um levantamento (diretório ou .zip) e monta o relatório.
+
+    - ``cache``: ``CacheResultados`` opcional.
+    - ``acervo``: ``AcervoResultados`` onde o resultado é anexado, se informado.
+    - ``dir_exportacoes``/``formatos``: relatórios gravados em
+      ``<dir_exportacoes>/<id_analise>/`` (formatos de ``rcf.exportacao.FORMATOS``).
+    - ``metricas``: ``Metricas`` opcional; uma nova é criada se não informada.
+
+    Retorna um ``ResultadoLevantamento``. Um formato desconhecido levanta
+    ``ValueError`` antes da análise começar.
+    """
+    from rcf.analise import analisar_diretorio, analisar_zip
+    from rcf.exportacao import FORMATOS
+    from rcf.metricas import Metricas
+    from rcf.relatorio import tabela_deteccoes
+
+    desconhecidos = [formato for formato in formatos if formato not in FORMATOS]
+    if desconhecidos:
+        raise ValueError(f"Formatos de exportação desconhecidos: {', '.join(desconhecidos)} "
+                         f"(disponíveis: {', '.join(FORMATOS)}).")
+    id_analise = id_analise or id_para(origem)
+    metricas = metricas if metricas is not None else Metricas()
+    analisar = analisar_diretorio if os.path.isdir(origem) else analisar_zip
+    analise = analisar(path_modelo_f1, path_modelo_f2, origem, config_f1, config_f2, processos,
+                       cache=cache, ao_lote=ao_lote, metricas=metricas)
+    with metricas.etapa('relatorio', imagens=len(analise.manifesto)):
+        df, rejeitados = tabela_deteccoes(analise.deteccoes)
+
+    linhas_acervo = 0
+    if acervo is not None:
+        with metricas.etapa('acervo'):
+            linhas_acervo = acervo.anexar(df, id_analise)
+
+    exportados = {}
+    if dir_exportacoes:
+        from rcf.exportacao import ExportacoesAnalise
+        exportacoes = ExportacoesAnalise(dir_exportacoes, id_analise)
+        arquivo_zip = None if os.path.isdir(origem) else origem
+        for formato in formatos:
+            if formato == 'imagens' and arquivo_zip is None:
+                continue
+            with metricas.etapa(f"exportacao_{formato}"):
+                exportados[formato] = exportacoes.obter(formato, df, arquivo_zip)
+    return ResultadoLevantamento(origem, id_analise, df, rejeitados, analise, metricas, exportados, linhas_acervo)
+
+
+# --- Linha de comando ---
+def _progresso_terminal(origem):
+    from rcf.analise import descrever_andamento
+    ultimo = {'mensagem': 0.0}
+
+    def ao_lote(andamento, deteccoes):
+        agora = time.monotonic()
+        if agora - ultimo['mensagem'] >= INTERVALO_MENSAGEM_S:
+            ultimo['mensagem'] = agora
+            print(f"[{os.path.basename(origem)}] {descrever_andamento(andamento)}", file=sys.stderr, flush=True)
+
+    return ao_lote
+
+
+def _argumentos():
+    from rcf.exportacao import FORMATOS
+    parser = argparse.ArgumentParser(prog="python -m rcf", description="Análise de RCF em levantamentos RIV, sem interface.")
+    parser.add_argument('origens', nargs='*', help="Diretórios, arquivos .zip ou padrões glob (ex.: 'dados/**/*.zip').")
+    parser.add_argument('--modelo-f1', help="Pesos da fase 1; sem ele, vêm do cache de modelos.")
+    parser.add_argument('--modelo-f2', help="Pesos da fase 2; sem ele, vêm do cache de modelos.")
+    parser.add_argument('--cache-modelos', default=DIR_CACHE_MODELOS)
+    parser.add_argument('--fonte-modelos', default=FONTE_MODELOS, help="gdrive, diretório local ou URL http(s).")
+    parser.add_argument('--max-idade-modelos', type=float, default=None, metavar='SEGUNDOS',
+                        help="Idade a partir da qual os pesos do cache são revalidados na fonte "
+                             "(padrão: RIV_MAX_IDADE_MODELOS ou 24 h; 0 = a cada execução).")
+    parser.add_argument('--atualizar-modelos', action='store_true',
+                        help="Baixa de novo os pesos da fonte antes de analisar; sem origens, só atualiza.")
+    parser.add_argument('--processos', type=int, default=1, help="Processos de inferência por levantamento.")
+    parser.add_argument('--threads', type=int, default=None, help="Threads do PyTorch por fase.")
+    parser.add_argument('--backend', choices=('pytorch', 'onnx', 'openvino'), default='pytorch',
+                        help="Backend de inferência das duas fases (ver rcf.backends).")
+    for fase in ('f1', 'f2'):
+        parser.add_argument(f'--lote-{fase}', type=int, default=16, help="0 = ajuste automático.")
+        parser.add_argument(f'--imgsz-{fase}', type=int, default=640)
+        parser.add_argument(f'--conf-{fase}', type=float, default=None)
+    parser.add_argument('--decodificadores', type=int, default=min(4, os.cpu_count() or 1),
+                        help="Threads de decodificação das imagens.")
+    parser.add_argument('--profundidade', type=int, default=None,
+                        help="Imagens decodificadas mantidas à frente da inferência (padrão: dois lotes).")
+    parser.add_argument('--decodificacao-reduzida', action='store_true',
+                        help="Decodifica os JPEGs já reduzidos para perto do tamanho de entrada dos modelos.")
+    parser.add_argument('--triagem-f1', type=int, default=None,
+                        help="Tamanho de entrada da triagem que descarta imagens sem trilho (ver python -m rcf.triagem).")
+    parser.add_argument('--fatia-f2', type=int, default=None,
+                        help="Lado, em pixels, das fatias dos recortes de trilho na fase 2 (sem ele, recorte inteiro).")
+    parser.add_argument('--sobreposicao-f2', type=float, default=0.2, help="Fração de sobreposição entre fatias.")
+    parser.add_argument('--agrupar-repetidos', action='store_true',
+                        help="Roda a fase 2 uma vez por grupo de recortes repetidos entre quadros consecutivos.")
+    parser.add_argument('--cache-resultados', default=CAMINHO_CACHE_RESULTADOS)
+    parser.add_argument('--sem-cache', action='store_true', help="Não usa o cache de resultados.")
+    parser.add_argument('--acervo', default=DIR_ACERVO)
+    parser.add_argument('--sem-acervo', action='store_true', help="Não grava no acervo.")
+    parser.add_argument('--exportar', metavar='DIRETORIO', help="Grava os relatórios em <DIRETORIO>/<id>/.")
+    parser.add_argument('--formatos', nargs='+', choices=list(FORMATOS), default=['csv'], metavar='FORMATO',
+                        help=f"Formatos exportados: {', '.join(FORMATOS)}.")
+    parser.add_argument('--silencioso', action='store_true', help="Sem mensagens de andamento.")
+    return parser
+
+
+def _cache_modelos(args):
+    from rcf.modelos import CacheModelos, fonte_por_uri
+    opcoes = {} if args.max_idade_modelos is None else {'max_idade_s': args.max_idade_modelos}
+    return CacheModelos(args.cache_modelos, fonte_por_uri(args.fonte_modelos), **opcoes)
+
+
+def main(argv=None):
+    parser = _argumentos()
+    args = parser.parse_args(argv)
+    if not args.origens and not args.atualizar_modelos:
+        parser.error("informe ao menos uma origem (ou --atualizar-modelos).")
+    if args.atualizar_modelos:
+        from rcf.modelos import MODEL_F1_ID, MODEL_F2_ID
+        cache_modelos = _cache_modelos(args)
+        for model_id in (MODEL_F1_ID, MODEL_F2_ID):
+            print(f"{model_id}\t{cache_modelos.atualizar(model_id)}")
+        if not args.origens:
+            return 0
+    origens = expandir_origens(args.origens)
+    if not origens:
+        print("Nenhum diretório ou .zip encontrado.", file=sys.stderr)
+        return 2
+
+    import contextlib
+    from rcf.inferencia import ConfigFase
+    from rcf.metricas import Metricas
+
+    config_f1 = ConfigFase(args.lote_f1, args.imgsz_f1, args.threads, conf=args.conf_f1, backend=args.backend,
+                           decodificadores=args.decodificadores, profundidade=args.profundidade,
+                           reduzir=args.decodificacao_reduzida, triagem=args.triagem_f1)
+    config_f2 = ConfigFase(args.lote_f2, args.imgsz_f2, args.threads, conf=args.conf_f2, backend=args.backend,
+                           fatia=args.fatia_f2, sobreposicao=args.sobreposicao_f2, deduplicar=args.agrupar_repetidos)
+    cache = None
+    if not args.sem_cache:
+        from rcf.cache_resultados import CacheResultados
+        cache = CacheResultados(args.cache_resultados)
+    acervo = None
+    if not args.sem_acervo:
+        from rcf.acervo import AcervoResultados
+        acervo = AcervoResultados(args.acervo)
+
+    falhas = 0
+    with contextlib.ExitStack() as modelos_em_uso:
+        if args.modelo_f1 and args.modelo_f2:
+            path_modelo_f1, path_modelo_f2 = args.modelo_f1, args.modelo_f2
+        else:
+            from rcf.modelos import MODEL_F1_ID, MODEL_F2_ID
+            cache_modelos = _cache_modelos(args)
+            path_modelo_f1 = args.modelo_f1 or modelos_em_uso.enter_context(cache_modelos.usar(MODEL_F1_ID))
+            path_modelo_f2 = args.modelo_f2 or modelos_em_uso.enter_context(cache_modelos.usar(MODEL_F2_ID))
+
+        for origem in origens:
+            metricas = Metricas()
+            try:
+                resultado = analisar_levantamento(
+                    origem, path_modelo_f1, path_modelo_f2, config_f1, config_f2, args.processos,
+                    cache=cache, acervo=acervo, dir_exportacoes=args.exportar, formatos=args.formatos,
+                    metricas=metricas, ao_lote=None if args.silencioso else _progresso_terminal(origem),
+                )
+            except Exception as e:
+                falhas += 1
+                print(f"[{origem}] falhou: {e}", file=sys.stderr)
+                continue
+            analise = resultado.analise
+            print(f"{origem}\t{resultado.id_analise}\t{len(analise.manifesto)} imagem(ns)\t"
+                  f"{len(resultado.df)} detecção(ões)\t{len(resultado.rejeitados)} rejeitada(s)\t"
+                  f"{len(analise.erros)} fragmento(s) com falha")
+            for aviso in analise.avisos:
+                print(f"[{origem}] {aviso}", file=sys.stderr)
+            if args.exportar:
+                with open(os.path.join(args.exportar, resultado.id_analise, 'metricas.json'), 'w', encoding='utf-8') as f:
+                    f.write(metricas.para_json())
+    return 1 if falhas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Descoberta de imagens em toda a árvore do upload.
+
+Substitui a busca pelo primeiro diretório com imagens: o manifesto lista
+todas as imagens do zip (ou de um diretório), com caminho e tamanho, remove
+arquivos idênticos e ordena o resultado para a formação dos lotes.
+"""
+import collections
+import hashlib
+import os
+import re
+
+EXTENSOES_IMAGEM = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+ItemManifesto = collections.namedtuple('ItemManifesto', ['caminho', 'tamanho', 'info'])
+ItemManifesto.__doc__ = """
+Imagem do upload: ``caminho`` (membro do zip ou caminho em disco),
+``tamanho`` descompactado em bytes e ``info`` (``ZipInfo`` ou None).
+"""
+
+
+def eh_imagem(nome):
+    """
+    Indica se o caminho (com separador '/') é uma imagem a ser analisada,
+    ignorando diretórios, arquivos ocultos e metadados do macOS.
+    """
+    base = os.path.basename(nome)
+    return (
+        not nome.endswith('/')
+        and not base.startswith('.')
+        and '__MACOSX' not in nome.split('/')
+        and base.lower().endswith(EXTENSOES_IMAGEM)
+    )
+
+
+def chave_natural(texto):
+    """
+    Chave de ordenação que compara os trechos numéricos como números
+    (``km_9`` antes de ``km_10``).
+    """
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r'(\d+)', texto)]
+
+
+def _ordenar(itens):
+    # Agrupa por pasta (pátio/dia) e, dentro dela, pela ordem natural do nome,
+    # que segue KM/metro; imagens vizinhas acabam no mesmo lote.
+    return sorted(itens, key=lambda i: (chave_natural(os.path.dirname(i.caminho)), chave_natural(os.path.basename(i.caminho))))
+
+
+def _sha256_arquivo(caminho):
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _sha256_membro(zip_ref, info):
+    h = hashlib.sha256()
+    with zip_ref.open(info) as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _deduplicar(itens, chave_barata, hash_completo):
+    """
+    Remove itens com conteúdo idêntico. Só calcula o SHA-256 dos itens que
+    colidem na chave barata (tamanho, CRC), evitando reler todo o upload.
+    """
+    grupos = collections.defaultdict(list)
+    for item in itens:
+        grupos[chave_barata(item)].append(item)
+
+    unicos = []
+    duplicados = []
+    for grupo in grupos.values():
+        if len(grupo) == 1:
+            unicos.append(grupo[0])
+            continue
+        vistos = {}
+        for item in _ordenar(grupo):
+            h = hash_completo(item)
+            if h in vistos:
+                duplicados.append((item.caminho, vistos[h].caminho))
+            else:
+                vistos[h] = item
+                unicos.append(item)
+    return unicos, duplicados
+
+
+def _avisos_duplicados(duplicados):
+    return [f"Aviso: '{dup}' é idêntico a '{original}' e foi analisado uma única vez." for dup, original in duplicados]
+
+
+def manifesto_membros(zip_ref, membros, deduplicar=True):
+    """
+    Manifesto a partir dos membros (``ZipInfo``) de imagem já selecionados de
+    um ``zipfile.ZipFile`` aberto. Retorna ``(itens, avisos)``.
+    """
+    avisos = []
+    itens = [ItemManifesto(info.filename, info.file_size, info) for info in membros]
+    if deduplicar:
+        itens, duplicados = _deduplicar(
+            itens,
+            lambda i: (i.tamanho, i.info.CRC),
+            lambda i: _sha256_membro(zip_ref, i.info),
+        )
+        avisos += _avisos_duplicados(duplicados)
+    return _ordenar(itens), avisos
+
+
+def manifesto_diretorio(base_dir, deduplicar=True):
+    """
+    Manifesto de todas as imagens de uma árvore de diretórios.
+    Retorna ``(itens, avisos)``.
+    """
+    itens = []
+    for root, dirs, files in os.walk(base_dir):
+        for file in files:
+            caminho = os.path.join(root, file)
+            if eh_imagem(os.path.relpath(caminho, base_dir).replace(os.sep, '/')):
+                itens.append(ItemManifesto(caminho, os.path.getsize(caminho), None))
+    avisos = []
+    if deduplicar:
+        itens, duplicados = _deduplicar(itens, lambda i: i.tamanho, lambda i: _sha256_arquivo(i.caminho))
+        avisos += _avisos_duplicados(duplicados)
+    return _ordenar(itens), avisos
+
+
+def resumo_manifesto(itens):
+    """
+    Quantidade de imagens e bytes por pasta, para exibição.
+    """
+    resumo = collections.OrderedDict()
+    for item in itens:
+        pasta = os.path.dirname(item.caminho) or '.'
+        qtd, total = resumo.get(pasta, (0, 0))
+        resumo[pasta] = (qtd + 1, total + item.tamanho)
+    return [{'Pasta': pasta, 'Imagens': qtd, 'Bytes': total} for pasta, (qtd, total) in resumo.items()]
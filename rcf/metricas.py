@@ -0,0 +1,204 @@
+"""
+Medição do tempo gasto em cada etapa de uma análise.
+
+Cada etapa (download dos modelos, leitura do zip, decodificação, fase 1,
+recortes, fase 2, relatório, exportação...) acumula tempo de parede, imagens,
+os bytes que ela informar e o pico de memória residente. Como as etapas se
+sobrepõem em threads (a decodificação roda junto com a inferência), o tempo de
+CPU e os contadores de E/S do processo não são atribuídos a etapas: aparecem
+uma vez, na entrada ``processo`` (``ETAPA_PROCESSO``), medidos desde a criação
+do ``Metricas``.
+O resumo pode ser exibido no app, gravado em JSON ou exportado no formato de
+texto do Prometheus. Opcionalmente a análise inteira roda sob o ``cProfile``,
+gerando um arquivo ``.prof`` (legível por ``pstats``, snakeviz etc.).
+"""
+import contextlib
+import json
+import sys
+import threading
+import time
+
+CAMPOS_SOMADOS = ('chamadas', 'tempo_s', 'cpu_s', 'imagens', 'bytes_lidos', 'bytes_escritos')
+ETAPA_PROCESSO = 'processo'
+
+
+def pico_rss_bytes():
+    """
+    Maior memória residente do processo até agora (0 se indisponível).
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss é em KB no Linux e em bytes no macOS.
+    return pico if sys.platform == 'darwin' else pico * 1024
+
+
+def contadores_io():
+    """
+    Bytes lidos e gravados pelo processo (``rchar``/``wchar`` de ``/proc/self/io``),
+    ou None onde não houver esse arquivo.
+    """
+    try:
+        with open('/proc/self/io') as f:
+            campos = dict(linha.split(':', 1) for linha in f.read().splitlines() if ':' in linha)
+        return int(campos['rchar']), int(campos['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _etapa_vazia():
+    etapa = {campo: 0 for campo in CAMPOS_SOMADOS}
+    etapa['pico_rss_bytes'] = 0
+    return etapa
+
+
+def medir(metricas, nome, **valores):
+    """
+    ``metricas.etapa(nome, ...)``, ou um contexto vazio se ``metricas`` for None.
+    """
+    return metricas.etapa(nome, **valores) if metricas is not None else contextlib.nullcontext()
+
+
+class Metricas:
+    """
+    Acumulador das métricas por etapa de uma análise. Seguro para uso por
+    várias threads (a decodificação roda em paralelo à inferência).
+
+    - ``perfil``: se verdadeiro, ``capturar_perfil()`` ativa o ``cProfile``.
+    """
+    def __init__(self, perfil=False):
+        self.perfil = perfil
+        self._etapas = {}
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._inicio = time.perf_counter()
+        self._cpu_inicio = time.process_time()
+        self._io_inicio = contadores_io()
+
+    @contextlib.contextmanager
+    def etapa(self, nome, imagens=0, bytes_lidos=0, bytes_escritos=0):
+        """
+        Mede o tempo de parede do bloco ``with`` e soma o resultado à etapa
+        ``nome``, com as imagens e os bytes informados pela própria etapa.
+        """
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.somar(nome, chamadas=1, tempo_s=time.perf_counter() - inicio, imagens=imagens,
+                       bytes_lidos=bytes_lidos, bytes_escritos=bytes_escritos)
+
+    def _processo(self):
+        # Totais do processo desde a criação: CPU de todas as threads e E/S do /proc.
+        lidos = escritos = 0
+        io_fim = contadores_io()
+        if io_fim and self._io_inicio:
+            lidos, escritos = io_fim[0] - self._io_inicio[0], io_fim[1] - self._io_inicio[1]
+        return {
+            'chamadas': 1, 'tempo_s': time.perf_counter() - self._inicio,
+            'cpu_s': time.process_time() - self._cpu_inicio, 'imagens': 0,
+            'bytes_lidos': lidos, 'bytes_escritos': escritos, 'pico_rss_bytes': pico_rss_bytes(),
+        }
+
+    def somar(self, nome, **valores):
+        """
+        Soma contadores a uma etapa sem medir tempo (ex.: imagens ou bytes lidos).
+        """
+        with self._lock:
+            etapa = self._etapas.setdefault(nome, _etapa_vazia())
+            for campo, valor in valores.items():
+                etapa[campo] += valor
+            etapa['pico_rss_bytes'] = max(etapa['pico_rss_bytes'], pico_rss_bytes())
+
+    def exportar(self):
+        """
+        Estado bruto, serializável, para enviar entre processos e ``mesclar``.
+        A entrada ``processo`` soma os totais deste processo aos dos processos mesclados.
+        """
+        processo = self._processo()
+        with self._lock:
+            etapas = {nome: dict(etapa) for nome, etapa in self._etapas.items()}
+        mesclado = etapas.pop(ETAPA_PROCESSO, None)
+        if mesclado is not None:
+            for campo in CAMPOS_SOMADOS:
+                processo[campo] += mesclado[campo]
+            processo['pico_rss_bytes'] = max(processo['pico_rss_bytes'], mesclado['pico_rss_bytes'])
+        etapas[ETAPA_PROCESSO] = processo
+        return etapas
+
+    def mesclar(self, etapas):
+        """
+        Soma as etapas exportadas por outro ``Metricas`` (ex.: de um processo worker).
+        """
+        with self._lock:
+            for nome, valores in etapas.items():
+                etapa = self._etapas.setdefault(nome, _etapa_vazia())
+                for campo in CAMPOS_SOMADOS:
+                    etapa[campo] += valores.get(campo, 0)
+                etapa['pico_rss_bytes'] = max(etapa['pico_rss_bytes'], valores.get('pico_rss_bytes', 0))
+
+    def resumo(self):
+        """
+        Uma entrada por etapa, na ordem em que apareceram, com a vazão em imagens/s.
+        """
+        linhas = []
+        for nome, etapa in self.exportar().items():
+            vazao = etapa['imagens'] / etapa['tempo_s'] if etapa['imagens'] and etapa['tempo_s'] > 0 else None
+            linhas.append({'etapa': nome, **etapa, 'imagens_por_s': vazao})
+        return linhas
+
+    def para_json(self):
+        return json.dumps(self.resumo(), ensure_ascii=False, indent=2)
+
+    def para_prometheus(self, prefixo='riv', rotulos=None):
+        return formatar_prometheus(self.resumo(), prefixo, rotulos)
+
+    @contextlib.contextmanager
+    def capturar_perfil(self):
+        """
+        Executa o bloco sob o ``cProfile`` se ``perfil`` estiver ativo.
+        """
+        if not self.perfil:
+            yield
+            return
+        import cProfile
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+        try:
+            yield
+        finally:
+            self._profiler.disable()
+
+    def salvar_perfil(self, caminho):
+        """
+        Grava o perfil capturado no formato do ``pstats``; retorna o caminho ou None.
+        """
+        if self._profiler is None:
+            return None
+        self._profiler.dump_stats(caminho)
+        return caminho
+
+
+def formatar_prometheus(resumo, prefixo='riv', rotulos=None):
+    """
+    Converte o ``resumo`` de ``Metricas`` para o formato de texto do Prometheus.
+    """
+    extras = ''.join(f',{chave}="{valor}"' for chave, valor in (rotulos or {}).items())
+    series = (
+        ('tempo_s', 'etapa_segundos', 'Tempo de parede acumulado da etapa.'),
+        ('cpu_s', 'etapa_cpu_segundos', 'Tempo de CPU de todas as threads (só na etapa processo).'),
+        ('chamadas', 'etapa_chamadas', 'Execuções da etapa.'),
+        ('imagens', 'etapa_imagens', 'Imagens processadas na etapa.'),
+        ('bytes_lidos', 'etapa_bytes_lidos', 'Bytes lidos informados pela etapa (na etapa processo, E/S do processo).'),
+        ('bytes_escritos', 'etapa_bytes_escritos', 'Bytes gravados informados pela etapa (na etapa processo, E/S do processo).'),
+        ('pico_rss_bytes', 'etapa_pico_rss_bytes', 'Pico de memória residente ao fim da etapa.'),
+    )
+    linhas = []
+    for campo, nome, ajuda in series:
+        linhas.append(f"# HELP {prefixo}_{nome} {ajuda}")
+        linhas.append(f"# TYPE {prefixo}_{nome} gauge")
+        for etapa in resumo:
+            linhas.append(f'{prefixo}_{nome}{{etapa="{etapa["etapa"]}"{extras}}} {etapa[campo]}')
+    return '\n'.join(linhas) + '\n'
@@ -0,0 +1,294 @@
+"""
+Cache persistente dos pesos dos modelos YOLO (fase 1 e fase 2).
+
+Cada modelo é guardado em disco como ``<raiz>/<model_id>/<sha256>.pt`` e um
+arquivo ``atual`` aponta para a versão em uso. O download acontece uma única
+vez; as versões novas são gravadas em arquivo temporário, verificadas e só
+então publicadas com ``os.replace`` (troca atômica). Versões antigas são
+removidas por ordem de último uso quando o cache passa do limite de tamanho,
+exceto as que estão em uso por alguma análise (referências em
+``<model_id>/.ref-<sha256>-<pid>-<id>``).
+"""
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+
+from rcf.backends import remover_exportados
+from rcf.trabalho import processo_vivo
+
+TAMANHO_BLOCO = 1024 * 1024
+
+# IDs dos modelos no Google Drive (ou nomes dos arquivos em outras fontes).
+MODEL_F1_ID = "10Hh3ovvDBurmD8wZYG7uRpZklMhPHo1u"
+MODEL_F2_ID = "1It73Ji3ivybC2p-8b0Lr6BIAXdn_5eyf"
+
+# Idade, em segundos, a partir da qual a versão atual de um modelo é
+# revalidada na fonte: pesos novos publicados com o mesmo ID chegam em até
+# esse intervalo (0 = revalida a cada uso).
+MAX_IDADE_MODELOS_S = float(os.environ.get("RIV_MAX_IDADE_MODELOS", 24 * 3600))
+
+
+def calcular_sha256(caminho):
+    """
+    Calcula o SHA-256 de um arquivo lendo-o em blocos.
+    """
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+# --- Fontes de download ---
+class FonteGoogleDrive:
+    """
+    Baixa os pesos do Google Drive via gdown (comportamento original do app).
+    """
+    def baixar(self, model_id, destino):
+        import gdown
+        resultado = gdown.download(id=model_id, output=destino, quiet=True)
+        if not resultado or not os.path.exists(destino):
+            raise IOError(f"Falha ao baixar o modelo '{model_id}' do Google Drive.")
+
+
+class FonteDiretorioLocal:
+    """
+    Copia os pesos de um diretório local ou montado (``<diretorio>/<model_id>``,
+    com ou sem a extensão ``.pt``).
+    """
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+
+    def baixar(self, model_id, destino):
+        for nome in (model_id, f"{model_id}.pt"):
+            origem = os.path.join(self.diretorio, nome)
+            if os.path.isfile(origem):
+                shutil.copyfile(origem, destino)
+                return
+        raise FileNotFoundError(f"Modelo '{model_id}' não encontrado em '{self.diretorio}'.")
+
+
+class FonteHTTP:
+    """
+    Baixa os pesos de um servidor de arquivos, montando a URL a partir de um
+    modelo como ``http://servidor/modelos/{model_id}.pt``.
+    """
+    def __init__(self, url_modelo, timeout=60):
+        self.url_modelo = url_modelo
+        self.timeout = timeout
+
+    def baixar(self, model_id, destino):
+        url = self.url_modelo.format(model_id=model_id)
+        with urllib.request.urlopen(url, timeout=self.timeout) as resposta, open(destino, 'wb') as f:
+            shutil.copyfileobj(resposta, f, TAMANHO_BLOCO)
+
+
+def fonte_por_uri(uri):
+    """
+    Cria a fonte de download a partir de uma string de configuração:
+    ``gdrive`` (padrão), ``file:///caminho`` / caminho local ou ``http(s)://...``.
+    """
+    if not uri or uri == 'gdrive':
+        return FonteGoogleDrive()
+    if uri.startswith(('http://', 'https://')):
+        return FonteHTTP(uri)
+    if uri.startswith('file://'):
+        uri = uri[len('file://'):]
+    return FonteDiretorioLocal(uri)
+
+
+# --- Cache em disco ---
+class CacheModelos:
+    """
+    Armazena os pesos dos modelos em disco, indexados pelo ID e pelo hash do conteúdo.
+
+    - ``raiz``: diretório do cache.
+    - ``fonte``: objeto com o método ``baixar(model_id, destino)``.
+    - ``limite_bytes``: tamanho máximo do cache; versões antigas são removidas
+      por LRU (a versão atual de cada modelo e as versões em uso nunca são removidas).
+    - ``max_idade_s``: a versão atual é revalidada na fonte depois desse
+      intervalo (padrão ``MAX_IDADE_MODELOS_S``; None = nunca); se o conteúdo
+      mudou, a nova versão é publicada.
+    """
+    ARQUIVO_ATUAL = 'atual'
+
+    def __init__(self, raiz, fonte=None, limite_bytes=2 * 1024 ** 3, max_idade_s=MAX_IDADE_MODELOS_S):
+        self.raiz = raiz
+        self.fonte = fonte or FonteGoogleDrive()
+        self.limite_bytes = limite_bytes
+        self.max_idade_s = max_idade_s
+        self._lock = threading.RLock()
+        self._verificados = set()
+        os.makedirs(self.raiz, exist_ok=True)
+
+    def _dir_modelo(self, model_id):
+        return os.path.join(self.raiz, model_id)
+
+    def _ler_atual(self, model_id):
+        try:
+            with open(os.path.join(self._dir_modelo(model_id), self.ARQUIVO_ATUAL)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _gravar_atual(self, model_id, sha):
+        dir_modelo = self._dir_modelo(model_id)
+        fd, tmp = tempfile.mkstemp(dir=dir_modelo, prefix='.atual-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(sha)
+        os.replace(tmp, os.path.join(dir_modelo, self.ARQUIVO_ATUAL))
+
+    def caminho_versao(self, model_id, sha):
+        return os.path.join(self._dir_modelo(model_id), f"{sha}.pt")
+
+    def _versao_valida(self, model_id, sha):
+        caminho = self.caminho_versao(model_id, sha)
+        if not os.path.isfile(caminho):
+            return False
+        # O hash é conferido uma vez por processo para detectar arquivos corrompidos.
+        if (model_id, sha) not in self._verificados:
+            if calcular_sha256(caminho) != sha:
+                os.remove(caminho)
+                return False
+            self._verificados.add((model_id, sha))
+        return True
+
+    def _baixar_versao(self, model_id, sha_esperado=None):
+        dir_modelo = self._dir_modelo(model_id)
+        os.makedirs(dir_modelo, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dir_modelo, prefix='.download-', suffix='.pt')
+        os.close(fd)
+        try:
+            self.fonte.baixar(model_id, tmp)
+            sha = calcular_sha256(tmp)
+            if sha_esperado and sha != sha_esperado:
+                raise ValueError(
+                    f"Checksum inválido para o modelo '{model_id}': esperado {sha_esperado}, obtido {sha}."
+                )
+            os.replace(tmp, self.caminho_versao(model_id, sha))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._verificados.add((model_id, sha))
+        self._gravar_atual(model_id, sha)
+        return sha
+
+    def _expirado(self, model_id):
+        if self.max_idade_s is None:
+            return False
+        ponteiro = os.path.join(self._dir_modelo(model_id), self.ARQUIVO_ATUAL)
+        return time.time() - os.path.getmtime(ponteiro) > self.max_idade_s
+
+    def obter(self, model_id, sha_esperado=None):
+        """
+        Retorna o caminho local dos pesos do modelo, baixando-os apenas se
+        necessário. Se ``sha_esperado`` for informado, só essa versão é aceita.
+        """
+        with self._lock:
+            sha = sha_esperado or self._ler_atual(model_id)
+            if sha and self._versao_valida(model_id, sha) and not (sha_esperado is None and self._expirado(model_id)):
+                if sha_esperado and self._ler_atual(model_id) != sha:
+                    self._gravar_atual(model_id, sha)
+            else:
+                sha = self._baixar_versao(model_id, sha_esperado)
+                self._limpar()
+            caminho = self.caminho_versao(model_id, sha)
+            # Atualiza o horário de acesso usado pela política LRU.
+            os.utime(caminho)
+            return caminho
+
+    def atualizar(self, model_id):
+        """
+        Força uma nova consulta à fonte; publica a versão se o conteúdo mudou.
+        """
+        with self._lock:
+            sha = self._baixar_versao(model_id)
+            self._limpar()
+            return self.caminho_versao(model_id, sha)
+
+    @contextlib.contextmanager
+    def usar(self, model_id, sha_esperado=None):
+        """
+        Como ``obter``, mas mantém uma referência à versão enquanto o bloco
+        ``with`` estiver ativo, impedindo que a limpeza a remova durante a análise
+        (inclusive por outros processos que compartilham o cache).
+        """
+        with self._lock:
+            caminho = self.obter(model_id, sha_esperado)
+            sha = os.path.basename(caminho)[:-len('.pt')]
+            ref = os.path.join(self._dir_modelo(model_id), f".ref-{sha}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+            open(ref, 'w').close()
+        try:
+            yield caminho
+        finally:
+            try:
+                os.remove(ref)
+            except FileNotFoundError:
+                pass
+
+    def _versoes_referenciadas(self, dir_modelo):
+        referenciadas = set()
+        for nome in os.listdir(dir_modelo):
+            if not nome.startswith('.ref-'):
+                continue
+            try:
+                _, sha, pid, _ = nome.split('-', 3)
+                pid = int(pid)
+            except ValueError:
+                continue
+            if processo_vivo(pid):
+                referenciadas.add(sha)
+            else:
+                # Referência deixada por um processo que morreu.
+                try:
+                    os.remove(os.path.join(dir_modelo, nome))
+                except OSError:
+                    pass
+        return referenciadas
+
+    def versao_atual(self, model_id):
+        """
+        Retorna o hash da versão em uso do modelo (ou None se não houver).
+        """
+        return self._ler_atual(model_id)
+
+    def _limpar(self):
+        versoes = []
+        total = 0
+        for model_id in os.listdir(self.raiz):
+            dir_modelo = self._dir_modelo(model_id)
+            if not os.path.isdir(dir_modelo):
+                continue
+            protegidas = {self._ler_atual(model_id)} | self._versoes_referenciadas(dir_modelo)
+            for nome in os.listdir(dir_modelo):
+                if not nome.endswith('.pt') or nome.startswith('.'):
+                    continue
+                caminho = os.path.join(dir_modelo, nome)
+                info = os.stat(caminho)
+                total += info.st_size
+                if nome[:-len('.pt')] not in protegidas:
+                    versoes.append((info.st_mtime, info.st_size, caminho))
+
+        for _, tamanho, caminho in sorted(versoes):
+            if total <= self.limite_bytes:
+                break
+            try:
+                os.remove(caminho)
+                total -= tamanho
+            except OSError:
+                continue
+            # Os artefatos ONNX/OpenVINO exportados desta versão saem junto.
+            remover_exportados(os.path.dirname(caminho), os.path.basename(caminho)[:-len('.pt')])
+
+    def limpar(self):
+        """
+        Remove versões antigas até que o cache respeite ``limite_bytes``.
+        """
+        with self._lock:
+            self._limpar()
@@ -0,0 +1,189 @@
+"""
+Execução das duas fases distribuída em vários processos.
+
+O manifesto é dividido em fragmentos contíguos; cada processo do pool carrega
+seus próprios modelos (uma única vez, no inicializador) e processa os
+fragmentos que receber. Os resultados são reunidos na ordem dos fragmentos,
+de modo que a saída é a mesma independentemente do número de processos. A
+falha de um fragmento é registrada e não descarta os demais.
+
+A exceção é o agrupamento de recortes repetidos (``ConfigFase.deduplicar``):
+cada fragmento agrupa só os seus recortes, então os grupos dependem da
+divisão. ``rcf.analise`` não usa o modo paralelo com agrupamento.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import traceback
+
+from rcf.inferencia import ConfigFase, aplicar_threads, resolver_config
+from rcf.ingestao import decodificar_itens, iterar_bytes_arquivos, iterar_bytes_zip
+from rcf.manifesto import ItemManifesto
+from rcf.metricas import Metricas
+from rcf.pipeline import executar_duas_fases, lado_decodificacao, reescalar_deteccoes
+
+TAMANHO_FRAGMENTO = 256
+
+# Estado de cada processo do pool, preenchido pelo inicializador.
+_modelos_processo = {}
+
+
+class ResultadoFragmento:
+    """
+    Saída de um fragmento: detecções, número de recortes de trilho (no total
+    e por imagem), avisos de leitura, imagens que não puderam ser lidas, as métricas das etapas
+    (``Metricas.exportar()``) e, em caso de falha, a mensagem de erro.
+    """
+    def __init__(self, indice, caminhos, deteccoes=None, total_trilhos=0, avisos=None, erro=None, falhas=None,
+                 metricas=None, trilhos_por_imagem=None):
+        self.indice = indice
+        self.caminhos = caminhos
+        self.deteccoes = deteccoes or []
+        self.total_trilhos = total_trilhos
+        self.avisos = avisos or []
+        self.erro = erro
+        self.falhas = falhas or []
+        self.metricas = metricas or {}
+        self.trilhos_por_imagem = trilhos_por_imagem or {}
+
+    def descrever_erro(self):
+        return (
+            f"Erro: fragmento {self.indice} ({len(self.caminhos)} imagens, a partir de '{self.caminhos[0]}') "
+            f"falhou e foi ignorado: {self.erro.splitlines()[0]}"
+        )
+
+
+def fragmentar(caminhos, tamanho=TAMANHO_FRAGMENTO):
+    """
+    Divide a lista de caminhos em fragmentos contíguos de até ``tamanho`` itens.
+    """
+    return [caminhos[i:i + tamanho] for i in range(0, len(caminhos), tamanho)]
+
+
+def _inicializar_processo(path_modelo_f1, path_modelo_f2, threads, imgsz_f1, imgsz_f2):
+    from rcf.registro import RegistroModelos
+    aplicar_threads(threads)
+    registro = RegistroModelos()
+    _modelos_processo['fase_1'] = registro.obter('fase_1', path_modelo_f1, imgsz=imgsz_f1)
+    _modelos_processo['fase_2'] = registro.obter('fase_2', path_modelo_f2, imgsz=imgsz_f2)
+
+
+def _fontes_fragmento(origem, caminhos, avisos, falhas, metricas=None, config_f1=None, config_f2=None, escalas=None):
+    # Zip ou arquivos em disco passam pela mesma decodificação do modo de um processo.
+    manifesto = [ItemManifesto(c, None, None) for c in caminhos]
+    itens = iterar_bytes_arquivos(manifesto) if origem is None else iterar_bytes_zip(origem, manifesto=manifesto)
+    return decodificar_itens(itens, avisos=avisos, falhas=falhas, metricas=metricas,
+                             threads=config_f1.decodificadores, lado_minimo=lado_decodificacao(config_f1, config_f2),
+                             escalas=escalas)
+
+
+def processar_fragmento(indice, origem, caminhos, config_f1, config_f2):
+    """
+    Executa as duas fases sobre um fragmento no processo atual. ``origem`` é o
+    caminho do .zip (membros em ``caminhos``) ou None para arquivos em disco.
+    """
+    avisos = []
+    falhas = []
+    escalas = {}
+    trilhos_por_imagem = {}
+    metricas = Metricas()
+    try:
+        model_f1 = _modelos_processo['fase_1']
+        model_f2 = _modelos_processo['fase_2']
+        config_f1 = resolver_config(config_f1, model_f1, 'fase_1')
+        config_f2 = resolver_config(config_f2, model_f2, 'fase_2')
+        deteccoes, total_trilhos = executar_duas_fases(
+            model_f1, model_f2, _fontes_fragmento(origem, caminhos, avisos, falhas, metricas, config_f1, config_f2, escalas),
+            config_f1, config_f2, metricas=metricas, trilhos_por_imagem=trilhos_por_imagem,
+        )
+        reescalar_deteccoes(deteccoes, escalas)
+        return ResultadoFragmento(indice, caminhos, deteccoes, total_trilhos, avisos, falhas=falhas,
+                                  metricas=metricas.exportar(), trilhos_por_imagem=trilhos_por_imagem)
+    except Exception as e:
+        return ResultadoFragmento(indice, caminhos, avisos=avisos, erro=f"{e}\n{traceback.format_exc()}")
+
+
+def threads_por_processo(processos):
+    return max(1, (os.cpu_count() or 1) // processos)
+
+
+def _executar_pool(pendentes, origem, processos, initargs, config_f1, config_f2, contexto, ao_concluir, concluidos, total):
+    """
+    Executa os fragmentos ``pendentes`` (pares ``(indice, caminhos)``) em um pool.
+    Retorna os resultados obtidos e os fragmentos perdidos por queda de processo.
+    """
+    resultados, perdidos = [], []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=processos,
+        mp_context=multiprocessing.get_context(contexto),
+        initializer=_inicializar_processo,
+        initargs=initargs,
+    ) as pool:
+        futuros = {
+            pool.submit(processar_fragmento, i, origem, fragmento, config_f1, config_f2): (i, fragmento)
+            for i, fragmento in pendentes
+        }
+        for futuro in concurrent.futures.as_completed(futuros):
+            indice, fragmento = futuros[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                # Ex.: o processo morreu (falta de memória) antes de devolver o resultado.
+                perdidos.append((indice, fragmento, str(e) or type(e).__name__))
+                continue
+            resultados.append(resultado)
+            if ao_concluir is not None:
+                ao_concluir(resultado, concluidos + len(resultados), total)
+    return resultados, perdidos
+
+
+def executar_paralelo(path_modelo_f1, path_modelo_f2, caminhos, origem=None, processos=None,
+                      config_f1=None, config_f2=None, tamanho_fragmento=TAMANHO_FRAGMENTO,
+                      contexto='spawn', ao_concluir=None, tentativas=2, metricas=None, trilhos_por_imagem=None):
+    """
+    Distribui ``caminhos`` (membros do zip ``origem`` ou arquivos em disco)
+    entre ``processos`` workers, cada um com seus modelos carregados.
+
+    Fragmentos perdidos porque um processo caiu são reenviados a um pool novo
+    até ``tentativas`` vezes; erros dentro do fragmento não são repetidos.
+    ``ao_concluir(resultado_fragmento, concluidos, total)`` é chamado no processo
+    principal à medida que os fragmentos terminam. As métricas medidas nos
+    processos são somadas a ``metricas``, se informado, e o número de recortes
+    de trilho de cada imagem dos fragmentos concluídos vai para ``trilhos_por_imagem``.
+    Retorna ``(deteccoes, total_trilhos, avisos, erros, falhas)``; ``erros`` lista os
+    ``ResultadoFragmento`` que falharam e ``falhas`` as imagens que não puderam ser lidas.
+    """
+    processos = processos or os.cpu_count() or 1
+    config_f1 = config_f1 or ConfigFase()
+    config_f2 = config_f2 or ConfigFase()
+    fragmentos = fragmentar(list(caminhos), tamanho_fragmento)
+    processos = max(1, min(processos, len(fragmentos)))
+    initargs = (path_modelo_f1, path_modelo_f2, threads_por_processo(processos), config_f1.imgsz, config_f2.imgsz)
+
+    resultados = []
+    pendentes = list(enumerate(fragmentos))
+    for _ in range(tentativas):
+        if not pendentes:
+            break
+        obtidos, perdidos = _executar_pool(pendentes, origem, processos, initargs, config_f1, config_f2,
+                                           contexto, ao_concluir, len(resultados), len(fragmentos))
+        resultados.extend(obtidos)
+        pendentes = [(i, fragmento) for i, fragmento, _ in perdidos]
+    if pendentes:
+        resultados.extend(ResultadoFragmento(i, fragmento, erro=erro) for i, fragmento, erro in perdidos)
+
+    resultados.sort(key=lambda r: r.indice)
+    deteccoes, total_trilhos, avisos, erros, falhas = [], 0, [], [], []
+    for resultado in resultados:
+        avisos.extend(resultado.avisos)
+        falhas.extend(resultado.falhas)
+        if metricas is not None:
+            metricas.mesclar(resultado.metricas)
+        if resultado.erro is not None:
+            erros.append(resultado)
+            continue
+        deteccoes.extend(resultado.deteccoes)
+        total_trilhos += resultado.total_trilhos
+        if trilhos_por_imagem is not None:
+            trilhos_por_imagem.update(resultado.trilhos_por_imagem)
+    return deteccoes, total_trilhos, avisos, erros, falhas
@@ -0,0 +1,341 @@
+"""
+Pipeline das duas fases em memória.
+
+A fase 1 detecta os trilhos em cada imagem; os recortes da classe 'Trilho'
+são passados como arrays diretamente para a fase 2, em lotes, sem gravar nem
+reler JPEGs do disco. O resultado é uma lista de detecções estruturadas, uma
+por caixa detectada na fase 2.
+"""
+import os
+
+from rcf.inferencia import ConfigFase, aplicar_threads
+from rcf.metricas import medir
+
+CLASSE_TRILHO = 'Trilho'
+
+# Mesma expansão usada pelo ``save_crop`` do ultralytics, para que a fase 2
+# receba recortes equivalentes aos do fluxo em disco.
+GANHO_RECORTE = 1.02
+MARGEM_RECORTE = 10
+
+
+def _em_lotes(itens, tamanho):
+    lote = []
+    for item in itens:
+        lote.append(item)
+        if len(lote) == tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def recortar_caixa(imagem, xyxy, ganho=GANHO_RECORTE, margem=MARGEM_RECORTE):
+    """
+    Recorta a caixa ``xyxy`` de uma imagem HxWxC, expandindo-a como o ultralytics.
+    Retorna o recorte (view contígua) e a caixa efetivamente usada.
+    """
+    import numpy as np
+    x1, y1, x2, y2 = (float(v) for v in xyxy)
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    w, h = (x2 - x1) * ganho + margem, (y2 - y1) * ganho + margem
+    altura, largura = imagem.shape[:2]
+    x1 = int(min(max(cx - w / 2, 0), largura))
+    x2 = int(min(max(cx + w / 2, 0), largura))
+    y1 = int(min(max(cy - h / 2, 0), altura))
+    y2 = int(min(max(cy + h / 2, 0), altura))
+    return np.ascontiguousarray(imagem[y1:y2, x1:x2]), (x1, y1, x2, y2)
+
+
+def nome_recorte(arquivo, indice):
+    """
+    Nome que o ``save_crop`` daria ao recorte: ``<stem>.jpg`` para o primeiro e
+    ``<stem>2.jpg``, ``<stem>3.jpg``... para os seguintes. Serve apenas para
+    rastreabilidade; os metadados vêm do nome da imagem de origem (``arquivo``),
+    que não sofre o sufixo numérico.
+    """
+    stem = os.path.splitext(os.path.basename(arquivo))[0]
+    return f"{stem}.jpg" if indice == 0 else f"{stem}{indice + 1}.jpg"
+
+
+def _caixas(resultado):
+    if resultado.boxes is None or len(resultado.boxes) == 0:
+        return []
+    nomes = resultado.names
+    xyxy = resultado.boxes.xyxy.tolist()
+    confs = resultado.boxes.conf.tolist()
+    classes = resultado.boxes.cls.tolist()
+    return [(nomes[int(c)], conf, caixa) for caixa, conf, c in zip(xyxy, confs, classes)]
+
+
+def _separar_nomes(fontes):
+    """
+    Aceita caminhos, arrays ou pares ``(nome, array)``; retorna as fontes para o
+    ``predict`` e os nomes a associar a cada resultado (None = usar ``result.path``).
+    Listas de caminhos são carregadas pelo ultralytics como imagens em memória,
+    o que faz ``result.path`` perder o nome original; por isso o caminho é guardado.
+    """
+    if fontes and isinstance(fontes[0], tuple):
+        return [f[1] for f in fontes], [f[0] for f in fontes]
+    return list(fontes), [f if isinstance(f, (str, os.PathLike)) else None for f in fontes]
+
+
+def extrair_trilhos(resultados_f1, classe_trilho=CLASSE_TRILHO, nomes=None):
+    """
+    Gera um recorte em memória para cada caixa de trilho dos resultados da fase 1.
+    """
+    nomes = nomes or [None] * len(resultados_f1)
+    for resultado, nome in zip(resultados_f1, nomes):
+        caminho = os.fspath(nome) if nome is not None else resultado.path
+        indice = 0
+        for classe, conf, caixa in _caixas(resultado):
+            if classe != classe_trilho:
+                continue
+            recorte, caixa_recorte = recortar_caixa(resultado.orig_img, caixa)
+            if recorte.size == 0:
+                continue
+            yield {
+                'imagem': caminho,
+                'arquivo': os.path.basename(caminho),
+                'indice_trilho': indice,
+                'nome_recorte': nome_recorte(caminho, indice),
+                'conf_trilho': conf,
+                'caixa_trilho': caixa_recorte,
+                'recorte': recorte,
+            }
+            indice += 1
+
+
+def kwargs_triagem(config):
+    """
+    Parâmetros do ``predict`` da triagem: os da fase 1 com o tamanho de entrada
+    reduzido (``config.triagem``) e a confiança mínima ``config.conf_triagem``.
+    """
+    kwargs = config.kwargs_predict()
+    kwargs['imgsz'] = config.triagem
+    kwargs['conf'] = config.conf_triagem
+    return kwargs
+
+
+def tem_trilho(resultado, classe_trilho=CLASSE_TRILHO):
+    return any(classe == classe_trilho for classe, _, _ in _caixas(resultado))
+
+
+def triar(modelo_f1, fontes, config, classe_trilho=CLASSE_TRILHO, metricas=None, descartadas=None):
+    """
+    Passada barata do modelo da fase 1 em baixa resolução: gera só as fontes
+    (no mesmo formato de ``iterar_duas_fases``) em que aparece algum candidato
+    a trilho. Os nomes das descartadas vão para ``descartadas``; a contagem,
+    para a etapa ``triagem_descartadas`` de ``metricas``.
+    """
+    kwargs = kwargs_triagem(config)
+    for lote in _em_lotes(fontes, config.lote):
+        lote_fontes, nomes = _separar_nomes(lote)
+        aplicar_threads(config.threads)
+        with medir(metricas, 'triagem', imagens=len(lote_fontes)):
+            resultados = modelo_f1.predict(source=lote_fontes, save=False, **kwargs)
+        for fonte, nome, resultado in zip(lote, nomes, resultados):
+            if tem_trilho(resultado, classe_trilho):
+                yield fonte
+                continue
+            if descartadas is not None:
+                descartadas.append(os.fspath(nome) if nome is not None else resultado.path)
+            if metricas is not None:
+                metricas.somar('triagem_descartadas', imagens=1)
+
+
+def _unidades_fase_2(trilhos, config):
+    # Cada unidade é (trilho, deslocamento da fatia no recorte, imagem, fatias do trilho).
+    if not config.fatia:
+        for trilho in trilhos:
+            yield trilho, (0, 0), trilho['recorte'], 1
+        return
+    from rcf.fatiamento import fatiar
+    for trilho in trilhos:
+        fatias = list(fatiar(trilho['recorte'], config.fatia, config.sobreposicao))
+        for deslocamento, fatia in fatias:
+            yield trilho, deslocamento, fatia, len(fatias)
+
+
+def _deteccoes_trilho(trilho, caixas, copia=False):
+    # As caixas de uma repetição são as do representante, relativas ao recorte
+    # dele; a posição no recorte da repetição é desconhecida e fica None.
+    deteccoes = []
+    for classe, conf, caixa in caixas:
+        deteccao = {
+            'imagem': trilho['imagem'],
+            'arquivo': trilho['arquivo'],
+            'indice_trilho': trilho['indice_trilho'],
+            'nome_recorte': trilho['nome_recorte'],
+            'conf_trilho': trilho['conf_trilho'],
+            'caixa_trilho': trilho['caixa_trilho'],
+            'classe': classe,
+            'conf': conf,
+            'caixa': None if copia else tuple(caixa),
+        }
+        if 'grupo' in trilho:
+            deteccao['grupo'] = trilho['grupo']
+        deteccoes.append(deteccao)
+    return deteccoes
+
+
+def iterar_duas_fases(modelo_f1, modelo_f2, fontes, config_f1=None, config_f2=None, classe_trilho=CLASSE_TRILHO,
+                      metricas=None, trilhos_por_imagem=None):
+    """
+    Executa fase 1 e fase 2 em memória, gerando ``(deteccoes, trilhos)`` a cada
+    lote da fase 2: as detecções do lote e o número de recortes de trilho nele.
+    Permite acompanhar e exibir resultados parciais durante a análise.
+
+    - ``modelo_f1``/``modelo_f2``: objetos com ``predict`` (YOLO ou ``ModeloCarregado``).
+    - ``fontes``: iterável de caminhos de imagens, arrays BGR ou pares
+      ``(nome, array)``; pode ser um gerador (ex.: leitura do zip).
+    - ``config_f1``/``config_f2``: ``ConfigFase`` de cada fase (lote, imgsz, threads...).
+      Com ``config_f2.fatia``, a fase 2 roda em fatias sobrepostas de cada recorte
+      (``rcf.fatiamento``), em lotes que misturam recortes e imagens; as
+      detecções de um recorte saem no lote em que a última fatia dele termina.
+      Com ``config_f2.deduplicar``, recortes repetidos entre quadros
+      consecutivos (``rcf.duplicatas``) não passam pela fase 2: recebem as
+      detecções do representante do grupo, identificado em ``grupo``, com a
+      classe e a confiança dele e ``caixa`` None (o defeito não ocupa a mesma
+      posição no recorte de outro quadro; ``caixa_trilho`` é a do próprio recorte).
+      Com ``config_f1.triagem``, as imagens passam antes por ``triar`` e só as
+      que têm candidatos a trilho chegam à fase 1 em resolução cheia.
+    - ``metricas``: ``Metricas`` opcional; mede as etapas ``fase_1``, ``recortes`` e ``fase_2``.
+    - ``trilhos_por_imagem``: dict opcional, preenchido com o número de
+      recortes de trilho de cada imagem (inclusive as sem nenhuma detecção).
+    """
+    config_f1 = config_f1 or ConfigFase()
+    config_f2 = config_f2 or ConfigFase()
+    kwargs_f1 = config_f1.kwargs_predict()
+    kwargs_f2 = config_f2.kwargs_predict()
+
+    if config_f1.triagem:
+        fontes = triar(modelo_f1, fontes, config_f1, classe_trilho, metricas)
+
+    def trilhos():
+        for lote_fontes in _em_lotes(fontes, config_f1.lote):
+            lote_fontes, nomes = _separar_nomes(lote_fontes)
+            aplicar_threads(config_f1.threads)
+            with medir(metricas, 'fase_1', imagens=len(lote_fontes)):
+                resultados = modelo_f1.predict(source=lote_fontes, save=False, **kwargs_f1)
+            with medir(metricas, 'recortes', imagens=len(lote_fontes)):
+                recortes = list(extrair_trilhos(resultados, classe_trilho, nomes))
+            if trilhos_por_imagem is not None:
+                for recorte in recortes:
+                    trilhos_por_imagem[recorte['imagem']] = trilhos_por_imagem.get(recorte['imagem'], 0) + 1
+            yield from recortes
+
+    # Com ``config_f2.deduplicar``, só os representantes de cada grupo de recortes
+    # repetidos vão para a fase 2; as repetições esperam em ``copias`` até o
+    # representante terminar e recebem as caixas dele (``caixas_grupo``), que
+    # são descartadas quando o grupo sai da janela do agrupador e não há mais
+    # repetições à espera.
+    agrupador = None
+    if config_f2.deduplicar:
+        from rcf.duplicatas import AgrupadorRecortes
+        agrupador = AgrupadorRecortes()
+    copias, caixas_grupo = {}, {}
+
+    def representantes():
+        for trilho in trilhos():
+            if agrupador is None:
+                yield trilho
+                continue
+            with medir(metricas, 'deduplicacao', imagens=1):
+                trilho['grupo'], representante = agrupador.agrupar(trilho)
+            if representante:
+                yield trilho
+            else:
+                trilho['recorte'] = None
+                copias.setdefault(trilho['grupo'], []).append(trilho)
+
+    def copias_prontas():
+        deteccoes, quantidade = [], 0
+        for grupo in [g for g in copias if g in caixas_grupo]:
+            for trilho in copias.pop(grupo):
+                deteccoes.extend(_deteccoes_trilho(trilho, caixas_grupo[grupo], copia=True))
+                quantidade += 1
+        for grupo in [g for g in caixas_grupo if g not in copias and not agrupador.ativo(g)]:
+            del caixas_grupo[grupo]
+        return deteccoes, quantidade
+
+    # Caixas acumuladas dos trilhos com fatias ainda por processar: id -> [trilho, fatias restantes, caixas].
+    pendentes = {}
+    for lote in _em_lotes(_unidades_fase_2(representantes(), config_f2), config_f2.lote):
+        aplicar_threads(config_f2.threads)
+        with medir(metricas, 'fase_2', imagens=len(lote)):
+            resultados = modelo_f2.predict(source=[unidade[2] for unidade in lote], save=False, **kwargs_f2)
+        deteccoes = []
+        concluidos = 0
+        for (trilho, (dx, dy), _, total), resultado in zip(lote, resultados):
+            estado = pendentes.setdefault(id(trilho), [trilho, total, []])
+            estado[1] -= 1
+            estado[2].extend(
+                (classe, conf, (caixa[0] + dx, caixa[1] + dy, caixa[2] + dx, caixa[3] + dy))
+                for classe, conf, caixa in _caixas(resultado)
+            )
+            if estado[1]:
+                continue
+            del pendentes[id(trilho)]
+            concluidos += 1
+            caixas = estado[2]
+            if total > 1:
+                from rcf.fatiamento import suprimir_duplicadas
+                caixas = suprimir_duplicadas(caixas)
+            if 'grupo' in trilho:
+                caixas_grupo[trilho['grupo']] = caixas
+            deteccoes.extend(_deteccoes_trilho(trilho, caixas))
+        novas, repetidos = copias_prontas()
+        yield deteccoes + novas, concluidos + repetidos
+
+    # Repetições que chegaram depois do último lote do representante.
+    novas, repetidos = copias_prontas()
+    if repetidos:
+        yield novas, repetidos
+
+
+def lado_decodificacao(config_f1, config_f2):
+    """
+    Menor lado maior com que as imagens podem ser decodificadas sem perder o que
+    os modelos veem: a fase 1 reduz a imagem toda para o seu ``imgsz`` e os
+    recortes de trilho, que ocupam a altura do quadro, são reduzidos para o
+    ``imgsz`` da fase 2. None se ``config_f1.reduzir`` estiver desligado ou a
+    fase 2 for fatiada (as fatias precisam da resolução cheia).
+    """
+    if not config_f1.reduzir or config_f2.fatia:
+        return None
+    return max(config_f1.imgsz, config_f2.imgsz)
+
+
+def reescalar_deteccoes(deteccoes, escalas):
+    """
+    Leva as caixas das imagens decodificadas reduzidas (``escalas``: imagem ->
+    fator) de volta às coordenadas da imagem original, no lugar.
+    """
+    if not escalas:
+        return deteccoes
+    for deteccao in deteccoes:
+        fator = escalas.get(deteccao['imagem'])
+        if fator is None:
+            continue
+        deteccao['caixa_trilho'] = tuple(int(round(v * fator)) for v in deteccao['caixa_trilho'])
+        if deteccao['caixa'] is not None:
+            deteccao['caixa'] = tuple(v * fator for v in deteccao['caixa'])
+    return deteccoes
+
+
+def executar_duas_fases(modelo_f1, modelo_f2, fontes, config_f1=None, config_f2=None, classe_trilho=CLASSE_TRILHO,
+                        metricas=None, trilhos_por_imagem=None):
+    """
+    Como ``iterar_duas_fases``, mas só retorna ao final.
+
+    Retorna ``(deteccoes, total_trilhos)``; cada detecção é um dict com a
+    imagem de origem, o recorte de trilho que a contém e a caixa da fase 2.
+    """
+    deteccoes = []
+    total_trilhos = 0
+    for novas, trilhos in iterar_duas_fases(modelo_f1, modelo_f2, fontes, config_f1, config_f2, classe_trilho, metricas,
+                                            trilhos_por_imagem):
+        deteccoes.extend(novas)
+        total_trilhos += trilhos
+    return deteccoes, total_trilhos
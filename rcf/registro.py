@@ -0,0 +1,175 @@
+"""
+Registro de modelos YOLO carregados e aquecidos, compartilhado pelo processo.
+
+O Streamlit reexecuta o script a cada interação, mas os módulos importados
+permanecem em memória; por isso o registro vive no nível do módulo e é
+compartilhado entre sessões e reruns. Cada modelo é carregado uma única vez,
+aquecido com um lote fictício e só é recarregado quando o arquivo de pesos
+muda (o cache de modelos grava cada versão com um nome diferente).
+"""
+import contextlib
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return None
+        # ru_maxrss está em KiB no Linux e em bytes no macOS; serve como aproximação.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _bytes_parametros(modelo):
+    try:
+        return sum(p.numel() * p.element_size() for p in modelo.model.parameters())
+    except AttributeError:
+        return None
+
+
+class ModeloCarregado:
+    """
+    Handle thread-safe para um modelo carregado. As predições do ultralytics
+    não são reentrantes, então o uso é serializado com um lock por modelo.
+    """
+    def __init__(self, nome, caminho, modelo, assinatura, tempo_carga_s, tempo_aquecimento_s, memoria_bytes):
+        self.nome = nome
+        self.caminho = caminho
+        self.modelo = modelo
+        self.assinatura = assinatura
+        self.tempo_carga_s = tempo_carga_s
+        self.tempo_aquecimento_s = tempo_aquecimento_s
+        self.memoria_bytes = memoria_bytes
+        self.carregado_em = time.time()
+        self.usos = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def uso(self):
+        """
+        Reserva o modelo para uso exclusivo durante o bloco ``with``.
+        """
+        with self._lock:
+            self.usos += 1
+            yield self.modelo
+
+    def predict(self, *args, **kwargs):
+        with self.uso() as modelo:
+            return modelo.predict(*args, **kwargs)
+
+    def estatisticas(self):
+        return {
+            'Modelo': self.nome,
+            'Arquivo': os.path.basename(self.caminho),
+            'Carga (s)': round(self.tempo_carga_s, 3),
+            'Aquecimento (s)': round(self.tempo_aquecimento_s, 3),
+            'Memória (MB)': round(self.memoria_bytes / 1024 ** 2, 1) if self.memoria_bytes else None,
+            'Usos': self.usos,
+        }
+
+
+def _assinatura(caminho):
+    info = os.stat(caminho)
+    return (os.path.abspath(caminho), info.st_size, info.st_mtime_ns)
+
+
+def carregar_yolo(caminho):
+    # A tarefa é explícita porque os artefatos exportados (ONNX, OpenVINO) nem sempre a informam.
+    from ultralytics import YOLO
+    return YOLO(caminho, task='detect')
+
+
+def aquecer_yolo(modelo, imgsz=640, lote=1):
+    """
+    Executa uma predição com imagens pretas para inicializar o preditor
+    (criação do pipeline, fusão de camadas, alocação de buffers).
+    """
+    import numpy as np
+    imagens = [np.zeros((imgsz, imgsz, 3), dtype=np.uint8) for _ in range(lote)]
+    modelo.predict(source=imagens, imgsz=imgsz, verbose=False, save=False)
+
+
+class RegistroModelos:
+    """
+    Mantém um ``ModeloCarregado`` por nome lógico (ex.: 'fase_1', 'fase_2').
+    """
+    def __init__(self, carregar=carregar_yolo, aquecer=aquecer_yolo):
+        self._carregar = carregar
+        self._aquecer = aquecer
+        self._modelos = {}
+        self._lock = threading.Lock()
+        self._locks_nome = {}
+
+    def _lock_nome(self, nome):
+        with self._lock:
+            return self._locks_nome.setdefault(nome, threading.Lock())
+
+    def obter(self, nome, caminho, imgsz=640):
+        """
+        Retorna o handle do modelo, carregando-o apenas se ainda não estiver
+        em memória ou se o arquivo de pesos tiver mudado.
+        """
+        assinatura = _assinatura(caminho)
+        atual = self._modelos.get(nome)
+        if atual is not None and atual.assinatura == assinatura:
+            return atual
+
+        # Um lock por nome evita que duas sessões carreguem o mesmo modelo ao mesmo tempo.
+        with self._lock_nome(nome):
+            atual = self._modelos.get(nome)
+            if atual is not None and atual.assinatura == assinatura:
+                return atual
+
+            rss_antes = _rss_bytes()
+            inicio = time.perf_counter()
+            modelo = self._carregar(caminho)
+            tempo_carga = time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            if self._aquecer is not None:
+                self._aquecer(modelo, imgsz=imgsz)
+            tempo_aquecimento = time.perf_counter() - inicio
+
+            memoria = _bytes_parametros(modelo)
+            if memoria is None and rss_antes is not None:
+                memoria = max(_rss_bytes() - rss_antes, 0)
+
+            handle = ModeloCarregado(nome, caminho, modelo, assinatura, tempo_carga, tempo_aquecimento, memoria)
+            with self._lock:
+                self._modelos[nome] = handle
+            return handle
+
+    def descarregar(self, nome):
+        with self._lock:
+            self._modelos.pop(nome, None)
+
+    def estatisticas(self):
+        """
+        Lista com tempo de carga, aquecimento e memória de cada modelo carregado.
+        """
+        with self._lock:
+            return [m.estatisticas() for m in self._modelos.values()]
+
+
+_registro = None
+_registro_lock = threading.Lock()
+
+
+def registro_global():
+    """
+    Retorna o registro único do processo.
+    """
+    global _registro
+    with _registro_lock:
+        if _registro is None:
+            _registro = RegistroModelos()
+        return _registro
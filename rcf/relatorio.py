@@ -0,0 +1,187 @@
+"""
+Montagem do relatório a partir das detecções da fase 2.
+
+O nome de cada imagem carrega os metadados do levantamento, no formato
+``<LIM_sup> - <LIM_inf><Linha>_<Pátio>_<AAAAMMDD>_<KM>_<Metro>.jpg``. A
+extração é feita de uma vez sobre a coluna inteira (operações vetorizadas do
+pandas) em vez de um ``re.match`` por arquivo, o que importa quando há
+centenas de milhares de recortes.
+
+No pipeline em memória, a tabela de detecções traz também o que o nome do
+arquivo não guarda: confianças, caixas da fase 2, a caixa do trilho da
+fase 1 que contém cada detecção e a imagem de origem.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+PADRAO_NOME = (
+    r"^(?P<lim_sup>\d+)\s+-\s+(?P<lim_inf>\d+)\s*(?P<linha>[A-Z\d]+)_(?P<patio>[A-Za-z]+)"
+    r"_(?P<data>\d{8})_(?P<km>\d+)_(?P<metro>\d+)\.jpg$"
+)
+
+COLUNAS = ['LIM_sup', 'LIM_inf', 'Linha', 'Pátio', 'Ano', 'Mês', 'Dia', 'KM', 'Metro', 'Classificação']
+COLUNAS_DETECCAO = [
+    'id_deteccao', 'id_trilho', 'imagem', 'nome_recorte', 'indice_trilho', 'conf_trilho',
+    'x1_trilho', 'y1_trilho', 'x2_trilho', 'y2_trilho', 'conf', 'x1', 'y1', 'x2', 'y2',
+    'x1_imagem', 'y1_imagem', 'x2_imagem', 'y2_imagem', 'grupo',
+]
+COLUNAS_REJEITADOS = ['arquivo', 'Classificação', 'motivo']
+
+# Colunas numéricas extraídas do nome -> (grupo da expressão, tipo).
+INTEIROS_NOME = {
+    'LIM_sup': ('lim_sup', 'int32'),
+    'LIM_inf': ('lim_inf', 'int32'),
+    'KM': ('km', 'int32'),
+    'Metro': ('metro', 'int32'),
+}
+TIPOS_DATA = {'Ano': 'int16', 'Mês': 'int8', 'Dia': 'int8'}
+CATEGORICAS = ('Linha', 'Pátio', 'Classificação')
+
+MOTIVO_PADRAO = "não segue o padrão esperado"
+MOTIVO_DATA = "data inválida"
+MOTIVO_NUMERO = "número fora do intervalo suportado"
+
+
+def listar_recortes(diretorio_principal):
+    """
+    Percorre a árvore de recortes (``<classe>/<arquivo>``) e retorna as listas
+    de nomes de arquivo e de classificações (nome da pasta).
+    """
+    arquivos, classificacoes = [], []
+    for root, dirs, files in os.walk(diretorio_principal):
+        classe = os.path.basename(root)
+        arquivos.extend(files)
+        classificacoes.extend([classe] * len(files))
+    return arquivos, classificacoes
+
+
+def analisar_nomes(arquivos, classificacoes):
+    """
+    Extrai os metadados de uma coleção de nomes de recortes.
+
+    Retorna ``(df, rejeitados)``: ``df`` com uma linha por nome válido e tipos
+    compactos (categorias para Linha/Pátio/Classificação, inteiros pequenos
+    para as datas); ``rejeitados`` com o arquivo, a classificação e o motivo
+    de cada nome ignorado.
+    """
+    df, rejeitados = _analisar_nomes(arquivos, classificacoes)
+    return df.reset_index(drop=True), rejeitados.reset_index(drop=True)
+
+
+def _analisar_nomes(arquivos, classificacoes):
+    # Mantém o índice posicional da entrada, para juntar com outras colunas.
+    nomes = pd.Series(arquivos, dtype=str)
+    classes = pd.Series(classificacoes, dtype=str)
+    partes = nomes.str.extract(PADRAO_NOME)
+
+    casou = partes['lim_sup'].notna()
+    datas = pd.to_datetime(partes['data'], format='%Y%m%d', errors='coerce')
+    numeros = {}
+    numeros_ok = pd.Series(True, index=nomes.index)
+    for coluna, (grupo, tipo) in INTEIROS_NOME.items():
+        valores = pd.to_numeric(partes[grupo], errors='coerce')
+        numeros_ok &= valores.between(0, np.iinfo(tipo).max)
+        numeros[coluna] = (valores, tipo)
+
+    motivos = pd.Series(
+        np.select([~casou, datas.isna(), ~numeros_ok], [MOTIVO_PADRAO, MOTIVO_DATA, MOTIVO_NUMERO], default=''),
+        index=nomes.index,
+    )
+    validos = motivos == ''
+
+    df = pd.DataFrame({
+        'LIM_sup': numeros['LIM_sup'][0][validos].astype(numeros['LIM_sup'][1]),
+        'LIM_inf': numeros['LIM_inf'][0][validos].astype(numeros['LIM_inf'][1]),
+        'Linha': partes['linha'][validos],
+        'Pátio': partes['patio'][validos],
+        'Ano': datas[validos].dt.year.astype(TIPOS_DATA['Ano']),
+        'Mês': datas[validos].dt.month.astype(TIPOS_DATA['Mês']),
+        'Dia': datas[validos].dt.day.astype(TIPOS_DATA['Dia']),
+        'KM': numeros['KM'][0][validos].astype(numeros['KM'][1]),
+        'Metro': numeros['Metro'][0][validos].astype(numeros['Metro'][1]),
+        'Classificação': classes[validos],
+    }, columns=COLUNAS)
+    for coluna in CATEGORICAS:
+        df[coluna] = df[coluna].astype('category')
+
+    rejeitados = pd.DataFrame({
+        'arquivo': nomes[~validos],
+        'Classificação': classes[~validos],
+        'motivo': motivos[~validos],
+    }, columns=COLUNAS_REJEITADOS)
+    return df, rejeitados
+
+
+def chave_trilho(imagem, indice_trilho):
+    """
+    Identificador do recorte de trilho ``indice_trilho`` da imagem ``imagem``,
+    único na análise. É o que ``grupo`` guarda para o recorte representante.
+    """
+    return f"{imagem}#{indice_trilho}"
+
+
+def _caixas(deteccoes, chave):
+    # Caixas ausentes (repetições de um grupo) viram NaN.
+    return np.array(
+        [d[chave] if d[chave] is not None else (np.nan,) * 4 for d in deteccoes], dtype='float32'
+    ).reshape(len(deteccoes), 4)
+
+
+def tabela_deteccoes(deteccoes):
+    """
+    Tabela colunar com uma linha por detecção da fase 2 (dicts de
+    ``executar_duas_fases``), com os metadados do nome da imagem juntados.
+
+    Além das colunas de ``analisar_nomes``: ``id_deteccao``, ``id_trilho``
+    (recorte de trilho da fase 1, único por imagem e índice), ``imagem``,
+    ``nome_recorte``, ``indice_trilho``, ``conf_trilho``, a caixa do trilho
+    (``x1_trilho``...``y2_trilho``, na imagem), ``conf``, a caixa da
+    detecção no recorte (``x1``...``y2``) e na imagem (``x1_imagem``...) e
+    ``grupo``, o recorte representante (``chave_trilho``) quando a análise
+    agrupou os recortes repetidos (vazio sem agrupamento). As repetições trazem
+    a classe e a confiança das detecções do representante, com as caixas da
+    detecção (``x1``...``y2`` e ``x1_imagem``...) vazias; ``defeitos_distintos``
+    as descarta para contagens.
+
+    Retorna ``(df, rejeitados)`` como ``analisar_nomes``.
+    """
+    metadados, rejeitados = _analisar_nomes([d['arquivo'] for d in deteccoes], [d['classe'] for d in deteccoes])
+
+    imagens = pd.Series([d['imagem'] for d in deteccoes], dtype=str)
+    indices = pd.Series([d['indice_trilho'] for d in deteccoes], dtype='int16')
+    trilhos = _caixas(deteccoes, 'caixa_trilho')
+    caixas = _caixas(deteccoes, 'caixa')
+    # A caixa da fase 2 é relativa ao recorte; somando a origem do recorte obtém-se a posição na imagem.
+    na_imagem = caixas + np.tile(trilhos[:, :2], 2)
+
+    detalhes = pd.DataFrame({
+        'id_deteccao': np.arange(len(deteccoes), dtype='int64'),
+        'id_trilho': pd.Series(list(zip(imagens, indices)), dtype=object).factorize()[0],
+        'imagem': imagens.astype('category'),
+        'nome_recorte': pd.Series([d['nome_recorte'] for d in deteccoes], dtype=str),
+        'indice_trilho': indices,
+        'conf_trilho': pd.Series([d['conf_trilho'] for d in deteccoes], dtype='float32'),
+        'x1_trilho': trilhos[:, 0], 'y1_trilho': trilhos[:, 1], 'x2_trilho': trilhos[:, 2], 'y2_trilho': trilhos[:, 3],
+        'conf': pd.Series([d['conf'] for d in deteccoes], dtype='float32'),
+        'x1': caixas[:, 0], 'y1': caixas[:, 1], 'x2': caixas[:, 2], 'y2': caixas[:, 3],
+        'x1_imagem': na_imagem[:, 0], 'y1_imagem': na_imagem[:, 1],
+        'x2_imagem': na_imagem[:, 2], 'y2_imagem': na_imagem[:, 3],
+        'grupo': pd.Series([d.get('grupo') for d in deteccoes], dtype=object),
+    }, columns=COLUNAS_DETECCAO)
+    df = metadados.join(detalhes, how='left')
+    return df.reset_index(drop=True), rejeitados.reset_index(drop=True)
+
+
+def defeitos_distintos(df):
+    """
+    Linhas do relatório sem as repetições de um grupo de recortes (as que vêm
+    de um recorte diferente do representante ``grupo``); cada defeito visto em
+    vários quadros consecutivos conta uma vez.
+    """
+    if 'grupo' not in df.columns or df['grupo'].isna().all():
+        return df
+    # Mesma chave de ``chave_trilho``, montada sobre as colunas inteiras.
+    proprio = df['imagem'].astype(str) + '#' + df['indice_trilho'].astype('Int64').astype(str)
+    return df[df['grupo'].isna() | (df['grupo'] == proprio)]
@@ -0,0 +1,352 @@
+"""
+Fila local de análises em segundo plano.
+
+As tarefas ficam registradas em SQLite (estado, progresso, mensagens) e os
+arquivos de cada uma em ``<dir_tarefas>/<id>/``. Processos worker, separados
+do script do Streamlit, reservam as tarefas pendentes e executam a análise;
+o app só enfileira, acompanha o progresso e recupera o resultado pelo ID.
+Assim a análise sobrevive a reruns, a recarregamentos da página e ao
+fechamento do navegador.
+"""
+import contextlib
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+PENDENTE = 'pendente'
+EXECUTANDO = 'executando'
+CONCLUIDA = 'concluida'
+FALHOU = 'falhou'
+
+# Intervalos de atualização da mensagem de andamento e das detecções parciais gravadas em disco.
+INTERVALO_MENSAGEM_S = 5
+INTERVALO_PARCIAL_S = 30
+# Intervalo máximo entre heartbeats de uma tarefa em execução.
+INTERVALO_HEARTBEAT_S = 30
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS tarefas (
+    id TEXT PRIMARY KEY,
+    estado TEXT NOT NULL,
+    criada_em REAL NOT NULL,
+    iniciada_em REAL,
+    concluida_em REAL,
+    heartbeat REAL,
+    pid INTEGER,
+    parametros TEXT NOT NULL,
+    progresso REAL NOT NULL DEFAULT 0,
+    mensagem TEXT,
+    erro TEXT
+)
+"""
+
+
+class FilaTarefas:
+    """
+    Registro persistente das tarefas. Pode ser usado por vários processos ao
+    mesmo tempo; cada operação abre sua própria conexão.
+
+    - ``dir_tarefas``: diretório com o banco (``tarefas.db``) e os arquivos das tarefas.
+    - ``tempo_abandono_s``: tarefas em execução sem heartbeat há mais tempo que
+      isso voltam a ficar pendentes (o worker morreu). Enquanto o worker vive,
+      ``manter_viva`` renova o heartbeat em segundo plano.
+
+    As atualizações de uma tarefa em execução só valem para o processo que a
+    reservou: se ela tiver sido reenfileirada e reservada por outro worker, o
+    anterior não sobrescreve o estado.
+    """
+    def __init__(self, dir_tarefas, tempo_abandono_s=300):
+        self.dir_tarefas = dir_tarefas
+        self.tempo_abandono_s = tempo_abandono_s
+        os.makedirs(dir_tarefas, exist_ok=True)
+        self.caminho_db = os.path.join(dir_tarefas, 'tarefas.db')
+        with self._conectar() as conexao:
+            conexao.execute(ESQUEMA)
+
+    @contextlib.contextmanager
+    def _conectar(self):
+        # isolation_level=None: cada comando é confirmado na hora, exceto dentro de BEGIN explícito.
+        conexao = sqlite3.connect(self.caminho_db, timeout=30, isolation_level=None)
+        try:
+            conexao.row_factory = sqlite3.Row
+            conexao.execute('PRAGMA journal_mode=WAL')
+            yield conexao
+        finally:
+            conexao.close()
+
+    def dir_tarefa(self, id_tarefa):
+        return os.path.join(self.dir_tarefas, id_tarefa)
+
+    def enfileirar(self, arquivo_zip, parametros=None):
+        """
+        Copia o .zip (caminho ou objeto de arquivo) para o diretório da tarefa e
+        a registra como pendente. Retorna o ID da tarefa.
+        """
+        id_tarefa = uuid.uuid4().hex[:12]
+        destino = self.dir_tarefa(id_tarefa)
+        os.makedirs(destino)
+        caminho_zip = os.path.join(destino, 'upload.zip')
+        if isinstance(arquivo_zip, (str, os.PathLike)):
+            shutil.copyfile(arquivo_zip, caminho_zip)
+        else:
+            arquivo_zip.seek(0)
+            with open(caminho_zip, 'wb') as f:
+                shutil.copyfileobj(arquivo_zip, f)
+
+        with self._conectar() as conexao:
+            conexao.execute(
+                "INSERT INTO tarefas (id, estado, criada_em, parametros, mensagem) VALUES (?, ?, ?, ?, ?)",
+                (id_tarefa, PENDENTE, time.time(), json.dumps(parametros or {}), "Aguardando um worker livre."),
+            )
+        return id_tarefa
+
+    def obter(self, id_tarefa):
+        with self._conectar() as conexao:
+            linha = conexao.execute("SELECT * FROM tarefas WHERE id = ?", (id_tarefa,)).fetchone()
+        return dict(linha) if linha else None
+
+    def listar(self, ids=None, limite=50):
+        with self._conectar() as conexao:
+            if ids is not None:
+                marcadores = ','.join('?' * len(ids))
+                linhas = conexao.execute(
+                    f"SELECT * FROM tarefas WHERE id IN ({marcadores}) ORDER BY criada_em DESC", list(ids)
+                ).fetchall()
+            else:
+                linhas = conexao.execute("SELECT * FROM tarefas ORDER BY criada_em DESC LIMIT ?", (limite,)).fetchall()
+        return [dict(linha) for linha in linhas]
+
+    def reservar(self):
+        """
+        Reserva atomicamente a tarefa pendente mais antiga para este processo.
+        Retorna a tarefa ou None.
+        """
+        with self._conectar() as conexao:
+            id_tarefa = self._reservar(conexao, time.time())
+        return self.obter(id_tarefa) if id_tarefa else None
+
+    def _reservar(self, conexao, agora):
+        try:
+            conexao.execute("BEGIN IMMEDIATE")
+            conexao.execute(
+                "UPDATE tarefas SET estado = ?, mensagem = ? WHERE estado = ? AND heartbeat < ?",
+                (PENDENTE, "Worker anterior parou de responder; tarefa reenfileirada.", EXECUTANDO,
+                 agora - self.tempo_abandono_s),
+            )
+            linha = conexao.execute(
+                "SELECT * FROM tarefas WHERE estado = ? ORDER BY criada_em LIMIT 1", (PENDENTE,)
+            ).fetchone()
+            if linha is None:
+                conexao.execute("COMMIT")
+                return None
+            conexao.execute(
+                "UPDATE tarefas SET estado = ?, iniciada_em = ?, heartbeat = ?, pid = ?, progresso = 0, mensagem = ? WHERE id = ?",
+                (EXECUTANDO, agora, agora, os.getpid(), "Iniciando a análise.", linha['id']),
+            )
+            conexao.execute("COMMIT")
+        except BaseException:
+            conexao.execute("ROLLBACK")
+            raise
+        return linha['id']
+
+    def _atualizar_propria(self, comando, valores, id_tarefa):
+        # Só altera a tarefa se ela ainda estiver em execução por este processo.
+        with self._conectar() as conexao:
+            return conexao.execute(
+                f"{comando} WHERE id = ? AND pid = ? AND estado = ?", (*valores, id_tarefa, os.getpid(), EXECUTANDO)
+            ).rowcount > 0
+
+    def atualizar(self, id_tarefa, progresso=None, mensagem=None):
+        """
+        Registra o andamento e renova o heartbeat da tarefa. Retorna False se a
+        tarefa não estiver mais em execução por este processo.
+        """
+        return self._atualizar_propria(
+            "UPDATE tarefas SET heartbeat = ?, progresso = COALESCE(?, progresso), mensagem = COALESCE(?, mensagem)",
+            (time.time(), progresso, mensagem), id_tarefa,
+        )
+
+    def concluir(self, id_tarefa, mensagem):
+        return self._atualizar_propria(
+            "UPDATE tarefas SET estado = ?, concluida_em = ?, progresso = 1, mensagem = ?",
+            (CONCLUIDA, time.time(), mensagem), id_tarefa,
+        )
+
+    def falhar(self, id_tarefa, erro):
+        return self._atualizar_propria(
+            "UPDATE tarefas SET estado = ?, concluida_em = ?, mensagem = ?, erro = ?",
+            (FALHOU, time.time(), "A análise falhou.", erro), id_tarefa,
+        )
+
+    @contextlib.contextmanager
+    def manter_viva(self, id_tarefa, intervalo_s=None):
+        """
+        Renova o heartbeat da tarefa em uma thread enquanto o bloco ``with``
+        executa, inclusive nas etapas sem callbacks de andamento (download
+        dos modelos, exportação de backend, ajuste do lote, consulta ao cache).
+        """
+        intervalo_s = intervalo_s or min(INTERVALO_HEARTBEAT_S, self.tempo_abandono_s / 3)
+        parar = threading.Event()
+
+        def renovar():
+            while not parar.wait(intervalo_s):
+                try:
+                    if not self.atualizar(id_tarefa):
+                        return
+                except sqlite3.Error:
+                    continue
+
+        thread = threading.Thread(target=renovar, name=f"heartbeat-{id_tarefa}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            parar.set()
+            thread.join()
+
+    def salvar_resultado(self, id_tarefa, nome, dados):
+        """
+        Grava um arquivo JSON de resultado da tarefa (escrita atômica).
+        """
+        caminho = os.path.join(self.dir_tarefa(id_tarefa), nome)
+        temporario = caminho + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(dados, f, ensure_ascii=False)
+        os.replace(temporario, caminho)
+        return caminho
+
+    def carregar_resultado(self, id_tarefa, nome):
+        caminho = os.path.join(self.dir_tarefa(id_tarefa), nome)
+        if not os.path.exists(caminho):
+            return None
+        with open(caminho, encoding='utf-8') as f:
+            return json.load(f)
+
+
+# --- Workers ---
+def executar_tarefa(fila, tarefa, obter_modelos, cache=None, acervo=None):
+    """
+    Executa a análise de uma tarefa reservada. ``obter_modelos()`` retorna os
+    caminhos locais dos pesos da fase 1 e da fase 2; ``cache`` é o cache de
+    resultados e ``acervo`` o ``AcervoResultados`` onde o resultado é anexado,
+    usados se a tarefa os pedir. As métricas das etapas vão para
+    ``metricas.json`` (e o perfil do ``cProfile``, se pedido, para ``perfil.prof``).
+    """
+    from rcf.metricas import Metricas
+
+    metricas = Metricas(perfil=json.loads(tarefa['parametros']).get('perfil', False))
+    with metricas.capturar_perfil():
+        mensagem = _executar_analise(fila, tarefa, obter_modelos, cache, acervo, metricas)
+    fila.salvar_resultado(tarefa['id'], 'metricas.json', metricas.resumo())
+    metricas.salvar_perfil(os.path.join(fila.dir_tarefa(tarefa['id']), 'perfil.prof'))
+    return mensagem
+
+
+def _executar_analise(fila, tarefa, obter_modelos, cache, acervo, metricas):
+    from rcf.analise import analisar_zip, descrever_andamento
+    from rcf.inferencia import ConfigFase
+
+    id_tarefa = tarefa['id']
+    parametros = json.loads(tarefa['parametros'])
+    processos = parametros.get('processos', 1)
+    if not parametros.get('usar_cache', True):
+        cache = None
+    if multiprocessing.current_process().daemon:
+        # Processos daemon não podem criar filhos; o paralelismo vem do número de workers.
+        processos = 1
+    fila.atualizar(id_tarefa, 0.0, "Carregando os modelos.")
+    with metricas.etapa('download_modelos'):
+        path_modelo_f1, path_modelo_f2 = obter_modelos()
+
+    def ao_manifesto(itens, avisos):
+        fila.atualizar(id_tarefa, 0.0, f"{len(itens)} imagem(ns) encontrada(s). Executando a inferência.")
+
+    parciais = []
+    ultimo = {'mensagem': 0.0, 'parcial': time.monotonic()}
+
+    def ao_lote(andamento, deteccoes):
+        parciais.extend(deteccoes)
+        agora = time.monotonic()
+        if agora - ultimo['mensagem'] >= INTERVALO_MENSAGEM_S:
+            ultimo['mensagem'] = agora
+            fila.atualizar(id_tarefa, andamento.feitos / andamento.total, descrever_andamento(andamento))
+        if deteccoes and agora - ultimo['parcial'] >= INTERVALO_PARCIAL_S:
+            ultimo['parcial'] = agora
+            fila.salvar_resultado(id_tarefa, 'deteccoes_parciais.json', parciais)
+
+    resultado = analisar_zip(
+        path_modelo_f1, path_modelo_f2, os.path.join(fila.dir_tarefa(id_tarefa), 'upload.zip'),
+        ConfigFase(**parametros.get('config_f1', {})), ConfigFase(**parametros.get('config_f2', {})),
+        processos=processos, ao_manifesto=ao_manifesto, cache=cache, ao_lote=ao_lote,
+        metricas=metricas,
+    )
+    avisos = resultado.avisos + [erro.descrever_erro() for erro in resultado.erros]
+    fila.salvar_resultado(id_tarefa, 'deteccoes.json', resultado.deteccoes)
+    fila.salvar_resultado(id_tarefa, 'avisos.json', avisos)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(fila.dir_tarefa(id_tarefa), 'deteccoes_parciais.json'))
+    if acervo is not None and parametros.get('gravar_acervo', True):
+        from rcf.relatorio import tabela_deteccoes
+        with metricas.etapa('relatorio', imagens=len(resultado.manifesto)):
+            df = tabela_deteccoes(resultado.deteccoes)[0]
+        with metricas.etapa('acervo'):
+            acervo.anexar(df, id_tarefa)
+    if resultado.total_trilhos == 0:
+        return "Aviso: Nenhuma detecção de trilho na Fase 1. Não é possível executar a Fase 2."
+    return f"Inferência concluída: {len(resultado.manifesto)} imagem(ns), {len(resultado.deteccoes)} detecção(ões)."
+
+
+@contextlib.contextmanager
+def _modelos_em_uso(cache, model_ids):
+    # Mantém referências aos pesos para que a limpeza do cache não os remova durante a tarefa.
+    with contextlib.ExitStack() as pilha:
+        yield tuple(pilha.enter_context(cache.usar(model_id)) for model_id in model_ids)
+
+
+def laco_worker(dir_tarefas, dir_cache, fonte, model_ids, intervalo_s=2.0, caminho_cache_resultados=None,
+                dir_acervo=None):
+    """
+    Laço de um processo worker: reserva e executa tarefas até ser encerrado.
+    """
+    from rcf.acervo import AcervoResultados
+    from rcf.cache_resultados import CacheResultados
+    from rcf.modelos import CacheModelos, fonte_por_uri
+    fila = FilaTarefas(dir_tarefas)
+    cache = CacheModelos(dir_cache, fonte_por_uri(fonte))
+    cache_resultados = CacheResultados(caminho_cache_resultados) if caminho_cache_resultados else None
+    acervo = AcervoResultados(dir_acervo) if dir_acervo else None
+    while True:
+        tarefa = fila.reservar()
+        if tarefa is None:
+            time.sleep(intervalo_s)
+            continue
+        with fila.manter_viva(tarefa['id']):
+            try:
+                with _modelos_em_uso(cache, model_ids) as caminhos:
+                    mensagem = executar_tarefa(fila, tarefa, lambda: caminhos, cache_resultados, acervo)
+                fila.concluir(tarefa['id'], mensagem)
+            except Exception as e:
+                fila.falhar(tarefa['id'], f"{e}\n{traceback.format_exc()}")
+
+
+def iniciar_workers(quantidade, dir_tarefas, dir_cache, fonte, model_ids, contexto='spawn', caminho_cache_resultados=None,
+                    dir_acervo=None):
+    """
+    Inicia ``quantidade`` processos worker em segundo plano e os retorna.
+    """
+    ctx = multiprocessing.get_context(contexto)
+    workers = []
+    for _ in range(quantidade):
+        processo = ctx.Process(
+            target=laco_worker, args=(dir_tarefas, dir_cache, fonte, tuple(model_ids)),
+            kwargs={'caminho_cache_resultados': caminho_cache_resultados, 'dir_acervo': dir_acervo}, daemon=True,
+        )
+        processo.start()
+        workers.append(processo)
+    return workers
@@ -0,0 +1,138 @@
+"""
+Diretórios de trabalho isolados por análise.
+
+Cada análise recebe um diretório próprio (``<raiz>/riv-<id>``), de preferência
+em tmpfs (``/dev/shm``) quando há espaço, em vez do ``temp_data`` global que
+era apagado no início de cada execução. Um arquivo de vida com o PID e o
+horário do último sinal, renovado por uma thread enquanto o diretório está em
+uso, permite que o coletor remova diretórios abandonados (processo morto ou
+sessão que caiu) sem tocar nos que estão em uso.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+PREFIXO = 'riv-'
+ARQUIVO_VIDA = '.vivo'
+DIR_TMPFS = '/dev/shm'
+# Diretórios com o arquivo de vida parado há mais que IDADE_MAX_S são
+# abandonados, mesmo com o processo dono vivo (sessão do Streamlit que caiu).
+IDADE_MAX_S = 6 * 3600
+INTERVALO_SINAL_S = 60
+
+
+def processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def espaco_livre(caminho):
+    try:
+        info = os.statvfs(caminho)
+    except (OSError, AttributeError):
+        return 0
+    return info.f_bavail * info.f_frsize
+
+
+def escolher_raiz(bytes_estimados=0, raiz_disco=None, usar_tmpfs=True, margem=2.0):
+    """
+    Usa tmpfs se ele existir e tiver ao menos ``margem`` vezes o espaço estimado;
+    caso contrário, o diretório temporário em disco.
+    """
+    raiz_disco = raiz_disco or tempfile.gettempdir()
+    if usar_tmpfs and os.path.isdir(DIR_TMPFS) and os.access(DIR_TMPFS, os.W_OK):
+        if espaco_livre(DIR_TMPFS) >= bytes_estimados * margem:
+            return DIR_TMPFS
+    return raiz_disco
+
+
+class DiretorioTrabalho:
+    """
+    Diretório exclusivo de uma análise; removido ao sair do bloco ``with``.
+
+    - ``bytes_estimados``: espaço que a análise deve ocupar, para decidir se cabe em tmpfs.
+    - ``raiz``: força a raiz (desativa a escolha automática).
+    - ``intervalo_s``: período de renovação do arquivo de vida dentro do bloco ``with``.
+    """
+    def __init__(self, bytes_estimados=0, raiz=None, raiz_disco=None, usar_tmpfs=True, intervalo_s=INTERVALO_SINAL_S):
+        self.raiz = raiz or escolher_raiz(bytes_estimados, raiz_disco, usar_tmpfs)
+        self.id = uuid.uuid4().hex[:12]
+        self.caminho = os.path.join(self.raiz, f"{PREFIXO}{self.id}")
+        self.intervalo_s = intervalo_s
+        self._parar = None
+        self._thread = None
+
+    def __enter__(self):
+        os.makedirs(self.caminho)
+        self.sinalizar()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._renovar, args=(self._parar,), name=f"vida-{self.id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+        self.remover()
+        return False
+
+    def _renovar(self, parar):
+        while not parar.wait(self.intervalo_s):
+            try:
+                self.sinalizar()
+            except OSError:
+                continue
+
+    def sinalizar(self):
+        """
+        Renova o arquivo de vida; dentro do bloco ``with`` uma thread o chama
+        a cada ``intervalo_s``.
+        """
+        with open(os.path.join(self.caminho, ARQUIVO_VIDA), 'w') as f:
+            f.write(str(os.getpid()))
+
+    def subdiretorio(self, *partes):
+        caminho = os.path.join(self.caminho, *partes)
+        os.makedirs(caminho, exist_ok=True)
+        return caminho
+
+    def remover(self):
+        shutil.rmtree(self.caminho, ignore_errors=True)
+
+
+def coletar_abandonados(raizes, idade_max_s=IDADE_MAX_S):
+    """
+    Remove diretórios de trabalho cujo processo dono morreu ou cujo arquivo de
+    vida não é renovado há mais de ``idade_max_s`` (um diretório em uso é
+    renovado a cada ``intervalo_s``). Retorna os removidos.
+    """
+    removidos = []
+    agora = time.time()
+    for raiz in raizes:
+        if not os.path.isdir(raiz):
+            continue
+        for nome in os.listdir(raiz):
+            caminho = os.path.join(raiz, nome)
+            if not nome.startswith(PREFIXO) or not os.path.isdir(caminho):
+                continue
+            vida = os.path.join(caminho, ARQUIVO_VIDA)
+            try:
+                with open(vida) as f:
+                    pid = int(f.read().strip() or 0)
+                idade = agora - os.path.getmtime(vida)
+            except (OSError, ValueError):
+                pid, idade = 0, agora - os.path.getmtime(caminho)
+            if (pid and not processo_vivo(pid)) or idade > idade_max_s:
+                shutil.rmtree(caminho, ignore_errors=True)
+                removidos.append(caminho)
+    return removidos
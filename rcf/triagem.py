@@ -0,0 +1,119 @@
+"""
+Avaliação da triagem da fase 1 sobre uma amostra.
+
+A triagem (``ConfigFase.triagem``, ``rcf.pipeline.triar``) roda o modelo da
+fase 1 em baixa resolução e descarta as imagens sem candidatos a trilho
+antes da passada em resolução cheia. Uma imagem com trilho descartada perde
+todas as suas detecções, então a triagem só deve ser ligada com a perda
+medida. A referência é um CSV de rótulos (colunas ``arquivo`` e ``trilho``,
+com 1/0) ou, sem rótulos, a própria fase 1 em resolução cheia::
+
+    python -m rcf.triagem amostra.zip --modelo-f1 f1.pt --triagem 320 --rotulos rotulos.csv
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+VERDADEIROS = ('1', 'sim', 's', 'true', 'verdadeiro', 'x')
+
+
+def ler_rotulos(caminho):
+    """
+    Lê um CSV com as colunas ``arquivo`` e ``trilho``; retorna ``{nome do arquivo: tem trilho}``.
+    """
+    with open(caminho, newline='', encoding='utf-8') as f:
+        return {
+            os.path.basename(linha['arquivo']): linha['trilho'].strip().lower() in VERDADEIROS
+            for linha in csv.DictReader(f)
+        }
+
+
+def avaliar_triagem(path_modelo_f1, origem, config, rotulos=None, limite=None, classe_trilho=None):
+    """
+    Roda a triagem configurada em ``config`` (``ConfigFase`` da fase 1) e a
+    fase 1 completa sobre as primeiras ``limite`` imagens de ``origem``.
+
+    Retorna um dict com a taxa de descarte, as imagens com trilho perdidas
+    (``perda_recall`` = perdidas / com trilho), os tempos das duas passadas e
+    o tempo estimado da fase 1 com a triagem na frente. ``rotulos`` (como os
+    de ``ler_rotulos``) são a referência; sem eles, vale a fase 1 completa.
+    Imagens sem rótulo ficam fora das contagens.
+    """
+    from rcf.backends import caminho_backend
+    from rcf.ingestao import carregar_amostra
+    from rcf.pipeline import CLASSE_TRILHO, tem_trilho, triar
+    from rcf.registro import registro_global
+
+    classe_trilho = classe_trilho or CLASSE_TRILHO
+    imagens = carregar_amostra(origem, limite)
+    modelo = registro_global().obter('fase_1', caminho_backend(path_modelo_f1, config), imgsz=config.imgsz)
+
+    inicio = time.perf_counter()
+    completa = {}
+    for indice in range(0, len(imagens), config.lote):
+        lote = imagens[indice:indice + config.lote]
+        resultados = modelo.predict(source=[imagem for _, imagem in lote], save=False, **config.kwargs_predict())
+        completa.update((nome, tem_trilho(resultado, classe_trilho)) for (nome, _), resultado in zip(lote, resultados))
+    tempo_completo = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    descartadas = []
+    for _ in triar(modelo, imagens, config, classe_trilho, descartadas=descartadas):
+        pass
+    tempo_triagem = time.perf_counter() - inicio
+
+    if rotulos is None:
+        referencia = completa
+    else:
+        referencia = {nome: rotulos[os.path.basename(nome)] for nome, _ in imagens if os.path.basename(nome) in rotulos}
+    descartadas = set(descartadas)
+    com_trilho = [nome for nome, positivo in referencia.items() if positivo]
+    perdidas = sorted(nome for nome in com_trilho if nome in descartadas)
+    taxa_descarte = len(descartadas) / len(imagens) if imagens else 0.0
+    return {
+        'imagens': len(imagens),
+        'referencia': 'fase_1' if rotulos is None else 'rotulos',
+        'avaliadas': len(referencia),
+        'descartadas': len(descartadas),
+        'taxa_descarte': taxa_descarte,
+        'com_trilho': len(com_trilho),
+        'perdidas': len(perdidas),
+        'perda_recall': len(perdidas) / len(com_trilho) if com_trilho else 0.0,
+        'tempo_triagem_s': tempo_triagem,
+        'tempo_fase_1_s': tempo_completo,
+        'tempo_estimado_com_triagem_s': tempo_triagem + tempo_completo * (1 - taxa_descarte),
+        'exemplos_perdidos': perdidas[:20],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mede o descarte e a perda de recall da triagem da fase 1.")
+    parser.add_argument('origem', help="Amostra: .zip ou diretório com imagens.")
+    parser.add_argument('--modelo-f1', required=True)
+    parser.add_argument('--triagem', type=int, default=320, help="Tamanho de entrada da triagem.")
+    parser.add_argument('--conf-triagem', type=float, default=None)
+    parser.add_argument('--imgsz', type=int, default=640, help="Tamanho de entrada da fase 1 completa.")
+    parser.add_argument('--lote', type=int, default=16)
+    parser.add_argument('--backend', choices=('pytorch', 'onnx', 'openvino'), default='pytorch')
+    parser.add_argument('--rotulos', help="CSV com as colunas 'arquivo' e 'trilho' (1/0).")
+    parser.add_argument('--limite', type=int, default=500, help="Imagens da amostra.")
+    parser.add_argument('--perda-maxima', type=float, default=None,
+                        help="Sai com código 1 se a perda de recall passar desta fração.")
+    args = parser.parse_args(argv)
+
+    from rcf.inferencia import CONF_TRIAGEM, ConfigFase
+    config = ConfigFase(args.lote, args.imgsz, backend=args.backend, triagem=args.triagem,
+                        conf_triagem=args.conf_triagem if args.conf_triagem is not None else CONF_TRIAGEM)
+    rotulos = ler_rotulos(args.rotulos) if args.rotulos else None
+    avaliacao = avaliar_triagem(args.modelo_f1, args.origem, config, rotulos, args.limite)
+    for chave, valor in avaliacao.items():
+        print(f"{chave}: {valor}")
+    if args.perda_maxima is not None and avaliacao['perda_recall'] > args.perda_maxima:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
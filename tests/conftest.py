@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os testes importam ``rcf`` a partir da raiz do repositório, rodando ``pytest`` de qualquer diretório.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
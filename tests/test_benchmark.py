@@ -0,0 +1,37 @@
+"""
+Execução isolada do benchmark: o cenário roda em um processo que pode abrir
+os próprios processos de inferência.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+
+import pytest
+
+from rcf.benchmark import executar_benchmark, executar_isolado
+
+
+def _quadrado(numero):
+    return numero * numero
+
+
+def _abrir_processos(processos):
+    # Como ``executar_paralelo``: um ProcessPoolExecutor dentro do cenário.
+    contexto = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(processos, mp_context=contexto) as pool:
+        return multiprocessing.current_process().daemon, sorted(pool.map(_quadrado, range(processos * 2)))
+
+
+def test_processo_isolado_pode_ter_filhos():
+    daemon, quadrados = executar_isolado(_abrir_processos, 2)
+    assert not daemon
+    assert quadrados == [0, 1, 4, 9]
+
+
+def test_benchmark_isolado_com_varios_processos(tmp_path):
+    pytest.importorskip('ultralytics')
+    relatorio = executar_benchmark(tamanhos=(4,), diretorio=str(tmp_path), processos=2, largura=320, altura=240)
+    cenario, = relatorio['cenarios']
+    assert cenario['processos'] == 2
+    assert cenario['imagens'] == 4
+    assert os.path.isdir(os.path.join(str(tmp_path), 'pesos'))
@@ -0,0 +1,212 @@
+"""
+Vários processos e threads sobre os mesmos diretórios de trabalho e o mesmo
+cache de modelos: diretórios isolados, referências que impedem a remoção de
+pesos em uso e coleta só dos diretórios de processos mortos ou parados.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from rcf.modelos import CacheModelos, FonteDiretorioLocal, calcular_sha256
+from rcf.trabalho import ARQUIVO_VIDA, DiretorioTrabalho, coletar_abandonados
+
+PROCESSOS = 4
+THREADS = 8
+RODADAS = 20
+MODELO = 'modelo'
+
+_contexto = multiprocessing.get_context('spawn')
+
+
+def _usar_diretorios(raiz, rodadas=RODADAS):
+    # Cada diretório só pode conter o que o próprio dono escreveu.
+    vistos = []
+    for _ in range(rodadas):
+        with DiretorioTrabalho(raiz=raiz) as trabalho:
+            marca = os.path.join(trabalho.subdiretorio('saida'), 'marca.txt')
+            with open(marca, 'w') as f:
+                f.write(trabalho.id)
+            time.sleep(0.001)
+            with open(marca) as f:
+                lido = f.read()
+            vistos.append((trabalho.caminho, lido == trabalho.id, sorted(os.listdir(trabalho.caminho))))
+    return vistos
+
+
+def _segurar_diretorio(raiz, fila, liberar):
+    with DiretorioTrabalho(raiz=raiz) as trabalho:
+        fila.put(trabalho.caminho)
+        liberar.wait(60)
+
+
+def _abandonar_diretorio(raiz, fila):
+    trabalho = DiretorioTrabalho(raiz=raiz).__enter__()
+    fila.put(trabalho.caminho)
+    fila.close()
+    fila.join_thread()
+    # Sai sem remover o diretório, como um processo que caiu.
+    os._exit(0)
+
+
+def _segurar_modelo(raiz, fonte, fila, liberar):
+    cache = CacheModelos(raiz, fonte=FonteDiretorioLocal(fonte), limite_bytes=1)
+    with cache.usar(MODELO) as caminho:
+        fila.put(caminho)
+        intacto = True
+        while not liberar.wait(0.01):
+            intacto = intacto and os.path.isfile(caminho)
+        fila.put(intacto and calcular_sha256(caminho) == os.path.basename(caminho)[:-len('.pt')])
+
+
+def _pid_dono(caminho):
+    with open(os.path.join(caminho, ARQUIVO_VIDA)) as f:
+        return int(f.read())
+
+
+def _publicar(fonte, conteudo):
+    with open(os.path.join(fonte, MODELO), 'wb') as f:
+        f.write(conteudo)
+
+
+@pytest.fixture
+def fonte(tmp_path):
+    diretorio = tmp_path / 'fonte'
+    diretorio.mkdir()
+    _publicar(str(diretorio), b'pesos v1')
+    return str(diretorio)
+
+
+@pytest.mark.parametrize('executor', ['processos', 'threads'])
+def test_diretorios_de_trabalho_isolados(tmp_path, executor):
+    raiz = str(tmp_path)
+    if executor == 'processos':
+        pool = concurrent.futures.ProcessPoolExecutor(PROCESSOS, mp_context=_contexto)
+        quantidade = PROCESSOS
+    else:
+        pool = concurrent.futures.ThreadPoolExecutor(THREADS)
+        quantidade = THREADS
+    with pool:
+        vistos = [item for futuro in [pool.submit(_usar_diretorios, raiz) for _ in range(quantidade)]
+                  for item in futuro.result()]
+
+    caminhos = [caminho for caminho, _, _ in vistos]
+    assert len(set(caminhos)) == len(caminhos) == quantidade * RODADAS
+    assert all(proprio for _, proprio, _ in vistos)
+    assert all(conteudo == sorted([ARQUIVO_VIDA, 'saida']) for _, _, conteudo in vistos)
+    assert os.listdir(raiz) == []
+
+
+def test_referencia_impede_remocao_de_pesos_em_uso(tmp_path, fonte):
+    raiz = str(tmp_path / 'cache')
+    fila, liberar = _contexto.Queue(), _contexto.Event()
+    donos = [_contexto.Process(target=_segurar_modelo, args=(raiz, fonte, fila, liberar)) for _ in range(PROCESSOS)]
+    for dono in donos:
+        dono.start()
+    try:
+        em_uso = {fila.get(timeout=60) for _ in donos}
+        assert len(em_uso) == 1
+        antigo = em_uso.pop()
+
+        # Versões novas publicadas com o cache acima do limite: só a referência protege a antiga.
+        cache = CacheModelos(raiz, fonte=FonteDiretorioLocal(fonte), limite_bytes=1)
+        for versao in range(2, 6):
+            _publicar(fonte, f'pesos v{versao}'.encode())
+            novo = cache.atualizar(MODELO)
+            cache.limpar()
+            assert os.path.isfile(antigo)
+            assert os.path.isfile(novo)
+    finally:
+        liberar.set()
+    assert all(fila.get(timeout=60) for _ in donos)
+    for dono in donos:
+        dono.join(60)
+
+    # Sem referências vivas, a versão antiga é a primeira a sair.
+    cache.limpar()
+    assert not os.path.exists(antigo)
+    assert os.path.isfile(novo)
+
+
+def test_referencia_de_processo_morto_nao_protege(tmp_path, fonte):
+    cache = CacheModelos(str(tmp_path / 'cache'), fonte=FonteDiretorioLocal(fonte), limite_bytes=1)
+    antigo = cache.obter(MODELO)
+    sha = os.path.basename(antigo)[:-len('.pt')]
+    morto = _contexto.Process(target=os._exit, args=(0,))
+    morto.start()
+    morto.join(60)
+    open(os.path.join(os.path.dirname(antigo), f".ref-{sha}-{morto.pid}-abandonada"), 'w').close()
+
+    _publicar(fonte, b'pesos v2')
+    cache.atualizar(MODELO)
+    assert not os.path.exists(antigo)
+    assert not [nome for nome in os.listdir(os.path.dirname(antigo)) if nome.startswith('.ref-')]
+
+
+def test_threads_usando_o_cache_com_limpeza_concorrente(tmp_path, fonte):
+    cache = CacheModelos(str(tmp_path / 'cache'), fonte=FonteDiretorioLocal(fonte), limite_bytes=1)
+
+    def usar(indice):
+        with cache.usar(MODELO) as caminho:
+            time.sleep(0.005)
+            cache.limpar()
+            return os.path.isfile(caminho)
+
+    def publicar():
+        for versao in range(2, 2 + RODADAS):
+            _publicar(fonte, f'pesos v{versao}'.encode())
+            cache.atualizar(MODELO)
+
+    with concurrent.futures.ThreadPoolExecutor(THREADS) as pool:
+        publicador = pool.submit(publicar)
+        usos = [pool.submit(usar, i) for i in range(THREADS * RODADAS)]
+        publicador.result()
+        assert all(uso.result() for uso in usos)
+
+
+def test_coleta_so_diretorios_de_processos_mortos(tmp_path):
+    raiz = str(tmp_path)
+    fila, liberar = _contexto.Queue(), _contexto.Event()
+    vivos = [_contexto.Process(target=_segurar_diretorio, args=(raiz, fila, liberar)) for _ in range(PROCESSOS)]
+    mortos = [_contexto.Process(target=_abandonar_diretorio, args=(raiz, fila)) for _ in range(PROCESSOS)]
+    for processo in vivos + mortos:
+        processo.start()
+    try:
+        caminhos = {fila.get(timeout=60) for _ in vivos + mortos}
+        for processo in mortos:
+            processo.join(60)
+        pids_mortos = {processo.pid for processo in mortos}
+        abandonados = {caminho for caminho in caminhos if _pid_dono(caminho) in pids_mortos}
+        with DiretorioTrabalho(raiz=raiz) as proprio:
+            removidos = set(coletar_abandonados([raiz]))
+            assert removidos == abandonados
+            assert len(removidos) == PROCESSOS
+            assert os.path.isdir(proprio.caminho)
+            assert all(os.path.isdir(caminho) for caminho in caminhos - abandonados)
+    finally:
+        liberar.set()
+        for processo in vivos:
+            processo.join(60)
+    assert os.listdir(raiz) == []
+
+
+def test_diretorio_em_uso_sobrevive_ao_limite_de_idade(tmp_path):
+    raiz = str(tmp_path)
+    with DiretorioTrabalho(raiz=raiz, intervalo_s=0.05) as trabalho:
+        # Criado há mais que o limite; só o arquivo de vida renovado o mantém.
+        antigo = time.time() - 3600
+        for caminho in (trabalho.caminho, os.path.join(trabalho.caminho, ARQUIVO_VIDA)):
+            os.utime(caminho, (antigo, antigo))
+        time.sleep(0.5)
+        assert coletar_abandonados([raiz], idade_max_s=0.3) == []
+        assert os.path.isdir(trabalho.caminho)
+
+    # Arquivo de vida parado além do limite, com o processo dono vivo: abandonado.
+    parado = DiretorioTrabalho(raiz=raiz, intervalo_s=3600).__enter__()
+    antigo = time.time() - 3600
+    os.utime(os.path.join(parado.caminho, ARQUIVO_VIDA), (antigo, antigo))
+    assert coletar_abandonados([raiz], idade_max_s=0.3) == [parado.caminho]
+    parado.__exit__(None, None, None)
+    assert os.listdir(raiz) == []